@@ -0,0 +1,191 @@
+"""
+Журнал доступа: одна короткая строка на каждый обработанный запрос
+
+Строка содержит время, адрес клиента, метод, путь, ключ файла, статус
+код, количество отправленных байт и время обработки в миллисекундах,
+поля разделены пробелами (пустое поле - '-'):
+
+2026-10-18T12:00:00.123 ::1 GET / d41d8cd98f00b204e9800998ecf8427e 200 0 3.214
+
+Ключ md5 - это просто шестнадцатеричный хэш, у других алгоритмов
+ключ вида <алгоритм>-<хэш> (file_hashing.make_hash_key)
+
+Поток, обработавший запрос, только кладет поля в очередь; строки
+формирует и записывает в файл фоновый поток, пачками до MAX_BATCH строк
+за один вызов write. Если запись не успевает за запросами и очередь
+заполнена, строки отбрасываются (счетчик dropped), а обработка запросов
+не замедляется.
+
+Содержимое запросов (заголовки и тело) выводится в отладочный журнал
+только если это явно включено (dump_payloads)
+"""
+import os
+import time
+import queue
+import atexit
+import threading
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+from loguru import logger
+
+ACCESS_LOG_FILE = './log/access.log'
+# Сколько строк записывается за один вызов write
+MAX_BATCH: int = 1024
+# Сколько строк может ждать записи, остальные отбрасываются
+MAX_QUEUE: int = 65536
+# Как долго фоновый поток копит строки перед записью (секунды)
+FLUSH_INTERVAL: float = 0.5
+
+# Поля строки: время (time.time), клиент, метод, путь, ключ, статус,
+# байты, длительность (секунды)
+AccessRecord = Tuple[float, str, str, str, str, int, int, float]
+
+
+def format_record(record: AccessRecord) -> str:
+    """
+    Строка журнала доступа по полям запроса
+    """
+    logged, client, method, path, key, status, sent, duration = record
+    return '{}.{:03d} {} {} {} {} {} {} {:.3f}\n'.format(
+        time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(logged)),
+        int(logged * 1000) % 1000, client or '-', method, log_field(path),
+        log_field(key), status, sent, duration * 1000)
+
+
+def log_field(value: str) -> str:
+    """
+    Поле строки без пробелов и переводов строки (percent-encoding)
+    """
+    return quote(value, safe='/:,=@+') if value else '-'
+
+
+class AccessLog:
+    """
+    Журнал доступа с фоновой записью в файл
+
+    Поток записи запускается при первой строке в каждом процессе (после
+    fork потоки родителя не работают)
+    """
+
+    def __init__(self, path: str = ACCESS_LOG_FILE,
+                 max_queue: int = MAX_QUEUE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._queue: Optional[queue.Queue] = None
+        self._pid = 0
+        self._lock = threading.Lock()
+
+    def submit(self, record: AccessRecord):
+        """
+        Ставим строку в очередь на запись, не дожидаясь записи
+        """
+        records = self._queue
+        if records is None or self._pid != os.getpid():
+            records = self._start()
+        try:
+            records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Ждем, пока все строки из очереди будут записаны
+        """
+        if self._queue is None or self._pid != os.getpid():
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики для GET /stats
+        """
+        return {'queued': self._queue.qsize() if self._queue else 0,
+                'written': self.written, 'dropped': self.dropped}
+
+    def _start(self) -> queue.Queue:
+        with self._lock:
+            if self._queue is None or self._pid != os.getpid():
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                records: queue.Queue = queue.Queue(self.max_queue)
+                threading.Thread(target=self._run, args=(records,),
+                                 daemon=True).start()
+                self._queue = records
+                self._pid = os.getpid()
+            return self._queue
+
+    def _run(self, records: queue.Queue):
+        # O_APPEND: строки процессов prefork не перезаписывают друг друга
+        with open(self.path, 'a', buffering=1024 * 1024) as log_file:
+            while True:
+                batch: List[str] = []
+                waiters = []
+                item = records.get()
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                        break
+                    batch.append(format_record(item))
+                    if len(batch) >= MAX_BATCH:
+                        break
+                    try:
+                        item = records.get(timeout=max(
+                            0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                try:
+                    log_file.write(''.join(batch))
+                    log_file.flush()
+                    self.written += len(batch)
+                except OSError as write_error:  # поток не должен упасть
+                    self.dropped += len(batch)
+                    logger.error("Access log was not written: {}",
+                                 write_error)
+                for waiter in waiters:
+                    waiter.set()
+
+
+_access_log: Optional[AccessLog] = None
+_dump_payloads = False
+
+
+def enable_access_log(path: str = ACCESS_LOG_FILE,
+                      dump_payloads: bool = False) -> Optional[AccessLog]:
+    """
+    Включаем журнал доступа (пустой path - журнал не ведется) и вывод
+    содержимого запросов в отладочный журнал
+    """
+    global _access_log, _dump_payloads  # pylint: disable=global-statement
+    _dump_payloads = dump_payloads
+    _access_log = AccessLog(path) if path else None
+    if _access_log is not None:
+        atexit.register(_access_log.flush, FLUSH_INTERVAL * 2)
+    return _access_log
+
+
+def dumps_payloads() -> bool:
+    """
+    Нужно ли выводить заголовки и тело запросов в отладочный журнал
+    """
+    return _dump_payloads
+
+
+def log_request(client: str, method: str, path: str, key: str,
+                status: int, sent: int, duration: float):
+    """
+    Записываем запрос в журнал доступа, если он включен
+    """
+    if _access_log is not None and status:
+        _access_log.submit((time.time(), client, method, path, key, status,
+                            sent, duration))
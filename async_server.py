@@ -0,0 +1,441 @@
+#!/usr/bin/python3.8
+# -*- coding: UTF-8 -*-
+"""
+Модуль с реализацией http-сервера на asyncio (engine='asyncio')
+
+Один процесс и один поток держат любое количество подключений: запрос
+читается из asyncio.StreamReader, а тело запроса и файл для скачивания
+передаются по частям асинхронными версиями обработчиков post_handler и
+get_handler. Разбор и проверка запроса общие с синхронным server.py
+"""
+import json
+import time
+import socket
+import asyncio
+import threading
+from functools import partial
+from typing import Dict, Optional, Tuple
+from loguru import logger
+import post_handler as post
+import get_handler as get
+import delete_handler
+import batch_handler as batch
+import engines
+import file_hashing
+import file_index
+import compression
+import metrics
+import profiling
+import graceful
+import server
+from stat_cache import get_stat_cache
+from read_cache import get_read_cache
+from pack_store import enable_packing
+from volumes import DEFAULT_PLACEMENT, enable_volumes
+from http_parser import HEAD_END, MAX_HEAD_SIZE, HttpParseError, \
+    HttpRequest, RequestParser
+
+
+def run_async_server(hostname_ipv4: str = '0.0.0.0', host_port: int = 9000,
+                     waiting_clients: int = 5,
+                     max_buffer_size: int = 4096,
+                     keepalive_timeout: float = server.KEEPALIVE_TIMEOUT,
+                     max_requests: int = server.MAX_KEEPALIVE_REQUESTS,
+                     request_timeout: float = server.REQUEST_TIMEOUT,
+                     hash_algorithm: str = file_hashing.DEFAULT_ALGORITHM,
+                     compress: Tuple[str, ...] = (),
+                     pack_max_size: int = 0,
+                     volume_dirs: Tuple[str, ...] = (),
+                     placement: str = DEFAULT_PLACEMENT,
+                     access_log_path: str = '',
+                     dump_payloads: bool = False,
+                     profile_seconds: float =
+                     profiling.DEFAULT_PROFILE_SECONDS
+                     ) -> socket.socket:
+    """
+    Функция для запуска asyncio-сервера, аналог server.run_server
+    """
+    file_hashing.set_algorithm(hash_algorithm)
+    server.enable_request_logging(access_log_path, dump_payloads)
+    profiling.enable_profiling(profile_seconds)
+    volumes = enable_volumes(server.STORAGE_DIR, volume_dirs, placement)
+    # Удаляем временные файлы загрузок, прерванных прошлым запуском
+    for volume_dir in volumes.volumes:
+        post.sweep_staging_files(volume_dir)
+    if compress:
+        compressor = compression.enable_background_compression(
+            server.STORAGE_DIR, compress, post.create_staging_file)
+        server.register_stats_provider('compression', compressor.stats)
+    server.register_stats_provider(
+        'packs', enable_packing(server.STORAGE_DIR, pack_max_size).stats)
+    server.register_stats_provider(
+        'index', file_index.get_index(server.STORAGE_DIR).stats)
+    server.register_stats_provider('volumes', volumes.stats)
+    server.register_stats_provider('stat_cache', get_stat_cache().stats)
+    server.register_stats_provider('read_cache', get_read_cache().stats)
+    server_socket = server.open_server_socket(hostname_ipv4, host_port,
+                                              waiting_clients)
+    stats = engines.EngineStats(1, waiting_clients)
+    server.register_stats_provider('engine', stats.snapshot)
+    try:
+        asyncio.run(serve(server_socket, stats, server.METHODS,
+                          server.HTTP_VERSIONS, max_buffer_size,
+                          keepalive_timeout, max_requests, request_timeout))
+    except KeyboardInterrupt as interruption_error:
+        logger.debug("Server was interrupted: {}", interruption_error)
+    return server_socket
+
+
+async def serve(server_socket: socket.socket, stats: engines.EngineStats,
+                methods: Tuple = server.METHODS,
+                http_versions: Tuple = server.HTTP_VERSIONS,
+                buffer_size: int = 4096,
+                keepalive_timeout: float = server.KEEPALIVE_TIMEOUT,
+                max_requests: int = server.MAX_KEEPALIVE_REQUESTS,
+                request_timeout: float = server.REQUEST_TIMEOUT):
+    """
+    Принимаем подключения на уже открытом серверном сокете до сигнала
+    остановки или перезапуска (graceful), после которого дообрабатываем
+    принятые подключения
+    """
+    handler = partial(handle_client_async, stats=stats, methods=methods,
+                      http_versions=http_versions, buffer_size=buffer_size,
+                      keepalive_timeout=keepalive_timeout,
+                      max_requests=max_requests,
+                      request_timeout=request_timeout)
+    # limit ограничивает размер заголовков, которые ждет readuntil
+    async_server = await asyncio.start_server(handler, sock=server_socket,
+                                              limit=MAX_HEAD_SIZE)
+    stopping = asyncio.Event()
+    install_signal_handlers(server_socket, stopping)
+    try:
+        await stopping.wait()
+    finally:
+        async_server.close()
+    await drain_connections(stats, graceful.DRAIN_TIMEOUT)
+
+
+def install_signal_handlers(server_socket: socket.socket,
+                            stopping: asyncio.Event):
+    """
+    Сигналы остановки и перезапуска (graceful) обрабатываются в цикле
+    событий и устанавливают stopping
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+
+    def stop():
+        if graceful.begin_drain():
+            stopping.set()
+
+    def reload():
+        if not graceful.is_draining() and \
+                graceful.spawn_successor(server_socket) is not None:
+            stop()
+
+    for signum in graceful.STOP_SIGNALS:
+        loop.add_signal_handler(signum, stop)
+    loop.add_signal_handler(graceful.RELOAD_SIGNAL, reload)
+
+
+async def drain_connections(stats: engines.EngineStats, timeout: float):
+    """
+    Ждем не дольше timeout секунд, пока обрабатываются принятые
+    подключения; оставшиеся закроет завершение цикла событий
+    """
+    active = stats.snapshot()['active']
+    if not active:
+        return
+    logger.info("Draining {} connections", active)
+    deadline = time.monotonic() + timeout
+    while stats.snapshot()['active'] and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    unfinished = stats.snapshot()['active']
+    if unfinished:
+        logger.warning("{} connections were not finished in {} s",
+                       unfinished, timeout)
+
+
+class TimeoutReader:
+    """
+    asyncio.StreamReader, который ждет каждую часть данных не дольше
+    timeout секунд (asyncio.TimeoutError), как сокет с таймаутом в
+    синхронном сервере
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, timeout: float):
+        self._reader = reader
+        self.timeout = timeout
+
+    async def read(self, n: int = -1) -> bytes:
+        return await asyncio.wait_for(self._reader.read(n), self.timeout)
+
+    async def readexactly(self, n: int) -> bytes:
+        return await asyncio.wait_for(self._reader.readexactly(n),
+                                      self.timeout)
+
+    async def readuntil(self, separator: bytes = b'\n') -> bytes:
+        return await asyncio.wait_for(self._reader.readuntil(separator),
+                                      self.timeout)
+
+    async def readline(self) -> bytes:
+        return await asyncio.wait_for(self._reader.readline(), self.timeout)
+
+    def __getattr__(self, name: str):
+        return getattr(self._reader, name)
+
+
+async def handle_client_async(reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter,
+                              stats: engines.EngineStats,
+                              methods: Tuple = server.METHODS,
+                              http_versions: Tuple = server.HTTP_VERSIONS,
+                              buffer_size: int = 4096,
+                              keepalive_timeout: float =
+                              server.KEEPALIVE_TIMEOUT,
+                              max_requests: int =
+                              server.MAX_KEEPALIVE_REQUESTS,
+                              request_timeout: float =
+                              server.REQUEST_TIMEOUT):
+    """
+    Обслуживаем одно клиентское подключение: в постоянном соединении
+    запросы обрабатываются по очереди, как в server.handle_client
+    """
+    accepted = time.perf_counter()
+    stats.incr('accepted')
+    stats.incr('active')
+    client_addr = writer.get_extra_info('peername')
+    logger.debug("New connection from: {}", client_addr)
+    # Отправленные части ответа учитываются в metrics
+    writer = metrics.MeteredWriter(writer)
+    # Тело запроса ждем не дольше request_timeout на каждую часть
+    body_reader = TimeoutReader(reader, request_timeout)
+    try:
+        for request_number in range(1, max_requests + 1):
+            try:
+                # readuntil останавливается ровно на конце заголовков,
+                # поэтому тело запроса остается в reader
+                head = await asyncio.wait_for(
+                    reader.readuntil(HEAD_END),
+                    request_timeout if request_number == 1 else
+                    keepalive_timeout)
+                head_received = time.perf_counter()
+                request = RequestParser().feed(head)
+            except asyncio.TimeoutError:
+                break
+            except asyncio.IncompleteReadError:
+                # Клиент закрыл соединение, не дождавшись конца заголовков
+                break
+            except (asyncio.LimitOverrunError, HttpParseError) as head_error:
+                status = getattr(head_error, 'status', 431)
+                logger.debug('{} Bad Request: {}', status, head_error)
+                writer.write(server.make_response(status))
+                await writer.drain()
+                break
+
+            timer = metrics.start_request(
+                accepted if request_number == 1 else head_received)
+            timer.add_stage('header_parse',
+                            time.perf_counter() - head_received)
+            try:
+                keep_alive = await process_request(
+                    body_reader, writer, request, methods, http_versions,
+                    buffer_size, request_number < max_requests and
+                    not graceful.is_draining())
+                await writer.drain()
+            finally:
+                server.finish_request(client_addr, request)
+            if not keep_alive:
+                break
+    except ConnectionError as conn_error:
+        logger.debug("Connection was close by peer: {}", conn_error)
+    except Exception as unknown_error:
+        stats.incr('failed')
+        logger.error("Unknown Error was occurred: {}", unknown_error)
+    finally:
+        writer.close()
+        stats.incr('active', -1)
+        stats.incr('completed')
+
+
+async def process_request(reader: asyncio.StreamReader,
+                          writer: asyncio.StreamWriter,
+                          request: HttpRequest,
+                          methods: Tuple, http_versions: Tuple,
+                          buffer_size: int,
+                          keep_alive_allowed: bool = True) -> bool:
+    """
+    Выбираем обработчик по методу и отправляем ответ клиенту.
+    Возвращаем True, если соединение можно использовать для следующего
+    запроса
+    """
+    first_req_line = request.first_line
+    req_headers_dict = request.headers
+    req_body = request.body
+    first_status = server.check_request_by_first_line(first_req_line,
+                                                      methods,
+                                                      http_versions)
+    if first_status != 200:
+        logger.debug('{}: {}', first_status, first_req_line)
+        writer.write(server.make_response(first_status))
+        return False
+
+    keep_alive = keep_alive_allowed and server.is_keep_alive(req_headers_dict)
+    method = request.method
+
+    if method == 'POST' and request.path in batch.BATCH_PATHS:
+        return await process_batch_request(reader, writer, request,
+                                           buffer_size, keep_alive)
+
+    if method == 'GET' and request.path == server.STATS_PATH:
+        writer.write(server.make_response(
+            200, json.dumps(server.collect_stats()), keep_alive))
+
+    elif method == 'GET' and request.path == server.METRICS_PATH:
+        writer.write(server.make_metrics_response(keep_alive))
+
+    elif method == 'GET' and request.path == server.META_PATH:
+        writer.write(await metrics.run_in_executor(
+            server.make_meta_response, request.query, keep_alive))
+
+    elif method == 'HEAD':
+        writer.write(await metrics.run_in_executor(
+            server.make_head_response, req_headers_dict, request.query,
+            keep_alive))
+
+    elif method == 'GET':
+        file_hash, plan, file_size, file_abs_path, offset = \
+            await metrics.run_in_executor(plan_get_request,
+                                          req_headers_dict, request.query)
+        if plan is None:
+            writer.write(server.make_response(int(file_hash), '',
+                                              keep_alive))
+            return keep_alive
+        writer.write(server.make_response_head(
+            plan.status, plan.content_length, keep_alive, plan.headers))
+        started = time.perf_counter()
+        is_ok = await get.send_planned_to_client_async(
+            writer, file_abs_path, plan, file_size, file_hash, offset)
+        metrics.add_stage('send', time.perf_counter() - started)
+        keep_alive = keep_alive and is_ok
+
+    elif method == 'POST':
+        # Проверка обращается к индексу хранилища, поэтому выполняется в
+        # пуле потоков
+        declared_hash, status = await metrics.run_in_executor(
+            post.check_declared_hash, req_headers_dict, request.query)
+        if status == 100:
+            writer.write(post.CONTINUE_RESPONSE)
+            await writer.drain()
+        elif status != 200:
+            # Тело запроса не прочитано - закрываем соединение
+            writer.write(server.make_response(
+                status, declared_hash, False,
+                server.hash_headers(declared_hash)))
+            return False
+
+        file_hash, status = await post.post_request_handler_async(
+            reader, buffer_size, req_headers_dict, req_body, declared_hash)
+        metrics.set_key(file_hash)
+        keep_alive = keep_alive and status in (200, 409)
+        writer.write(server.make_response(status, file_hash, keep_alive,
+                                          server.hash_headers(file_hash)))
+
+    else:  # method == DELETE
+        file_hash, abs_path = await metrics.run_in_executor(
+            server.find_file_hash_in_req, request.query)
+        if file_hash in ('400', '404'):
+            writer.write(server.make_response(int(file_hash), '',
+                                              keep_alive))
+        elif await metrics.run_in_executor(delete_handler.delete_file,
+                                           file_hash, abs_path):
+            writer.write(server.make_response(200, ' DELETE method',
+                                              keep_alive))
+        else:
+            writer.write(server.make_response(500, '', keep_alive))
+
+    return keep_alive
+
+
+def plan_get_request(req_headers: Dict, params: Dict[str, str]
+                     ) -> Tuple[str, Optional[get.DownloadPlan], int, str,
+                                int]:
+    """
+    Блокирующая часть GET-запроса для пула потоков: поиск файла в индексе,
+    план ответа и расположение данных (файл или pack-файл)
+
+    :return: кортеж из ключа файла, плана ответа, размера файла, пути к
+    данным и их смещения; если файл не найден - план None, а вместо ключа
+    статус ответа ('400' или '404')
+    """
+    file_hash, file_abs_path = server.find_file_hash_in_req(params)
+    if file_hash in ('400', '404'):
+        return file_hash, None, 0, '', 0
+    index_entry = file_index.get_index().lookup(file_hash)
+    if index_entry is None:  # файл удалили параллельным запросом
+        return '404', None, 0, '', 0
+    plan = get.plan_download(req_headers, file_hash, index_entry.size,
+                             server.file_variants(req_headers, file_hash))
+    file_abs_path, offset = server.file_source(file_hash, file_abs_path)
+    return file_hash, plan, index_entry.size, file_abs_path, offset
+
+
+async def process_batch_request(reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter,
+                                request: HttpRequest, buffer_size: int,
+                                keep_alive: bool) -> bool:
+    """
+    Асинхронная версия server.serve_batch_request
+    """
+    req_headers_dict = request.headers
+    if request.path == batch.BATCH_UPLOAD_PATH:
+        status = 200 if post.check_post_request(req_headers_dict,
+                                                request.body) else 400
+    else:
+        status = batch.check_batch_request(req_headers_dict)
+    if status != 200:
+        writer.write(server.make_response(status))
+        return False
+    if post.expects_continue(req_headers_dict):
+        writer.write(post.CONTINUE_RESPONSE)
+        await writer.drain()
+
+    receiver = None
+    if request.path == batch.BATCH_UPLOAD_PATH:
+        receiver, status = await post.receive_upload_async(
+            reader, buffer_size, req_headers_dict, request.body,
+            server.STORAGE_DIR)
+        results = batch.upload_objects(receiver, server.STORAGE_DIR) \
+            if receiver else None
+    else:
+        keys, status = await batch.receive_key_list_async(
+            reader, buffer_size, req_headers_dict, request.body)
+        if keys is None:
+            results = None
+        elif request.path == batch.BATCH_STAT_PATH:
+            results = batch.stat_objects(keys, server.find_file_hash_in_req)
+        else:
+            results = batch.delete_objects(keys,
+                                           server.find_file_hash_in_req)
+    if results is None:
+        writer.write(server.make_response(status))
+        return False
+
+    writer.write(server.make_chunked_response_head(
+        200, keep_alive, {'Content-Type': batch.JSON_CONTENT_TYPE}))
+    # Результаты считаются при чтении (перенос файлов в хранилище,
+    # удаление), поэтому каждая часть ответа готовится в пуле потоков
+    chunks = batch.iter_json_chunks(results)
+    try:
+        while True:
+            chunk = await metrics.run_in_executor(next, chunks, None)
+            if chunk is None:
+                break
+            writer.write(chunk)
+            await writer.drain()
+    finally:
+        # Файлы, которые не успели перенести в хранилище, удаляются
+        if receiver is not None:
+            await metrics.run_in_executor(receiver.discard)
+    return keep_alive
@@ -0,0 +1,211 @@
+"""
+Пакетные запросы: несколько объектов в одном запросе
+
+POST /batch/upload - архив tar или multipart/form-data с несколькими
+файлами, каждый файл переносится в хранилище как при обычной загрузке;
+POST /batch/stat - JSON-массив ключей, для каждого ключа возвращается,
+есть ли файл в хранилище, и его размер;
+POST /batch/delete - JSON-массив ключей, которые нужно удалить.
+
+Ответ - JSON-массив с результатом для каждого объекта в порядке запроса.
+Он отправляется частями (Transfer-Encoding: chunked) по мере обработки
+объектов, поэтому длинный список не приходится держать в памяти целиком
+"""
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from loguru import logger
+import post_handler as post
+import delete_handler
+from file_index import get_index
+from http_parser import HttpParseError, encode_chunk, is_chunked, LAST_CHUNK
+
+BATCH_UPLOAD_PATH = '/batch/upload'
+BATCH_STAT_PATH = '/batch/stat'
+BATCH_DELETE_PATH = '/batch/delete'
+BATCH_PATHS = (BATCH_UPLOAD_PATH, BATCH_STAT_PATH, BATCH_DELETE_PATH)
+JSON_CONTENT_TYPE = 'application/json'
+# Максимальный размер тела /batch/stat и /batch/delete
+MAX_BATCH_BODY_SIZE: int = 4 * 1024 * 1024
+# Максимальное количество ключей в одном запросе
+MAX_BATCH_KEYS: int = 10000
+# Результаты объединяются в части ответа примерно такого размера
+RESPONSE_CHUNK_SIZE: int = 16 * 1024
+
+# Поиск файла по параметрам запроса (server.find_file_hash_in_req)
+FileFinder = Callable[[Dict[str, str]], Tuple[str, str]]
+
+
+class BodyCollector(post.BodyReceiver):
+    """
+    Приемник тела запроса для post_handler.receive_files_from_client,
+    который собирает тело в памяти (не больше max_size байт)
+    """
+
+    def __init__(self, max_size: int = MAX_BATCH_BODY_SIZE):
+        self.max_size = max_size
+        self._parts: List[bytes] = []
+        self._size = 0
+
+    def feed(self, data: bytes):
+        """
+        :raise HttpParseError: если тело длиннее max_size (413)
+        """
+        self._size += len(data)
+        if self._size > self.max_size:
+            raise HttpParseError(413, "Batch request body is too large")
+        self._parts.append(data)
+
+    def finish(self) -> bytes:
+        return b''.join(self._parts)
+
+    def discard(self):
+        self._parts = []
+        self._size = 0
+
+
+def check_batch_request(req_headers: Dict) -> int:
+    """
+    Проверка запроса /batch/stat или /batch/delete до чтения тела
+
+    :return: статус код: 200 - можно принимать тело, 400 - размер тела
+    не указан, 413 - тело слишком большое
+    """
+    if is_chunked(req_headers):
+        return 200
+    if 'Transfer-Encoding' in req_headers:
+        return 400
+    try:
+        content_len = int(req_headers['Content-Length'])
+    except (KeyError, ValueError):
+        return 400
+    if content_len < 0:
+        return 400
+    if content_len > MAX_BATCH_BODY_SIZE:
+        return 413
+    return 200
+
+
+def parse_key_list(body: bytes) -> Tuple[Optional[List[str]], int]:
+    """
+    Список ключей из тела запроса - JSON-массива строк
+
+    :return: кортеж из списка ключей и статус кода 200; если тело
+    некорректно - None и 400, если ключей больше MAX_BATCH_KEYS - None и 413
+    """
+    try:
+        keys = json.loads(body.decode('utf-8'))
+    except ValueError:
+        return None, 400
+    if not isinstance(keys, list) or \
+            not all(isinstance(key, str) for key in keys):
+        return None, 400
+    if len(keys) > MAX_BATCH_KEYS:
+        return None, 413
+    return keys, 200
+
+
+def receive_key_list(client_socket, buffer_size, req_headers: Dict,
+                     req_body: bytes) -> Tuple[Optional[List[str]], int]:
+    """
+    Получаем тело /batch/stat или /batch/delete и разбираем список ключей
+
+    :return: кортеж из списка ключей (None при ошибке) и статус кода
+    """
+    try:
+        body = post.receive_files_from_client(client_socket, buffer_size,
+                                              req_headers, req_body,
+                                              BodyCollector())
+    except HttpParseError as parse_error:
+        logger.error("{}: {}", parse_error.status, parse_error)
+        return None, parse_error.status
+    except Exception as unknown_error:
+        logger.error("Unknown Error was occurred: {}", unknown_error)
+        return None, 500
+    return parse_key_list(body)
+
+
+async def receive_key_list_async(reader, buffer_size, req_headers: Dict,
+                                 req_body: bytes
+                                 ) -> Tuple[Optional[List[str]], int]:
+    """
+    Асинхронная версия receive_key_list
+    """
+    try:
+        body = await post.receive_files_from_client_async(
+            reader, buffer_size, req_headers, req_body, BodyCollector())
+    except HttpParseError as parse_error:
+        logger.error("{}: {}", parse_error.status, parse_error)
+        return None, parse_error.status
+    except Exception as unknown_error:
+        logger.error("Unknown Error was occurred: {}", unknown_error)
+        return None, 500
+    return parse_key_list(body)
+
+
+def stat_objects(keys: List[str], find_file: FileFinder) -> Iterator[Dict]:
+    """
+    Есть ли файлы в хранилище и их размеры
+
+    :param keys: ключи файлов
+    :param find_file: поиск файла по параметрам запроса
+    (server.find_file_hash_in_req)
+    """
+    for key in keys:
+        file_hash, _ = find_file({'file_hash': key})
+        index_entry = None
+        if file_hash not in ('400', '404'):
+            index_entry = get_index().lookup(file_hash)
+        yield {'hash': key, 'exists': index_entry is not None,
+               'size': index_entry.size if index_entry else None}
+
+
+def delete_objects(keys: List[str], find_file: FileFinder) -> Iterator[Dict]:
+    """
+    Удаляем файлы из хранилища, статус для каждого ключа такой же, как
+    у DELETE-запроса: 200, 400, 404 или 500
+    """
+    for key in keys:
+        file_hash, abs_path = find_file({'file_hash': key})
+        if file_hash in ('400', '404'):
+            status = int(file_hash)
+        elif delete_handler.delete_file(file_hash, abs_path):
+            status = 200
+        else:
+            status = 500
+        yield {'hash': key, 'status': status}
+
+
+def upload_objects(receiver: post.UploadReceiver,
+                   storage_dir: str) -> Iterator[Dict]:
+    """
+    Переносим в хранилище файлы, полученные /batch/upload; статус для
+    каждого файла такой же, как у POST-запроса: 200 - новый файл,
+    409 - файл уже был в хранилище
+
+    Файлы забираются из receiver по одному, поэтому если ответ не дочитан
+    до конца, receiver.discard() удалит только оставшиеся временные файлы
+    """
+    while receiver.files:
+        name = receiver.names.pop(0)
+        file_hash, temp_file = receiver.files.pop(0)
+        file_hash, status = post.serve_post_request(file_hash, storage_dir,
+                                                    temp_file)
+        yield {'name': name, 'hash': file_hash, 'status': status}
+
+
+def iter_json_chunks(items: Iterable[Dict],
+                     chunk_size: int = RESPONSE_CHUNK_SIZE
+                     ) -> Iterator[bytes]:
+    """
+    Части тела chunked с JSON-массивом items, последняя - LAST_CHUNK
+    """
+    buffer = b'['
+    separator = b''
+    for item in items:
+        buffer += separator + json.dumps(item).encode()
+        separator = b','
+        if len(buffer) >= chunk_size:
+            yield encode_chunk(buffer)
+            buffer = b''
+    yield encode_chunk(buffer + b']')
+    yield LAST_CHUNK
@@ -0,0 +1,6 @@
+"""
+Benchmarks for server hot paths [pytest-benchmark]
+
+Run explicitly, they are not collected by the default pytest run:
+pytest benchmarks/bench_get_handler.py
+"""
@@ -0,0 +1,46 @@
+"""
+Hashing speed of every registered algorithm and read buffer size
+[pytest-benchmark]
+
+By default a BENCH_HASH_MB megabytes (default 64) file of random data is
+hashed; set BENCH_HASH_FILE to hash one of our real objects instead.
+
+pytest benchmarks/bench_file_hashing.py --benchmark-columns=mean,ops
+BENCH_HASH_FILE=store/ab/abcdef... pytest benchmarks/bench_file_hashing.py
+"""
+import os
+import pytest
+import file_hashing
+
+BUFFER_SIZES = [8192, 65536, 1024 * 1024]
+HASH_MB = int(os.environ.get('BENCH_HASH_MB', '64'))
+
+
+@pytest.fixture(scope='module')
+def sample_path(tmp_path_factory):
+    if os.environ.get('BENCH_HASH_FILE'):
+        yield os.environ['BENCH_HASH_FILE']
+        return
+    path = str(tmp_path_factory.mktemp('hashing') / 'sample.data')
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as sample:
+        for _ in range(HASH_MB):
+            sample.write(block)
+    yield path
+    os.remove(path)
+
+
+@pytest.mark.parametrize('buffer_size', BUFFER_SIZES)
+@pytest.mark.parametrize('algorithm', sorted(file_hashing.HASH_ALGORITHMS))
+def test_hash_throughput(benchmark, sample_path, algorithm, buffer_size):
+    """
+    Time to hash the sample file with algorithm reading buffer_size bytes
+    """
+    size_mb = os.path.getsize(sample_path) / (1024 * 1024)
+
+    benchmark.pedantic(file_hashing.get_file_hash,
+                       args=(sample_path, algorithm, buffer_size),
+                       rounds=3, iterations=1, warmup_rounds=1)
+    if benchmark.enabled:
+        benchmark.extra_info['MB/s'] = round(
+            size_mb / benchmark.stats.stats.mean, 1)
@@ -0,0 +1,170 @@
+"""
+Download throughput of get_handler: legacy 1 KB loop, buffered fallback
+and zero-copy os.sendfile [pytest-benchmark]
+
+Small objects are also compared as requests per second: the file opened
+and sent by sendfile for every request vs the read_cache (memory for
+small objects, mmap for medium ones).
+
+Objects from 1 MB up to BENCH_MAX_MB megabytes (default 64, use 4096 to
+include the 4 GB case) are sent over a loopback TCP connection to a
+receiver thread that only counts bytes.
+
+pytest benchmarks/bench_get_handler.py --benchmark-columns=mean,ops
+BENCH_MAX_MB=4096 pytest benchmarks/bench_get_handler.py
+"""
+import os
+import socket
+import threading
+import pytest
+import get_handler
+from read_cache import ReadCache
+
+SIZES_MB = [1, 16, 64, 256, 1024, 4096]
+SMALL_SIZES_KB = [4, 64, 1024]
+MAX_MB = int(os.environ.get('BENCH_MAX_MB', '64'))
+
+
+class Receiver:
+    """
+    Reads everything from the socket and reports when target bytes arrived
+    """
+
+    def __init__(self, recv_sock):
+        self.recv_sock = recv_sock
+        self.received = 0
+        self.target = 0
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def expect(self, target):
+        self.received = 0
+        self.target = target
+        self.done.clear()
+
+    def _drain(self):
+        buffer = bytearray(1024 * 1024)
+        while True:
+            size = self.recv_sock.recv_into(buffer)
+            if not size:
+                break
+            self.received += size
+            if self.received >= self.target:
+                self.done.set()
+
+
+@pytest.fixture(scope='module')
+def connection():
+    """
+    Connected loopback socket pair with a draining Receiver on one end
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+    send_sock = socket.create_connection(listener.getsockname())
+    recv_sock, _ = listener.accept()
+    receiver = Receiver(recv_sock)
+    yield send_sock, receiver
+    send_sock.close()
+    recv_sock.close()
+    listener.close()
+
+
+def make_object(directory, size_mb):
+    """
+    File of size_mb megabytes of random data in directory
+    """
+    path = os.path.join(str(directory), 'object_{}mb'.format(size_mb))
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as obj:
+        for _ in range(size_mb):
+            obj.write(block)
+    return path
+
+
+def send_legacy(client_socket, file_abs_path):
+    """
+    Loop from the first get_handler version: 1 KB reads, send() without
+    checking the result (printing of every chunk is left out)
+    """
+    with open(file_abs_path, 'rb') as file_stream:
+        file_chunk = file_stream.read(1024)
+        while file_chunk:
+            client_socket.sendall(file_chunk)
+            file_chunk = file_stream.read(1024)
+
+
+def send_buffered(client_socket, file_abs_path):
+    """
+    Current fallback of get_handler: 64 KB reads and sendall
+    """
+    with open(file_abs_path, 'rb') as file_stream:
+        size = os.fstat(file_stream.fileno()).st_size
+        get_handler.send_buffered(client_socket, file_stream, 0, size)
+
+
+def send_zero_copy(client_socket, file_abs_path):
+    """
+    Current get_handler path: os.sendfile without copying to user space
+    """
+    get_handler.send_file_to_client(client_socket, file_abs_path)
+
+
+@pytest.mark.parametrize('size_mb', [size for size in SIZES_MB
+                                     if size <= MAX_MB])
+@pytest.mark.parametrize('sender', [send_legacy, send_buffered,
+                                    send_zero_copy],
+                         ids=['legacy_1k', 'buffered_64k', 'sendfile'])
+def test_download_throughput(benchmark, tmp_path_factory, connection,
+                             sender, size_mb):
+    """
+    Time to push one object of size_mb megabytes through the socket
+    """
+    send_sock, receiver = connection
+    path = make_object(tmp_path_factory.mktemp('objects'), size_mb)
+    size = os.path.getsize(path)
+
+    def send_object():
+        receiver.expect(size)
+        sender(send_sock, path)
+        receiver.done.wait()
+
+    benchmark.pedantic(send_object, rounds=3, iterations=1, warmup_rounds=1)
+    if benchmark.enabled:
+        benchmark.extra_info['MB/s'] = round(
+            size_mb / benchmark.stats.stats.mean, 1)
+    os.remove(path)
+
+
+@pytest.mark.parametrize('size_kb', SMALL_SIZES_KB)
+@pytest.mark.parametrize('cached', [False, True],
+                         ids=['sendfile', 'read_cache'])
+def test_small_object_rate(benchmark, tmp_path, connection, cached,
+                           size_kb):
+    """
+    Requests per second for one hot object of size_kb kilobytes
+    """
+    send_sock, receiver = connection
+    path = str(tmp_path / 'hot_object')
+    with open(path, 'wb') as obj:
+        obj.write(os.urandom(size_kb * 1024))
+    size = size_kb * 1024
+    cache = ReadCache()
+    requests_per_round = 100
+
+    def send_objects():
+        receiver.expect(size * requests_per_round)
+        for _ in range(requests_per_round):
+            content = cache.get('hot', path, size) if cached else None
+            if content is not None:
+                get_handler.send_content_to_client(send_sock, content)
+            else:
+                get_handler.send_file_to_client(send_sock, path, 0, size)
+        receiver.done.wait()
+
+    benchmark.pedantic(send_objects, rounds=5, iterations=1,
+                       warmup_rounds=1)
+    if benchmark.enabled:
+        benchmark.extra_info['requests/s'] = round(
+            requests_per_round / benchmark.stats.stats.mean)
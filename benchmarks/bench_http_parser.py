@@ -0,0 +1,76 @@
+"""
+Request head parsing speed without any network I/O [pytest-benchmark]
+
+Typical GET and POST heads are parsed by http_parser.RequestParser either
+at once or fed by small parts, as they come from a slow client, and by
+server.get_request_elements, which parses a complete request at once.
+
+pytest benchmarks/bench_http_parser.py --benchmark-columns=mean,ops
+"""
+import pytest
+from http_parser import RequestParser
+from server import get_request_elements
+
+REQUESTS_PER_ROUND = 1000
+HEADS = {
+    'get': (b'GET /?file_hash=f3d73e8b9006f3bf6c541786c1c96fc3 HTTP/1.1\r\n'
+            b'Host: localhost:9000\r\n'
+            b'User-Agent: python-requests/2.25.1\r\n'
+            b'Accept-Encoding: gzip, deflate\r\n'
+            b'Accept: */*\r\n'
+            b'Connection: keep-alive\r\n'
+            b'Range: bytes=0-1023\r\n\r\n'),
+    'post': (b'POST / HTTP/1.1\r\n'
+             b'Host: localhost:9000\r\n'
+             b'User-Agent: curl/7.68.0\r\n'
+             b'Accept: */*\r\n'
+             b'Content-Length: 1048576\r\n'
+             b'Content-Type: multipart/form-data; '
+             b'boundary=------------------------d74496d66958873e\r\n'
+             b'Expect: 100-continue\r\n\r\n'),
+}
+
+
+def parse_heads(head, part_size):
+    """
+    Parse REQUESTS_PER_ROUND copies of head fed by part_size bytes
+    """
+    for _ in range(REQUESTS_PER_ROUND):
+        parser = RequestParser()
+        for position in range(0, len(head), part_size):
+            request = parser.feed(head[position:position + part_size])
+        assert request is not None
+
+
+@pytest.mark.parametrize('part_size', [16, 4096])
+@pytest.mark.parametrize('head_name', sorted(HEADS))
+def test_parse_throughput(benchmark, head_name, part_size):
+    """
+    Parsed requests per second for head fed by part_size bytes
+    """
+    benchmark.pedantic(parse_heads, args=(HEADS[head_name], part_size),
+                       rounds=5, iterations=1, warmup_rounds=1)
+    if benchmark.enabled:
+        benchmark.extra_info['requests/s'] = round(
+            REQUESTS_PER_ROUND / benchmark.stats.stats.mean)
+
+
+def split_heads(head):
+    """
+    Split REQUESTS_PER_ROUND complete requests with get_request_elements
+    """
+    for _ in range(REQUESTS_PER_ROUND):
+        first_line, _, _ = get_request_elements(head)
+        assert first_line
+
+
+@pytest.mark.parametrize('head_name', sorted(HEADS))
+def test_get_request_elements_throughput(benchmark, head_name):
+    """
+    Requests per second for the whole-request parser of server
+    """
+    benchmark.pedantic(split_heads, args=(HEADS[head_name],),
+                       rounds=5, iterations=1, warmup_rounds=1)
+    if benchmark.enabled:
+        benchmark.extra_info['requests/s'] = round(
+            REQUESTS_PER_ROUND / benchmark.stats.stats.mean)
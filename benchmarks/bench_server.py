@@ -0,0 +1,131 @@
+"""
+End-to-end server throughput over loopback HTTP [pytest-benchmark]
+
+A server is started in a thread on BENCH_PORT (default 9100) with the
+BENCH_ENGINE engine (default 'threads') and the ./store/ directory.
+Upload and download speed are measured per object size up to
+BENCH_MAX_MB megabytes (default 64), and requests per second of the mixed
+load of load_generator for 1 to 64 concurrent clients (BENCH_LOAD_SECONDS
+per run, default 3).
+
+pytest benchmarks/bench_server.py --benchmark-columns=mean,ops
+BENCH_ENGINE=asyncio pytest benchmarks/bench_server.py -k concurrent
+"""
+import os
+import time
+import socket
+import threading
+import http.client
+from hashlib import md5
+import pytest
+import server
+import async_server
+from benchmarks.load_generator import delete_objects, run_load, upload
+
+PORT = int(os.environ.get('BENCH_PORT', '9100'))
+ENGINE = os.environ.get('BENCH_ENGINE', 'threads')
+MAX_MB = int(os.environ.get('BENCH_MAX_MB', '64'))
+LOAD_SECONDS = float(os.environ.get('BENCH_LOAD_SECONDS', '3'))
+URL = 'http://localhost:{}'.format(PORT)
+SIZES_KB = [4, 64, 1024, 16 * 1024, 64 * 1024, 256 * 1024]
+CLIENTS = [1, 8, 32, 64]
+
+
+@pytest.fixture(scope='module')
+def running_server():
+    """
+    Server of the BENCH_ENGINE engine started in a daemon thread, yields
+    its address
+    """
+    if ENGINE == 'asyncio':
+        target = async_server.run_async_server
+        args = ('localhost', PORT, 128, 65536)
+    else:
+        target = server.run_server
+        args = ('localhost', PORT, 128, 65536, ENGINE)
+    threading.Thread(target=target, args=args, daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('localhost', PORT)).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    yield 'localhost', PORT
+
+
+@pytest.fixture(scope='module')
+def connection(running_server):
+    """
+    Keep-alive HTTP connection to the running server
+    """
+    host, port = running_server
+    client = http.client.HTTPConnection(host, port, timeout=60)
+    yield client
+    client.close()
+
+
+@pytest.mark.parametrize('size_kb', [size for size in SIZES_KB
+                                     if size <= MAX_MB * 1024])
+def test_upload_throughput(benchmark, connection, size_kb):
+    """
+    Time to upload one new object of size_kb kilobytes
+    """
+    payload = bytearray(os.urandom(size_kb * 1024))
+    keys = []
+
+    def upload_object():
+        # New content every round, otherwise the upload is deduplicated
+        payload[:8] = len(keys).to_bytes(8, 'big')
+        content = bytes(payload)
+        assert upload(connection, content) == 200
+        keys.append(md5(content).hexdigest())
+
+    benchmark.pedantic(upload_object, rounds=5, iterations=1,
+                       warmup_rounds=1)
+    if benchmark.enabled:
+        benchmark.extra_info['MB/s'] = round(
+            size_kb / 1024 / benchmark.stats.stats.mean, 1)
+    delete_objects(URL, keys)
+
+
+@pytest.mark.parametrize('size_kb', [size for size in SIZES_KB
+                                     if size <= MAX_MB * 1024])
+def test_download_throughput(benchmark, connection, size_kb):
+    """
+    Time to download one object of size_kb kilobytes
+    """
+    content = os.urandom(size_kb * 1024)
+    upload(connection, content)
+    path = '/?file_hash={}'.format(md5(content).hexdigest())
+
+    def download_object():
+        connection.request('GET', path)
+        response = connection.getresponse()
+        assert len(response.read()) == len(content)
+
+    benchmark.pedantic(download_object, rounds=5, iterations=1,
+                       warmup_rounds=1)
+    if benchmark.enabled:
+        benchmark.extra_info['MB/s'] = round(
+            size_kb / 1024 / benchmark.stats.stats.mean, 1)
+    delete_objects(URL, [md5(content).hexdigest()])
+
+
+@pytest.mark.usefixtures('running_server')
+@pytest.mark.parametrize('clients', CLIENTS)
+def test_concurrent_requests(benchmark, clients):
+    """
+    Requests per second of the load_generator mix for clients concurrent
+    keep-alive clients
+    """
+    reports = []
+
+    def run():
+        reports.append(run_load(URL, clients, LOAD_SECONDS, objects=20))
+
+    benchmark.pedantic(run, rounds=1, iterations=1)
+    report = reports[0]
+    delete_objects(URL, report.uploaded)
+    summary = report.summary()
+    assert summary['errors'] == 0
+    benchmark.extra_info.update(summary)
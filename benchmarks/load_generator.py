@@ -0,0 +1,238 @@
+"""
+Load generator for a running server: N concurrent clients send a mix of
+GET, HEAD and POST requests over keep-alive connections and the
+requests per second and latency percentiles are reported.
+
+Objects for GET and HEAD are uploaded before the run; every POST uploads
+new content, so uploads are never answered by deduplication (409). All
+uploaded objects are deleted after the run unless --keep is given.
+
+python benchmarks/load_generator.py --clients 32 --duration 10
+python benchmarks/load_generator.py --url http://localhost:9000 \
+    --mix get=8,head=1,post=1 --size 65536
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import http.client
+from hashlib import md5
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+DEFAULT_URL = 'http://localhost:9000'
+DEFAULT_MIX = 'get=8,head=1,post=1'
+METHODS = ('get', 'head', 'post')
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """
+    Weights of request methods from 'get=8,head=1,post=1'
+    """
+    mix = {}
+    for item in value.split(','):
+        method, _, weight = item.strip().partition('=')
+        if method not in METHODS or not weight.isdigit():
+            raise ValueError("Invalid request mix: {}".format(value))
+        mix[method] = int(weight)
+    if not any(mix.values()):
+        raise ValueError("Request mix is empty: {}".format(value))
+    return mix
+
+
+class LoadReport:
+    """
+    Results of all clients: latencies of successful requests in seconds,
+    errors and received bytes per method
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {
+            method: [] for method in METHODS}
+        self.errors = 0
+        self.received = 0
+        self.elapsed = 0.0
+        self.uploaded: List[str] = []
+        self._lock = threading.Lock()
+
+    def add(self, method: str, latency: float, received: int):
+        with self._lock:
+            self.latencies[method].append(latency)
+            self.received += received
+
+    def add_upload(self, key: str):
+        with self._lock:
+            self.uploaded.append(key)
+
+    def fail(self):
+        with self._lock:
+            self.errors += 1
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Requests per second, error count and latency percentiles in ms
+        """
+        latencies = sorted(latency for method in METHODS
+                           for latency in self.latencies[method])
+        result = {'requests': len(latencies), 'errors': self.errors,
+                  'rps': round(len(latencies) / self.elapsed, 1)
+                  if self.elapsed else 0.0,
+                  'MB/s': round(self.received / self.elapsed / 2 ** 20, 1)
+                  if self.elapsed else 0.0}
+        for percentile in (50, 90, 99):
+            result['p{}_ms'.format(percentile)] = round(
+                1000 * latencies[min(len(latencies) - 1, len(latencies) *
+                                     percentile // 100)], 2) \
+                if latencies else 0.0
+        return result
+
+
+def upload(connection: http.client.HTTPConnection, content: bytes) -> int:
+    connection.request('POST', '/', body=content,
+                       headers={'Content-Type': 'application/octet-stream'})
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def prepare_objects(url: str, count: int, size: int) -> List[str]:
+    """
+    Upload count objects of size bytes for GET and HEAD requests
+
+    :return: keys of the objects
+    """
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    keys = []
+    for _ in range(count):
+        content = os.urandom(size)
+        upload(connection, content)
+        keys.append(md5(content).hexdigest())
+    connection.close()
+    return keys
+
+
+def delete_objects(url: str, keys: List[str]):
+    """
+    Delete uploaded objects from the server
+    """
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    for key in keys:
+        connection.request('DELETE', '/?file_hash={}'.format(key))
+        connection.getresponse().read()
+    connection.close()
+
+
+def run_client(url: str, keys: List[str], schedule: List[str], size: int,
+               deadline: float, report: LoadReport):
+    """
+    One client: sends requests by schedule in a loop until deadline,
+    reconnects after errors
+    """
+    parts = urlsplit(url)
+    connection: Optional[http.client.HTTPConnection] = None
+    payload = bytearray(os.urandom(size))
+    number = 0
+    while time.monotonic() < deadline:
+        method = schedule[number % len(schedule)]
+        key = keys[number % len(keys)]
+        number += 1
+        if connection is None:
+            connection = http.client.HTTPConnection(parts.hostname,
+                                                    parts.port, timeout=30)
+        started = time.perf_counter()
+        try:
+            if method == 'post':
+                # New content for every upload
+                payload[:8] = number.to_bytes(8, 'big')
+                content = bytes(payload)
+                status = upload(connection, content)
+                report.add_upload(md5(content).hexdigest())
+                received = 0
+            else:
+                connection.request(method.upper(),
+                                   '/?file_hash={}'.format(key))
+                response = connection.getresponse()
+                received = len(response.read())
+                status = response.status
+        except (OSError, http.client.HTTPException):
+            report.fail()
+            connection.close()
+            connection = None
+            continue
+        if status >= 400:
+            report.fail()
+            continue
+        report.add(method, time.perf_counter() - started, received)
+    if connection is not None:
+        connection.close()
+
+
+def run_load(url: str = DEFAULT_URL, clients: int = 8,
+             duration: float = 10.0, mix: Optional[Dict[str, int]] = None,
+             size: int = 4096, objects: int = 100) -> LoadReport:
+    """
+    Run clients concurrent clients for duration seconds
+    """
+    mix = mix or parse_mix(DEFAULT_MIX)
+    schedule = [method for method in METHODS
+                for _ in range(mix.get(method, 0))]
+    keys = prepare_objects(url, objects, size)
+    report = LoadReport()
+    report.uploaded.extend(keys)
+    started = time.monotonic()
+    deadline = started + duration
+    threads = []
+    for client in range(clients):
+        # Clients start at different places of the schedule
+        shifted = schedule[client % len(schedule):] + \
+            schedule[:client % len(schedule)]
+        thread = threading.Thread(target=run_client,
+                                  args=(url, keys, shifted, size, deadline,
+                                        report), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    report.elapsed = time.monotonic() - started
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Load generator for http-upload-server')
+    parser.add_argument('--url', default=DEFAULT_URL,
+                        help="Server URL, default - %(default)s")
+    parser.add_argument('--clients', type=int, default=8,
+                        help="Concurrent clients, default - %(default)s")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="Seconds to run, default - %(default)s")
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help="Weights of request methods, "
+                             "default - %(default)s")
+    parser.add_argument('--size', type=int, default=4096,
+                        help="Object size in bytes, default - %(default)s")
+    parser.add_argument('--objects', type=int, default=100,
+                        help="Objects for GET and HEAD, "
+                             "default - %(default)s")
+    parser.add_argument('--keep', action='store_true',
+                        help="Keep uploaded objects on the server")
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as mix_error:
+        parser.error(str(mix_error))
+
+    report = run_load(args.url, args.clients, args.duration, mix,
+                      args.size, args.objects)
+    if not args.keep:
+        delete_objects(args.url, report.uploaded)
+    for name, value in report.summary().items():
+        print('{:>10}: {}'.format(name, value))
+    return 1 if report.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -33,45 +33,61 @@ def send_non_http_request(host_addr: str = 'localhost', port: int = 9000,
     return server_response.decode()
 
 
-def file_read_by_chunks(file_stream, content_boundary, chunk_size=1024,
+def file_read_by_chunks(file_stream, part_head, part_tail, chunk_size=1024,
                         chunks=-1):
     """Lazy function (generator) to read a file piece by piece.
     Default chunk size: 1k
+    File data is wrapped with multipart part head and closing delimiter.
     If file not exists can return: [StopIteration: File Not Found Error]
     """
-    data = content_boundary.encode()
-    yield data
+    yield part_head
     while chunks:
         data = file_stream.read(chunk_size)
         if not data:
             break
         yield data
         chunks -= 1
+    yield part_tail
 
 
-def send_post_request(server_host, file_sample):
+def send_post_request(server_host, file_sample, chunked=False):
     """
-    Function for sending post request with file
+    Function for sending post request with file as multipart/form-data
     :param server_host:
     :param file_sample:
+    :param chunked: send body with Transfer-Encoding: chunked instead of
+    Content-Length (size of body is not computed in advance)
     :return: resp - ответ сервера, file_hash - хэш в теле ответа
     """
-    boundary = '--' + str(uuid.uuid4()) + '--'
-
+    boundary = uuid.uuid4().hex
+    part_head = ('--{}\r\n'
+                 'Content-Disposition: form-data; name="file"; '
+                 'filename="{}"\r\n'
+                 'Content-Type: application/octet-stream\r\n\r\n').format(
+                     boundary, Path(file_sample).name).encode()
+    part_tail = '\r\n--{}--\r\n'.format(boundary).encode()
     custom_header = {"Connection": "close",
                      "Content-Type": "multipart/form-data; boundary={}".format(
-                         boundary),
-                     "Content-Length": str(Path(file_sample).stat().st_size)}
+                         boundary)}
+    # Without Content-Length requests sends generator body chunked
+    if not chunked:
+        custom_header["Content-Length"] = str(
+            len(part_head) + Path(file_sample).stat().st_size +
+            len(part_tail))
 
-    print(custom_header)
+    logger.debug(custom_header)
 
     file_stream = open(file_sample, 'rb')
 
     with requests.Session() as session:
-        server_response = requests.post(server_host,
-                                        data=file_read_by_chunks(file_stream,
-                                                                 boundary),
-                                        headers=custom_header)
+        request = session.prepare_request(requests.Request(
+            'POST', server_host, headers=custom_header,
+            data=file_read_by_chunks(file_stream, part_head, part_tail)))
+        # requests marks generator body as chunked even with Content-Length,
+        # but sends it as is - both headers must not be sent (RFC 7230)
+        if not chunked:
+            del request.headers['Transfer-Encoding']
+        server_response = session.send(request)
         logger.debug(server_response)
         response_file_hash = server_response.content.decode()
         session.close()
@@ -95,15 +111,12 @@ def download_file(host_addr, params):
         filename = 'none'
     full_received_file_name = current_dir + filename
     response_for_get = requests.get(host_addr, params=params, stream=True)
-    print(response_for_get)
+    logger.debug(response_for_get)
     if response_for_get.status_code == 200:
-        print(response_for_get)
         file = open(full_received_file_name, "wb")
         for chunk_size in response_for_get.iter_content(chunk_size=1024):
             file.write(chunk_size)
         file.close()
-    else:
-        print(response_for_get)
 
 
 def delete_file(host_addr, params):
@@ -0,0 +1,245 @@
+"""
+Сжатые варианты файлов хранилища и выбор кодирования по Accept-Encoding
+
+Рядом с файлом <ключ> может лежать его сжатая копия <ключ>.<кодирование>
+(например, <ключ>.gzip). Ключ по-прежнему считается по исходному
+содержимому, а сжатая копия отдается клиенту, который ее принимает
+(Content-Encoding), без сжатия во время запроса. Копии создает фоновый
+поток после загрузки нового файла, если сжатие включено при запуске
+сервера; копия сохраняется, только если она заметно меньше исходного
+файла. Какие копии есть у файла, записано в индексе хранилища.
+
+gzip доступен всегда, zstd - только если установлен пакет zstandard
+"""
+import os
+import gzip
+import queue
+import shutil
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+from file_index import FileIndex, get_index
+from volumes import get_volumes
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# Кодирования в порядке предпочтения сервера
+ENCODINGS: Tuple[str, ...] = ('zstd', 'gzip') if zstandard is not None \
+    else ('gzip',)
+# Файлы меньше этого размера не сжимаются
+MIN_COMPRESS_SIZE: int = 1024
+# Копия сохраняется, только если она не больше этой доли исходного файла
+MAX_COMPRESS_RATIO: float = 0.9
+GZIP_LEVEL: int = 6
+ZSTD_LEVEL: int = 3
+READ_BUFFER_SIZE: int = 65536
+
+
+def variant_path(file_abs_path: str, encoding: str) -> str:
+    """
+    Путь к сжатой копии файла
+    """
+    return file_abs_path + '.' + encoding
+
+
+def variant_key(file_hash: str, encoding: str) -> str:
+    """
+    Ключ сжатой копии для кэшей и ETag; для исходного файла - сам ключ
+    """
+    return file_hash + '.' + encoding if encoding else file_hash
+
+
+def parse_accept_encoding(header_value: str) -> Dict[str, float]:
+    """
+    Кодирования из заголовка Accept-Encoding с их весами (q)
+    """
+    weights = {}
+    for item in header_value.split(','):
+        coding, *params = item.strip().split(';')
+        weight = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding.strip().lower()] = weight
+    return weights
+
+
+def negotiate_encoding(header_value: str, available: Iterable[str]) -> str:
+    """
+    Выбираем сжатую копию, которую принимает клиент: с наибольшим весом,
+    при равных весах - в порядке ENCODINGS
+
+    :return: кодирование или пустая строка - отдать исходный файл
+    """
+    weights = parse_accept_encoding(header_value)
+    best, best_weight = '', 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress_file(source_path: str, target_path: str, encoding: str) -> int:
+    """
+    Сжимаем файл source_path в target_path
+
+    :return: размер сжатого файла
+    """
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        if encoding == 'gzip':
+            # mtime=0 - одинаковое содержимое всегда дает одинаковую копию
+            with gzip.GzipFile(fileobj=target, mode='wb', mtime=0,
+                               compresslevel=GZIP_LEVEL) as compressed:
+                shutil.copyfileobj(source, compressed, READ_BUFFER_SIZE)
+        elif encoding == 'zstd' and zstandard is not None:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            compressor.copy_stream(source, target,
+                                   read_size=READ_BUFFER_SIZE)
+        else:
+            raise ValueError("Unsupported encoding: {}".format(encoding))
+        return target.tell()
+
+
+class BackgroundCompressor:
+    """
+    Фоновый поток, который создает сжатые копии новых файлов
+
+    Поток запускается при первой задаче в каждом процессе (после fork
+    потоки родителя не работают). make_temp_file создает временный файл
+    в каталоге временных файлов хранилища (post_handler.create_staging_file)
+    index - индекс хранилища, по умолчанию file_index.get_index
+    """
+
+    def __init__(self, storage_dir: str, encodings: Iterable[str],
+                 make_temp_file: Callable[[str], str],
+                 index: Optional[FileIndex] = None):
+        self.storage_dir = storage_dir
+        self.index = index
+        self.encodings: List[str] = [encoding for encoding in encodings
+                                     if encoding in ENCODINGS]
+        self.make_temp_file = make_temp_file
+        self.compressed = 0
+        self.skipped = 0
+        self._queue: Optional[queue.Queue] = None
+        self._pid = 0
+        self._lock = threading.Lock()
+
+    def submit(self, file_hash: str, file_abs_path: str):
+        """
+        Ставим файл в очередь на сжатие
+        """
+        if not self.encodings:
+            return
+        with self._lock:
+            if self._queue is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._queue,),
+                                 daemon=True).start()
+            self._queue.put((file_hash, file_abs_path))
+
+    def join(self):
+        """
+        Ждем, пока очередь будет обработана
+        """
+        if self._queue is not None:
+            self._queue.join()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики для GET /stats
+        """
+        return {'pending': self._queue.qsize() if self._queue else 0,
+                'compressed': self.compressed, 'skipped': self.skipped}
+
+    def _run(self, tasks: queue.Queue):
+        while True:
+            file_hash, file_abs_path = tasks.get()
+            try:
+                for encoding in self.encodings:
+                    self.compress(file_hash, file_abs_path, encoding)
+            except Exception as unknown_error:  # поток не должен упасть
+                logger.error("Compression of {} failed: {}", file_hash,
+                             unknown_error)
+            finally:
+                tasks.task_done()
+
+    def compress(self, file_hash: str, file_abs_path: str,
+                 encoding: str) -> bool:
+        """
+        Создаем сжатую копию файла и записываем ее в индекс
+
+        :return: True - если копия сохранена
+        """
+        try:
+            file_size = os.path.getsize(file_abs_path)
+        except FileNotFoundError:  # файл уже удален
+            return False
+        if file_size < MIN_COMPRESS_SIZE:
+            return False
+
+        # Временный файл - на томе исходного файла, чтобы его можно было
+        # переименовать в сжатую копию
+        temp_file = self.make_temp_file(
+            get_volumes(self.storage_dir).volume_of(file_abs_path))
+        try:
+            compressed_size = compress_file(file_abs_path, temp_file,
+                                            encoding)
+            if compressed_size > file_size * MAX_COMPRESS_RATIO:
+                self.skipped += 1
+                return False
+            os.replace(temp_file, variant_path(file_abs_path, encoding))
+        except FileNotFoundError:
+            return False
+        finally:
+            try:
+                os.remove(temp_file)
+            except FileNotFoundError:
+                pass
+
+        index = self.index or get_index(self.storage_dir)
+        index.add_variant(file_hash, encoding, compressed_size)
+        if index.lookup(file_hash) is None:
+            # Файл удалили, пока он сжимался
+            index.remove(file_hash)
+            os.remove(variant_path(file_abs_path, encoding))
+            return False
+        self.compressed += 1
+        logger.debug("Stored {} variant of {}: {} -> {} bytes", encoding,
+                     file_hash, file_size, compressed_size)
+        return True
+
+
+_compressor: Optional[BackgroundCompressor] = None
+
+
+def enable_background_compression(storage_dir: str,
+                                  encodings: Iterable[str],
+                                  make_temp_file: Callable[[str], str]
+                                  ) -> BackgroundCompressor:
+    """
+    Включаем сжатие новых файлов в фоне (см. submit)
+    """
+    global _compressor  # pylint: disable=global-statement
+    _compressor = BackgroundCompressor(storage_dir, encodings,
+                                       make_temp_file)
+    return _compressor
+
+
+def submit(file_hash: str, file_abs_path: str):
+    """
+    Ставим новый файл в очередь на сжатие, если сжатие включено
+    """
+    if _compressor is not None:
+        _compressor.submit(file_hash, file_abs_path)
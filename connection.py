@@ -0,0 +1,116 @@
+"""
+Клиентское подключение с буфером непрочитанных данных
+
+При постоянных соединениях (keep-alive) и конвейерной отправке запросов
+(pipelining) из сокета за один recv могут прийти окончание одного
+запроса и начало следующего. ClientConnection позволяет вернуть лишние
+байты обратно (unread), чтобы их получил разбор следующего запроса
+"""
+import time
+import socket
+from typing import Optional
+from http_parser import HttpRequest, RequestParser, MAX_HEAD_SIZE
+import metrics
+
+
+class ClientConnection:
+    """
+    Обертка над клиентским сокетом с методами recv/send, которые
+    ожидают обработчики запросов
+    """
+
+    def __init__(self, client_socket: socket.socket):
+        self.client_socket = client_socket
+        self._pending = b''
+        # Когда получены заголовки последнего запроса (time.perf_counter)
+        # и сколько секунд занял их разбор - для metrics
+        self.head_received = 0.0
+        self.head_parse_time = 0.0
+
+    def recv(self, buffer_size: int) -> bytes:
+        """
+        Сначала отдаем ранее возвращенные через unread данные, затем
+        читаем из сокета
+        """
+        if self._pending:
+            data = self._pending[:buffer_size]
+            self._pending = self._pending[buffer_size:]
+            return data
+        return self.client_socket.recv(buffer_size)
+
+    def unread(self, data: bytes):
+        """
+        Возвращаем прочитанные, но не использованные байты в начало буфера
+        """
+        if data:
+            self._pending = data + self._pending
+
+    def has_pending(self) -> bool:
+        """
+        Есть ли уже полученные данные следующего запроса
+        """
+        return bool(self._pending)
+
+    def send(self, data: bytes) -> int:
+        """
+        Отправляем данные целиком (socket.sendall), возвращаем их длину
+        """
+        metrics.count_sent(data)
+        self.client_socket.sendall(data)
+        return len(data)
+
+    def sendall(self, data: bytes):
+        """
+        Отправляем данные целиком
+        """
+        metrics.count_sent(data)
+        self.client_socket.sendall(data)
+
+    def fileno(self) -> int:
+        """
+        Файловый дескриптор сокета, нужен для os.sendfile
+        """
+        return self.client_socket.fileno()
+
+    def gettimeout(self):
+        """
+        Текущий таймаут сокета
+        """
+        return self.client_socket.gettimeout()
+
+    def settimeout(self, timeout):
+        """
+        Таймаут ожидания данных от клиента, None - без ограничения
+        """
+        self.client_socket.settimeout(timeout)
+
+    def close(self):
+        """
+        Закрываем клиентский сокет
+        """
+        self.client_socket.close()
+
+    def read_request(self, buffer_size: int,
+                     max_head_size: int = MAX_HEAD_SIZE
+                     ) -> Optional[HttpRequest]:
+        """
+        Читаем строку запроса и заголовки, сколько бы частей recv они ни
+        заняли. Все, что пришло после заголовков (начало тела запроса и,
+        возможно, следующий запрос), попадает в body разобранного запроса.
+        None - клиент закрыл соединение, не отправив запрос целиком
+
+        :raise HttpParseError: если запрос некорректен (400) или
+        заголовки длиннее max_head_size (431)
+        """
+        parser = RequestParser(max_head_size)
+        self.head_parse_time = 0.0
+        while True:
+            data = self.recv(buffer_size)
+            if not data:
+                return None
+            started = time.perf_counter()
+            request = parser.feed(data)
+            self.head_received = time.perf_counter()
+            self.head_parse_time += self.head_received - started
+            if request is not None:
+                return request
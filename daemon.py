@@ -31,6 +31,11 @@ Changes (1):
                 - Add signal.SIGHUP with sigtermhandler func
                 - Add logger with Loguru
                 - Add changes with PEP8
+                - stop() waits stop_timeout seconds for a graceful exit,
+                  then kills the process (SIGKILL)
+                - Add reload() and takeover() for restart without
+                  downtime: the running process starts its successor on
+                  reload_signal and exits after finishing its work
 """
 
 from __future__ import print_function
@@ -56,7 +61,12 @@ class Daemon:
 
     def __init__(self, pidfile, stdin=os.devnull,
                  stdout=os.devnull, stderr=os.devnull,
-                 home_dir='.', umask=0o22, verbose=1):
+                 home_dir='.', umask=0o22, verbose=1, stop_timeout=30,
+                 reload_signal=None):
+        self.stop_timeout = stop_timeout
+        # Signal that makes the running daemon start its successor,
+        # None - reload is not supported and restart() is stop() + start()
+        self.reload_signal = reload_signal
         self.stdin = stdin
         self.stdout = stdout
         self.stderr = stderr
@@ -189,6 +199,16 @@ class Daemon:
         self.daemonize()
         self.run(*args, **kwargs)
 
+    def takeover(self, *args, **kwargs):
+        """
+        Start the daemon in place of the running one (reload): the
+        pidfile is not checked and is rewritten with the new PID, the
+        previous process leaves it as it is on exit
+        """
+        self.log("Taking over...")
+        self.daemonize()
+        self.run(*args, **kwargs)
+
     def stop(self):
         """
         Stop the daemon
@@ -211,15 +231,19 @@ class Daemon:
 
             return  # Not an error in a restart
 
-        # Try killing the daemon process
+        # Ask the daemon process to finish its work, kill it after
+        # stop_timeout seconds
         try:
-            i = 0
+            os.kill(pid, signal.SIGTERM)
+            deadline = time.time() + self.stop_timeout
             while 1:
-                os.kill(pid, signal.SIGTERM)
                 time.sleep(0.1)
-                i = i + 1
-                if i % 10 == 0:
-                    os.kill(pid, signal.SIGHUP)
+                if time.time() > deadline:
+                    self.log("Process (pid %d) did not stop in %s s, "
+                             "killing" % (pid, self.stop_timeout))
+                    os.kill(pid, signal.SIGKILL)
+                    deadline = time.time() + self.stop_timeout
+                os.kill(pid, 0)
         except OSError as err:
             if err.errno == errno.ESRCH:
                 if os.path.exists(self.pidfile):
@@ -232,11 +256,42 @@ class Daemon:
 
     def restart(self):
         """
-        Restart the daemon
+        Restart the daemon: reload without downtime if it is supported
+        and the daemon is running, otherwise stop and start
         """
+        if self.reload():
+            return
         self.stop()
         self.start()
 
+    def reload(self, timeout=None):
+        """
+        Ask the running daemon to start its successor (reload_signal) and
+        wait until the successor writes its PID to the pidfile
+        :return: True - the successor is running
+        """
+        pid = self.get_pid()
+        if self.reload_signal is None or not pid:
+            return False
+
+        self.log("Reloading...")
+        try:
+            os.kill(pid, self.reload_signal)
+        except OSError as err:
+            if err.errno == errno.ESRCH:
+                return False
+            raise
+
+        deadline = time.time() + (timeout or self.stop_timeout)
+        while time.time() < deadline:
+            time.sleep(0.1)
+            new_pid = self.get_pid()
+            if new_pid and new_pid != pid:
+                self.log("Reloaded: pid %d -> %d" % (pid, new_pid))
+                return True
+        self.log("Successor of pid %d did not start" % pid)
+        return False
+
     def get_pid(self):
         """
         Get daemon Process ID
@@ -2,21 +2,60 @@
 Implementation of file deletion on DELETE method
 """
 import os
+from file_index import get_index
+from stat_cache import get_stat_cache
+from read_cache import get_read_cache
+from compression import variant_key, variant_path
+from pack_store import get_pack_store
+from volumes import get_volumes
 
 
 def delete_file(file_hash, file_abs_path):
     """
+    Убираем одну ссылку на файл (file_index.FileIndex.release). Вместе с
+    последней ссылкой удаляем файл и его сжатые копии из хранилища,
+    индекса и кэшей, а также его каталоги, если в них больше нет файлов.
+    Файл из pack-файла помечается удаленным, место освобождает
+    pack_store.PackStore.compact
 
-    :param file_hash:
-    :param file_abs_path:
-    :return:
+    :param file_hash: хэш (ключ) удаляемого файла
+    :param file_abs_path: полный путь к файлу в хранилище
+    :return: True - если ссылка или файл были удалены
     """
+    index = get_index()
+    remaining = index.release(file_hash)
+    if remaining or remaining == 0 and index.lookup(file_hash) is not None:
+        # То же содержимое загружено еще раз (или загружено снова сразу
+        # после того, как убрана последняя ссылка), файл остается для
+        # других загрузивших его
+        get_stat_cache().invalidate(file_hash)
+        return True
+
+    if get_pack_store().delete(file_hash):
+        index.remove(file_hash)
+        get_stat_cache().invalidate(file_hash)
+        get_read_cache().evict(file_hash)
+        return True
+
+    for encoding in index.variants(file_hash):
+        get_read_cache().evict(variant_key(file_hash, encoding))
+        try:
+            os.remove(variant_path(file_abs_path, encoding))
+        except FileNotFoundError:
+            pass
+
     try:
         os.remove(file_abs_path)
     except FileNotFoundError:
-        return False
+        # Файла нет, а индекс считает иначе - убираем устаревшую запись
+        is_deleted = False
     else:
-        file_dir_len = len(file_abs_path) - len(file_hash)
-        os.rmdir(file_abs_path[:file_dir_len])
+        is_deleted = True
+    index.remove(file_hash)
+    get_stat_cache().invalidate(file_hash)
+    get_read_cache().evict(file_hash)
+    if not is_deleted:
+        return False
 
+    get_volumes().remove_empty_dirs(file_abs_path)
     return True
@@ -0,0 +1,336 @@
+"""
+Движки (engines) для параллельной обработки клиентских подключений
+
+Все движки принимают подключения на общем серверном сокете, полученном
+из server.get_server_socket, и передают каждое из них в обработчик
+handler(client_socket, client_addr):
+- threads - один поток принимает подключения и складывает их в
+ограниченную очередь, из которой их забирает пул потоков-обработчиков;
+если очередь заполнена, клиент сразу получает 503 Service Unavailable;
+- prefork - несколько процессов (fork) вызывают accept на одном и том же
+слушающем сокете, очередь ожидающих клиентов ограничена параметром listen.
+Движок asyncio реализован отдельно в модуле async_server.
+
+Счетчики движка (EngineStats) лежат в разделяемой памяти, поэтому для
+prefork они суммируются по всем процессам.
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import socket
+import threading
+import multiprocessing
+from typing import Callable, Dict, List, Tuple
+from loguru import logger
+import graceful
+import profiling
+
+ENGINES: Tuple[str, ...] = ('sync', 'threads', 'prefork', 'asyncio')
+DEFAULT_WORKERS: int = 8
+DEFAULT_QUEUE_SIZE: int = 64
+
+ClientHandler = Callable[[socket.socket, Tuple], None]
+
+SERVICE_UNAVAILABLE = ("HTTP/1.1 503 Service Unavailable\r\n"
+                       "Retry-After: 1\r\n"
+                       "Content-Length: 0\r\n"
+                       "Connection: close\r\n\r\n").encode()
+
+
+class EngineStats:
+    """
+    Счетчики движка в разделяемой между процессами памяти
+
+    accepted - принято подключений
+    rejected - отклонено из-за переполнения очереди (503)
+    completed - обработано подключений
+    failed - обработчик завершился с исключением
+    active - обрабатывается прямо сейчас
+    queued - ожидает свободного обработчика
+    peak_queued - максимальная длина очереди за время работы
+    """
+    FIELDS: Tuple[str, ...] = ('accepted', 'rejected', 'completed', 'failed',
+                               'active', 'queued', 'peak_queued')
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._lock = multiprocessing.Lock()
+        self._values = multiprocessing.RawArray('q', len(self.FIELDS))
+
+    def incr(self, name: str, delta: int = 1) -> int:
+        """
+        Изменяем счетчик name на delta и возвращаем новое значение
+        """
+        index = self.FIELDS.index(name)
+        with self._lock:
+            self._values[index] += delta
+            value = self._values[index]
+            if name == 'queued':
+                # Счетчик увеличивается до постановки в очередь, поэтому
+                # при переполнении он на время превышает размер очереди
+                queued = min(value, self.queue_size) \
+                    if self.queue_size > 0 else value
+                peak = self.FIELDS.index('peak_queued')
+                self._values[peak] = max(self._values[peak], queued)
+        return value
+
+    def snapshot(self) -> Dict[str, int]:
+        """
+        Текущие значения счетчиков вместе с параметрами движка
+        """
+        with self._lock:
+            values = dict(zip(self.FIELDS, self._values))
+        values['workers'] = self.workers
+        values['queue_size'] = self.queue_size
+        return values
+
+
+def reject_connection(client_socket: socket.socket):
+    """
+    Отвечаем 503 Service Unavailable и закрываем подключение, не читая
+    запрос клиента, чтобы не занимать ресурсы при перегрузке
+    """
+    try:
+        client_socket.send(SERVICE_UNAVAILABLE)
+    except OSError as os_error:
+        logger.debug("Can't send 503 to client: {}", os_error)
+    finally:
+        client_socket.close()
+
+
+class ThreadPoolEngine:
+    """
+    Пул потоков с ограниченной очередью принятых подключений
+    """
+
+    def __init__(self, server_socket: socket.socket, handler: ClientHandler,
+                 workers: int = DEFAULT_WORKERS,
+                 queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.server_socket = server_socket
+        self.handler = handler
+        self.workers = workers
+        self.stats = EngineStats(workers, queue_size)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._threads: List[threading.Thread] = []
+
+    def serve_forever(self):
+        """
+        Запускаем потоки-обработчики и принимаем подключения в текущем
+        потоке до прерывания (KeyboardInterrupt) или закрытия сокета
+        """
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker,
+                                      name='worker-{}'.format(number),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        # По SIGTERM закрываем сокет: accept завершится ошибкой
+        graceful.install_handlers(self.server_socket.close,
+                                  self.server_socket)
+        logger.info("Thread pool engine: {} workers, queue size {}",
+                    self.workers, self.stats.queue_size)
+        try:
+            while True:
+                try:
+                    client_socket, client_addr = self.server_socket.accept()
+                except OSError as os_error:
+                    logger.debug("Server socket was closed: {}", os_error)
+                    break
+                self.stats.incr('accepted')
+                # Счетчик увеличивается до put_nowait: иначе обработчик
+                # может взять подключение и уменьшить его раньше
+                self.stats.incr('queued')
+                try:
+                    self._queue.put_nowait((client_socket, client_addr))
+                except queue.Full:
+                    self.stats.incr('queued', -1)
+                    self.stats.incr('rejected')
+                    logger.warning("503 Service Unavailable: queue is full, "
+                                   "client {}", client_addr)
+                    reject_connection(client_socket)
+        except KeyboardInterrupt as interruption_error:
+            logger.debug("Engine was interrupted: {}", interruption_error)
+        finally:
+            self.stop()
+        if graceful.is_draining():
+            self.join(graceful.DRAIN_TIMEOUT)
+
+    def join(self, timeout: float):
+        """
+        Ждем не дольше timeout секунд, пока потоки-обработчики закончат
+        уже принятые подключения
+        """
+        logger.info("Draining {} connections",
+                    self.stats.snapshot()['active'] + self._queue.qsize())
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        unfinished = self.stats.snapshot()['active']
+        if unfinished:
+            logger.warning("{} connections were not finished in {} s",
+                           unfinished, timeout)
+
+    def stop(self):
+        """
+        Закрываем серверный сокет и просим потоки завершиться после
+        обработки уже принятых подключений
+        """
+        self.server_socket.close()
+        for _ in self._threads:
+            self._queue.put(None)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            client_socket, client_addr = item
+            self.stats.incr('queued', -1)
+            self.stats.incr('active')
+            try:
+                self.handler(client_socket, client_addr)
+            except Exception as unknown_error:
+                self.stats.incr('failed')
+                logger.error("Worker failed on {}: {}", client_addr,
+                             unknown_error)
+            finally:
+                client_socket.close()
+                self.stats.incr('active', -1)
+                self.stats.incr('completed')
+
+
+class PreforkEngine:
+    """
+    Несколько процессов, принимающих подключения на общем сокете.
+    Родительский процесс только следит за потомками и перезапускает
+    упавшие процессы
+    """
+
+    def __init__(self, server_socket: socket.socket, handler: ClientHandler,
+                 workers: int = DEFAULT_WORKERS,
+                 backlog: int = DEFAULT_QUEUE_SIZE):
+        self.server_socket = server_socket
+        self.handler = handler
+        self.workers = workers
+        # Очередью для prefork служит backlog слушающего сокета (listen)
+        self.stats = EngineStats(workers, backlog)
+        self.children: List[int] = []
+        self._stopping = False
+
+    def serve_forever(self):
+        """
+        Создаем процессы-обработчики и ждем их завершения, перезапуская
+        упавшие, пока родителя не остановят (SIGTERM/KeyboardInterrupt)
+        """
+        for _ in range(self.workers):
+            self._spawn()
+        # Профилируются процессы-обработчики, а не родитель
+        profiling.forward_profile_signal(lambda: list(self.children))
+        graceful.install_handlers(self._drain, self.server_socket)
+
+        logger.info("Prefork engine: {} worker processes", self.workers)
+        try:
+            while self.children:
+                pid, status = os.wait()
+                if pid not in self.children:
+                    continue
+                self.children.remove(pid)
+                if not (self._stopping or graceful.is_draining()):
+                    logger.warning("Worker {} exited with status {}, respawn",
+                                   pid, status)
+                    self._spawn()
+        finally:
+            self.stop()
+
+    def _drain(self):
+        # Обработчик сигнала: процессы-обработчики дообрабатывают
+        # подключения и завершаются сами
+        self._stopping = True
+        self.server_socket.close()
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def stop(self):
+        """
+        Останавливаем все процессы-обработчики
+        """
+        self._stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in self.children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.children = []
+        self.server_socket.close()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children.append(pid)
+            return
+
+        # Процесс-потомок: обработчики сигналов демона ему не нужны,
+        # по SIGTERM он заканчивает текущее подключение и завершается
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        graceful.install_handlers(self._drain_worker)
+        profiling.reset_profile_signal()
+        exit_code = 0
+        try:
+            self._worker()
+        except BaseException as unknown_error:
+            logger.error("Worker {} failed: {}", os.getpid(), unknown_error)
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+    def _drain_worker(self):
+        self.server_socket.close()
+        graceful.set_deadline()
+
+    def _worker(self):
+        while True:
+            try:
+                client_socket, client_addr = self.server_socket.accept()
+            except OSError:
+                if graceful.is_draining():
+                    return
+                raise
+            self.stats.incr('accepted')
+            self.stats.incr('active')
+            try:
+                self.handler(client_socket, client_addr)
+            except Exception as unknown_error:
+                self.stats.incr('failed')
+                logger.error("Worker failed on {}: {}", client_addr,
+                             unknown_error)
+            finally:
+                client_socket.close()
+                self.stats.incr('active', -1)
+                self.stats.incr('completed')
+
+
+def create_engine(name: str, server_socket: socket.socket,
+                  handler: ClientHandler, workers: int = DEFAULT_WORKERS,
+                  queue_size: int = DEFAULT_QUEUE_SIZE):
+    """
+    Создаем движок по имени из ENGINES (кроме 'sync', который реализован
+    циклом server.accept_connections, и 'asyncio' из модуля async_server)
+    """
+    if name == 'threads':
+        return ThreadPoolEngine(server_socket, handler, workers, queue_size)
+    if name == 'prefork':
+        return PreforkEngine(server_socket, handler, workers, queue_size)
+    raise ValueError("Unknown engine: {}".format(name))
@@ -1,19 +1,117 @@
 """
 Module for file hashing algorithms
+
+Algorithms are registered in HASH_ALGORITHMS by name. MD5 stays the
+default for compatibility with already stored files, SHA-256 and BLAKE2b
+come from hashlib, xxh3 and BLAKE3 are registered only when the optional
+xxhash / blake3 packages are installed.
+
+Keys of stored files record the algorithm: MD5 keys are bare hex digests
+(as before), keys of other algorithms look like <algorithm>-<hexdigest>.
 """
+import string
 import hashlib
+from typing import Callable, Dict, Optional, Tuple
 
+try:
+    import xxhash
+except ImportError:  # optional dependency
+    xxhash = None
 
-def get_hash_md5(filename: str) -> str:
+try:
+    import blake3
+except ImportError:  # optional dependency
+    blake3 = None
+
+DEFAULT_ALGORITHM: str = 'md5'
+READ_BUFFER_SIZE: int = 65536
+KEY_SEPARATOR: str = '-'
+
+HASH_ALGORITHMS: Dict[str, Callable] = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'blake2b': hashlib.blake2b,
+}
+if xxhash is not None:
+    HASH_ALGORITHMS['xxh3'] = xxhash.xxh3_128
+if blake3 is not None:
+    HASH_ALGORITHMS['blake3'] = blake3.blake3
+
+# Length of hex digest for every registered algorithm
+DIGEST_LENGTHS: Dict[str, int] = {
+    name: len(factory().hexdigest()) for name, factory in
+    HASH_ALGORITHMS.items()}
+
+_active_algorithm: str = DEFAULT_ALGORITHM
+
+
+def set_algorithm(algorithm: str):
     """
-    Simple hash MD5 algorithm using hashlib
+    Select algorithm for new uploads of this deployment
+    """
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError("Unknown hash algorithm: {}".format(algorithm))
+    global _active_algorithm  # pylint: disable=global-statement
+    _active_algorithm = algorithm
+
+
+def get_algorithm() -> str:
+    """
+    Algorithm selected for new uploads
+    """
+    return _active_algorithm
+
+
+def get_hasher(algorithm: Optional[str] = None):
+    """
+    Incremental hash object (update/hexdigest) for hashing data while it
+    is being received, without reading the written file again
     """
-    # OPTIMIZE: use more fast hash algorithm
+    return HASH_ALGORITHMS[algorithm or _active_algorithm]()
+
+
+def make_hash_key(algorithm: str, hexdigest: str) -> str:
+    """
+    Key of stored file for digest produced by algorithm
+    """
+    if algorithm == 'md5':
+        return hexdigest
+    return algorithm + KEY_SEPARATOR + hexdigest
+
+
+def split_hash_key(key: str) -> Optional[Tuple[str, str]]:
+    """
+    Algorithm and hex digest from key of stored file, None if key is not
+    a valid key for one of registered algorithms
+    """
+    algorithm, separator, hexdigest = key.rpartition(KEY_SEPARATOR)
+    if not separator:
+        algorithm = 'md5'
+    if DIGEST_LENGTHS.get(algorithm) != len(hexdigest):
+        return None
+    if not all(symbol in string.hexdigits for symbol in hexdigest):
+        return None
+    return algorithm, hexdigest.lower()
+
+
+def get_file_hash(filename: str, algorithm: Optional[str] = None,
+                  buffer_size: int = READ_BUFFER_SIZE) -> str:
+    """
+    Key of file content for algorithm (selected one by default)
+    """
+    algorithm = algorithm or _active_algorithm
+    hash_obj = get_hasher(algorithm)
     with open(filename, 'rb') as reading_file:
-        hash_obj = hashlib.md5()
         while True:
-            data = reading_file.read(8192)
+            data = reading_file.read(buffer_size)
             if not data:
                 break
             hash_obj.update(data)
-        return hash_obj.hexdigest()
+    return make_hash_key(algorithm, hash_obj.hexdigest())
+
+
+def get_hash_md5(filename: str) -> str:
+    """
+    Simple hash MD5 algorithm using hashlib
+    """
+    return get_file_hash(filename, 'md5')
@@ -0,0 +1,397 @@
+"""
+Индекс файлов хранилища для дедупликации по содержимому
+
+Для каждого ключа файла хранятся размер, время добавления и количество
+ссылок - сколько раз это содержимое было загружено. Наличие и размер
+файла проверяются поиском по первичному ключу SQLite без обращения к
+файловой системе, а повторная загрузка уже известного содержимого только
+увеличивает счетчик ссылок. Удаление уменьшает счетчик, а сам файл
+удаляется вместе с последней ссылкой
+
+Для файлов, у которых есть сжатые копии (compression), в индексе
+записаны кодирование и размер каждой копии, а для небольших файлов,
+сложенных в pack-файлы (pack_store), - номер pack-файла, смещение и
+длина. Если у хранилища несколько томов (volumes), записан том каждого
+нового файла.
+
+Индекс лежит в хранилище (store/index.sqlite3). При первом открытии он
+заполняется по уже сохраненным файлам
+"""
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from loguru import logger
+from file_hashing import split_hash_key
+
+INDEX_FILE_NAME = 'index.sqlite3'
+DEFAULT_STORAGE_DIR = str(Path().parent.absolute()) + '/store/'
+# Сколько секунд ждать, пока другой процесс освободит базу
+BUSY_TIMEOUT: float = 5.0
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS objects ('
+    'key TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, '
+    'refcount INTEGER NOT NULL DEFAULT 1) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS variants ('
+    'key TEXT NOT NULL, encoding TEXT NOT NULL, size INTEGER NOT NULL, '
+    'PRIMARY KEY (key, encoding)) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS packed ('
+    'key TEXT PRIMARY KEY, pack INTEGER NOT NULL, offset INTEGER NOT NULL, '
+    'length INTEGER NOT NULL) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS packed_by_pack ON packed (pack)',
+    'CREATE TABLE IF NOT EXISTS placed ('
+    'key TEXT PRIMARY KEY, volume TEXT NOT NULL) WITHOUT ROWID',
+)
+
+
+class IndexEntry(NamedTuple):
+    """
+    Запись индекса: размер файла, время добавления и количество ссылок
+    """
+    size: int
+    mtime: float
+    refcount: int
+
+
+class PackedEntry(NamedTuple):
+    """
+    Расположение файла в pack-файле: номер pack-файла, смещение данных
+    файла и их длина
+    """
+    pack: int
+    offset: int
+    length: int
+
+
+def iter_stored_files(storage_dir: str) -> Iterator[Tuple[str, str]]:
+    """
+    Файлы в каталогах хранилища при любой схеме шардирования: имя файла
+    и каталог относительно хранилища. Каталоги, которые начинаются с
+    точки (временные файлы, pack-файлы), пропускаются
+    """
+    for dir_path, dir_names, file_names in os.walk(storage_dir):
+        dir_names[:] = [name for name in dir_names
+                        if not name.startswith('.')]
+        rel_dir = os.path.relpath(dir_path, storage_dir)
+        if rel_dir == '.':
+            continue
+        for file_name in file_names:
+            yield file_name, rel_dir.replace(os.sep, '/') + '/'
+
+
+def is_shard_dir(file_hash: str, rel_dir: str) -> bool:
+    """
+    Подходит ли каталог rel_dir ('ab/cd/') файлу при какой-нибудь схеме:
+    названия каталогов одной длины и вместе составляют начало хэша
+    """
+    hash_key = split_hash_key(file_hash)
+    parts = rel_dir.rstrip('/').split('/')
+    if not hash_key or len({len(part) for part in parts}) != 1:
+        return False
+    return hash_key[1].startswith(''.join(parts))
+
+
+class FileIndex:
+    """
+    Индекс файлов одного хранилища
+
+    Соединение с базой открывается отдельно в каждом потоке и в каждом
+    процессе (после fork соединение родителя использовать нельзя)
+    """
+
+    def __init__(self, storage_dir: str):
+        self.storage_dir = storage_dir
+        self.path = storage_dir + INDEX_FILE_NAME
+        self._local = threading.local()
+        if self.get_meta('built') is None:
+            self.rebuild()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(self.storage_dir, exist_ok=True)
+            # isolation_level=None - каждый запрос фиксируется сразу
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_meta(self, name: str) -> Optional[str]:
+        """
+        Служебное значение индекса (например, схема шардирования
+        storage_paths), None - значение не записано
+        """
+        row = self._connection().execute(
+            'SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name: str, value: Optional[str]):
+        """
+        Записываем служебное значение, None - удаляем его
+        """
+        if value is None:
+            self._connection().execute('DELETE FROM meta WHERE name = ?',
+                                       (name,))
+        else:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                (name, value))
+
+    def lookup(self, key: str) -> Optional[IndexEntry]:
+        """
+        Запись индекса для ключа файла, None - такого файла нет
+        """
+        row = self._connection().execute(
+            'SELECT size, mtime, refcount FROM objects WHERE key = ?',
+            (key,)).fetchone()
+        return IndexEntry(*row) if row else None
+
+    def add(self, key: str, size: int, mtime: Optional[float] = None) -> int:
+        """
+        Добавляем ссылку на файл: новый ключ записывается с одной ссылкой,
+        у известного увеличивается счетчик ссылок
+
+        :return: количество ссылок после добавления
+        """
+        connection = self._connection()
+        connection.execute(
+            'INSERT INTO objects (key, size, mtime) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET refcount = refcount + 1',
+            (key, size, time.time() if mtime is None else mtime))
+        return connection.execute(
+            'SELECT refcount FROM objects WHERE key = ?',
+            (key,)).fetchone()[0]
+
+    def add_reference(self, key: str) -> bool:
+        """
+        Добавляем ссылку на файл, только если он уже есть в индексе:
+        проверка и увеличение счетчика ссылок выполняются одним запросом
+
+        :return: True - ссылка добавлена, False - такого файла нет
+        """
+        cursor = self._connection().execute(
+            'UPDATE objects SET refcount = refcount + 1 WHERE key = ?',
+            (key,))
+        return cursor.rowcount > 0
+
+    def release(self, key: str) -> Optional[int]:
+        """
+        Убираем одну ссылку на файл. Вместе с последней ссылкой в той же
+        транзакции удаляется запись файла, поэтому параллельный
+        add_reference либо успевает добавить ссылку раньше, либо уже не
+        находит файл
+
+        :return: сколько ссылок осталось (0 - это была последняя ссылка,
+        файл нужно удалить), None - такого файла нет
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = connection.execute(
+                'UPDATE objects SET refcount = refcount - 1 '
+                'WHERE key = ? AND refcount > 1', (key,))
+            if cursor.rowcount:
+                remaining = connection.execute(
+                    'SELECT refcount FROM objects WHERE key = ?',
+                    (key,)).fetchone()[0]
+            else:
+                cursor = connection.execute(
+                    'DELETE FROM objects WHERE key = ?', (key,))
+                remaining = 0 if cursor.rowcount else None
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return remaining
+
+    def remove(self, key: str) -> bool:
+        """
+        Удаляем файл из индекса вместе со всеми ссылками на него, его
+        сжатыми копиями, расположением в pack-файле и томом
+        """
+        connection = self._connection()
+        connection.execute('DELETE FROM variants WHERE key = ?', (key,))
+        connection.execute('DELETE FROM packed WHERE key = ?', (key,))
+        connection.execute('DELETE FROM placed WHERE key = ?', (key,))
+        cursor = connection.execute(
+            'DELETE FROM objects WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def add_variant(self, key: str, encoding: str, size: int):
+        """
+        Записываем сжатую копию файла
+        """
+        self._connection().execute(
+            'INSERT OR REPLACE INTO variants (key, encoding, size) '
+            'VALUES (?, ?, ?)', (key, encoding, size))
+
+    def variants(self, key: str) -> Dict[str, int]:
+        """
+        Сжатые копии файла: кодирование и размер копии
+        """
+        return dict(self._connection().execute(
+            'SELECT encoding, size FROM variants WHERE key = ?', (key,)))
+
+    def claim_volume(self, key: str, volume: str) -> bool:
+        """
+        Записываем том файла, если том этого ключа еще не записан
+
+        :return: True - файл с этим ключом записан на этот том
+        """
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR IGNORE INTO placed (key, volume) VALUES (?, ?)',
+            (key, volume))
+        return self.lookup_volume(key) == volume
+
+    def lookup_volume(self, key: str) -> Optional[str]:
+        """
+        Том файла, None - файл в основном каталоге хранилища
+        """
+        row = self._connection().execute(
+            'SELECT volume FROM placed WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def volume_counts(self) -> Dict[str, int]:
+        """
+        Количество файлов с записанным томом на каждом томе
+        """
+        return dict(self._connection().execute(
+            'SELECT volume, COUNT(*) FROM placed GROUP BY volume'))
+
+    def add_packed(self, key: str, entry: PackedEntry):
+        """
+        Записываем (или переносим при уплотнении) расположение файла в
+        pack-файле
+        """
+        self._connection().execute(
+            'INSERT OR REPLACE INTO packed (key, pack, offset, length) '
+            'VALUES (?, ?, ?, ?)', (key,) + tuple(entry))
+
+    def lookup_packed(self, key: str) -> Optional[PackedEntry]:
+        """
+        Расположение файла в pack-файле, None - файл лежит отдельно
+        """
+        row = self._connection().execute(
+            'SELECT pack, offset, length FROM packed WHERE key = ?',
+            (key,)).fetchone()
+        return PackedEntry(*row) if row else None
+
+    def remove_packed(self, key: str) -> bool:
+        """
+        Удаляем расположение файла в pack-файле
+        """
+        cursor = self._connection().execute(
+            'DELETE FROM packed WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def packed_in(self, pack: int) -> List[Tuple[str, PackedEntry]]:
+        """
+        Все файлы pack-файла: ключ и расположение
+        """
+        return [(row[0], PackedEntry(*row[1:]))
+                for row in self._connection().execute(
+                    'SELECT key, pack, offset, length FROM packed '
+                    'WHERE pack = ? ORDER BY offset', (pack,))]
+
+    def packed_sizes(self) -> Dict[int, int]:
+        """
+        Объем живых (не удаленных) данных каждого pack-файла
+        """
+        return dict(self._connection().execute(
+            'SELECT pack, SUM(length) FROM packed GROUP BY pack'))
+
+    def rebuild(self, volume_dirs: Iterable[str] = ()) -> int:
+        """
+        Заполняем индекс заново по файлам, которые лежат в хранилище
+
+        :param volume_dirs: каталоги дополнительных томов хранилища
+        :return: количество найденных файлов
+        """
+        entries = []
+        variants = []
+        placed = []
+        for volume_dir in [self.storage_dir, *volume_dirs]:
+            for file_name, shard_dir in iter_stored_files(volume_dir):
+                # Сжатая копия называется <ключ>.<кодирование>
+                key, dot, encoding = file_name.partition('.')
+                if not is_shard_dir(key, shard_dir):
+                    continue
+                file_stat = os.stat(volume_dir + shard_dir + file_name)
+                if dot:
+                    variants.append((key, encoding, file_stat.st_size))
+                    continue
+                entries.append((key, file_stat.st_size, file_stat.st_mtime))
+                if volume_dir != self.storage_dir:
+                    placed.append((key, volume_dir))
+
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM objects')
+            connection.execute('DELETE FROM variants')
+            connection.execute('DELETE FROM placed')
+            connection.executemany(
+                'INSERT OR IGNORE INTO objects (key, size, mtime) '
+                'VALUES (?, ?, ?)', entries)
+            connection.executemany(
+                'INSERT OR IGNORE INTO variants (key, encoding, size) '
+                'VALUES (?, ?, ?)', variants)
+            connection.executemany(
+                'INSERT OR IGNORE INTO placed (key, volume) VALUES (?, ?)',
+                placed)
+            # Файлы из pack-файлов в каталогах хранилища не видны
+            connection.execute(
+                'INSERT OR IGNORE INTO objects (key, size, mtime) '
+                'SELECT key, length, ? FROM packed', (time.time(),))
+            connection.execute(
+                "INSERT OR REPLACE INTO meta (name, value) "
+                "VALUES ('built', ?)", (str(time.time()),))
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        logger.info("File index was rebuilt: {} files", len(entries))
+        return len(entries)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики индекса для GET /stats: количество файлов, их общий
+        размер, количество ссылок и объем, сэкономленный дедупликацией
+        """
+        objects, total_bytes, references, saved_bytes = \
+            self._connection().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), '
+                'COALESCE(SUM(refcount), 0), '
+                'COALESCE(SUM(size * (refcount - 1)), 0) '
+                'FROM objects').fetchone()
+        return {'objects': objects, 'bytes': total_bytes,
+                'references': references, 'deduplicated_bytes': saved_bytes}
+
+
+_index: Optional[FileIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index(storage_dir: Optional[str] = None) -> FileIndex:
+    """
+    Индекс хранилища storage_dir (по умолчанию - открытого последним или
+    DEFAULT_STORAGE_DIR), открывается при первом обращении
+    """
+    global _index  # pylint: disable=global-statement
+    with _index_lock:
+        if storage_dir is None:
+            storage_dir = _index.storage_dir if _index else \
+                DEFAULT_STORAGE_DIR
+        if _index is None or _index.storage_dir != storage_dir:
+            _index = FileIndex(storage_dir)
+        return _index
@@ -1,27 +1,421 @@
 """
 Implementation of file Download on GET method
+
+Файл отдается без копирования в пространство пользователя через
+os.sendfile (ядро само передает страницы файла в сокет). Если sendfile
+недоступен для данного сокета или платформы, используется буферизованное
+чтение файла крупными частями. Небольшие и средние файлы отдаются из
+кэша содержимого (read_cache) без повторного открытия файла
 """
+import os
+import uuid
+import errno
+import select
+import asyncio
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from loguru import logger
+from file_hashing import split_hash_key
+from read_cache import get_read_cache
+from compression import negotiate_encoding, variant_key, variant_path
+import metrics
+
+# Максимальный объем данных за один вызов sendfile
+SENDFILE_MAX_CHUNK: int = 8 * 1024 * 1024
+# Размер буфера для чтения файла, если sendfile недоступен
+BUFFER_SIZE: int = 64 * 1024
+# Ошибки, означающие, что sendfile не поддерживается для этого сокета
+SENDFILE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK,
+                        errno.EOPNOTSUPP)
+# Больше диапазонов в одном запросе не обслуживаем, отдаем файл целиком
+MAX_RANGES: int = 16
+CONTENT_TYPE = 'application/octet-stream'
+
+
+class DownloadPlan(NamedTuple):
+    """
+    Что и как отдавать на GET-запрос
+
+    status - 200, 206, 304 или 416
+    headers - дополнительные заголовки ответа
+    content_length - длина тела ответа, None - без тела (304)
+    ranges - список диапазонов (start, end) включительно, которые надо
+    отправить; для 200 это весь файл
+    boundary - разделитель частей multipart/byteranges, если диапазонов
+    несколько, иначе пустая строка
+    encoding - кодирование сжатой копии файла, которую нужно отдать,
+    пустая строка - исходный файл
+    size - размер отдаваемого файла или его сжатой копии
+    """
+    status: int
+    headers: Dict[str, str]
+    content_length: Optional[int]
+    ranges: List[Tuple[int, int]]
+    boundary: str = ''
+    encoding: str = ''
+    size: int = 0
+
+
+def file_metadata(file_hash: str, index_entry) -> Dict:
+    """
+    Метаданные файла для GET /meta по записи индекса
+    (file_index.IndexEntry): размер, алгоритм хэширования, время
+    добавления (Unix time) и количество ссылок
+    """
+    return {'hash': file_hash,
+            'algorithm': split_hash_key(file_hash)[0],
+            'size': index_entry.size,
+            'created': index_entry.mtime,
+            'references': index_entry.refcount}
+
+
+def make_etag(file_hash: str) -> str:
+    """
+    Файлы адресуются хэшом содержимого, поэтому хэш - это сильный ETag
+    """
+    return '"{}"'.format(file_hash)
+
+
+def etag_matches(header_value: str, etag: str, weak: bool = True) -> bool:
+    """
+    Проверяем, есть ли etag в списке из заголовка If-None-Match или
+    If-Range. При слабом сравнении (weak) префикс W/ не учитывается
+    """
+    if header_value.strip() == '*':
+        return True
+    for candidate in header_value.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def parse_range_header(range_header: str,
+                       file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Разбираем заголовок Range вида bytes=0-99,200-,-50
+
+    :return: список диапазонов (start, end) включительно; пустой список,
+    если ни один диапазон не попадает в файл (416); None, если заголовок
+    некорректен и его нужно проигнорировать (отдаем файл целиком)
+    """
+    unit, _, range_set = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or not range_set.strip():
+        return None
+
+    specs = range_set.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else file_size - 1
+                if start < 0 or (last and end < start):
+                    return None
+            else:  # -N - последние N байт
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start = max(file_size - suffix, 0)
+                end = file_size - 1
+        except ValueError:
+            return None
+        if start < file_size:
+            ranges.append((start, min(end, file_size - 1)))
+    return ranges
+
+
+def plan_download(req_headers: Dict, file_hash: str, file_size: int,
+                  variants: Optional[Dict[str, int]] = None) -> DownloadPlan:
+    """
+    Выбираем ответ на GET-запрос с учетом заголовков If-None-Match,
+    Range, If-Range и Accept-Encoding
+
+    :param variants: сжатые копии файла (FileIndex.variants) - кодирование
+    и размер; сжатая копия отдается целиком, запросы Range
+    обслуживаются по исходному файлу
+    """
+    range_header = req_headers.get('Range')
+    encoding = ''
+    if variants and not range_header:
+        encoding = negotiate_encoding(req_headers.get('Accept-Encoding', ''),
+                                      variants)
+    # У сжатой копии свой ETag, ключ файла остается прежним
+    etag = make_etag(variant_key(file_hash, encoding))
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes',
+               'Vary': 'Accept-Encoding',
+               'X-Hash-Algorithm': split_hash_key(file_hash)[0]}
+
+    if_none_match = req_headers.get('If-None-Match')
+    if if_none_match and etag_matches(if_none_match, etag):
+        return DownloadPlan(304, headers, None, [])
+
+    if encoding:
+        size = variants[encoding]
+        return DownloadPlan(200, dict(headers, **{
+            'Content-Type': CONTENT_TYPE, 'Content-Encoding': encoding}),
+            size, [(0, size - 1)], encoding=encoding, size=size)
+
+    full_file = DownloadPlan(200, dict(headers, **{
+        'Content-Type': CONTENT_TYPE}), file_size, [(0, file_size - 1)],
+        size=file_size)
+
+    if not range_header:
+        return full_file
+    # If-Range со старым ETag (или датой) - отдаем новую версию целиком
+    if_range = req_headers.get('If-Range')
+    if if_range and not etag_matches(if_range, etag, weak=False):
+        return full_file
+
+    ranges = parse_range_header(range_header, file_size)
+    if ranges is None:
+        return full_file
+    if not ranges:
+        headers['Content-Range'] = 'bytes */{}'.format(file_size)
+        return DownloadPlan(416, headers, 0, [])
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Type'] = CONTENT_TYPE
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end,
+                                                           file_size)
+        return DownloadPlan(206, headers, end - start + 1, ranges,
+                            size=file_size)
+
+    boundary = uuid.uuid4().hex
+    headers['Content-Type'] = \
+        'multipart/byteranges; boundary={}'.format(boundary)
+    content_length = len(multipart_tail(boundary))
+    for start, end in ranges:
+        content_length += len(multipart_part_head(boundary, start, end,
+                                                  file_size))
+        content_length += end - start + 1
+    return DownloadPlan(206, headers, content_length, ranges, boundary,
+                        size=file_size)
+
+
+def multipart_part_head(boundary: str, start: int, end: int,
+                        file_size: int) -> bytes:
+    """
+    Заголовки одной части ответа multipart/byteranges
+    """
+    return ("\r\n--{}\r\n"
+            "Content-Type: {}\r\n"
+            "Content-Range: bytes {}-{}/{}\r\n\r\n").format(
+                boundary, CONTENT_TYPE, start, end, file_size).encode()
+
 
+def multipart_tail(boundary: str) -> bytes:
+    """
+    Завершающий разделитель ответа multipart/byteranges
+    """
+    return "\r\n--{}--\r\n".format(boundary).encode()
+
+
+def send_planned_to_client(client_socket, file_abs_path, plan, file_size,
+                           file_hash: str = '', offset: int = 0):
+    """
+    Отправляем тело ответа по плану из plan_download (заголовки ответа
+    уже отправлены)
+
+    :param file_hash: ключ файла - если указан, файл отдается из кэша
+    содержимого, когда он там помещается
+    :param offset: смещение данных файла в file_abs_path (файл в
+    pack-файле)
+    :return: True - если все диапазоны отправлены полностью
+    """
+    if plan.encoding:
+        file_abs_path = variant_path(file_abs_path, plan.encoding)
+        file_size = plan.size
+        file_hash = file_hash and variant_key(file_hash, plan.encoding)
+    content = get_read_cache().get(file_hash, file_abs_path, file_size,
+                                   offset) \
+        if file_hash and plan.ranges else None
+    for start, end in plan.ranges:
+        if plan.boundary:
+            client_socket.sendall(multipart_part_head(plan.boundary, start,
+                                                      end, file_size))
+        if content is not None:
+            if not send_content_to_client(client_socket,
+                                          content[start:end + 1]):
+                return False
+        elif not send_file_to_client(client_socket, file_abs_path,
+                                     offset + start, end - start + 1):
+            return False
+    if plan.boundary:
+        client_socket.sendall(multipart_tail(plan.boundary))
+    return True
+
+
+async def send_planned_to_client_async(writer, file_abs_path, plan,
+                                       file_size, file_hash: str = '',
+                                       offset: int = 0):
+    """
+    Асинхронная версия send_planned_to_client
+    """
+    if plan.encoding:
+        file_abs_path = variant_path(file_abs_path, plan.encoding)
+        file_size = plan.size
+        file_hash = file_hash and variant_key(file_hash, plan.encoding)
+    # Кэш читает файл с диска, поэтому обращение к нему идет в пуле потоков
+    content = await metrics.run_in_executor(
+        get_read_cache().get, file_hash, file_abs_path, file_size, offset) \
+        if file_hash and plan.ranges else None
+    for start, end in plan.ranges:
+        if plan.boundary:
+            writer.write(multipart_part_head(plan.boundary, start, end,
+                                             file_size))
+        if content is not None:
+            writer.write(content[start:end + 1])
+            await writer.drain()
+        elif not await send_file_to_client_async(writer, file_abs_path,
+                                                 offset + start,
+                                                 end - start + 1):
+            return False
+    if plan.boundary:
+        writer.write(multipart_tail(plan.boundary))
+    return True
 
-def send_file_to_client(client_socket, file_abs_path):
+
+def send_file_to_client(client_socket, file_abs_path, offset=0, count=None):
     """
+    Отправляем клиенту файл (или count байт начиная с offset)
 
-    :param client_socket:
-    :param file_hash:
-    :param file_abs_path:
-    :return:
+    :param client_socket: подключение клиента (socket или ClientConnection)
+    :param file_abs_path: полный путь к файлу в хранилище
+    :param offset: смещение от начала файла
+    :param count: сколько байт отправить, None - до конца файла
+    :return: True - если отправлено ровно count байт
     """
     try:
         file_stream = open(file_abs_path, 'rb')
     except FileNotFoundError:
-        print('File not found')
+        logger.error("File not found: {}", file_abs_path)
         return False
-    else:
-        file_chunk = file_stream.read(1024)
-        while file_chunk:
-            client_socket.send(file_chunk)
-            print('Sent', repr(file_chunk))
-            file_chunk = file_stream.read(1024)
-        file_stream.close()
-        print('Done sending')
-        return True
+
+    with file_stream:
+        if count is None:
+            count = os.fstat(file_stream.fileno()).st_size - offset
+        try:
+            sent = send_zero_copy(client_socket, file_stream, offset, count)
+            if sent is None:
+                sent = send_buffered(client_socket, file_stream, offset,
+                                     count)
+        except OSError as os_error:
+            logger.debug("Connection was close by peer: {}", os_error)
+            return False
+
+    logger.debug("Done sending {} of {} bytes", sent, count)
+    return sent == count
+
+
+def send_content_to_client(client_socket, content: memoryview) -> bool:
+    """
+    Отправляем клиенту часть файла из кэша содержимого
+
+    :return: True - если данные отправлены полностью
+    """
+    try:
+        client_socket.sendall(content)
+    except OSError as os_error:
+        logger.debug("Connection was close by peer: {}", os_error)
+        return False
+    return True
+
+
+def send_zero_copy(client_socket, file_stream, offset, count):
+    """
+    Отправляем count байт файла с позиции offset через os.sendfile.
+    sendfile может отправить меньше запрошенного, поэтому повторяем
+    вызов, пока не будет отправлено все или файл не закончится
+
+    :return: количество отправленных байт или None, если sendfile
+    не поддерживается и нужно использовать send_buffered
+    """
+    if not hasattr(os, 'sendfile'):
+        return None
+    try:
+        out_fd = client_socket.fileno()
+    except (AttributeError, OSError):
+        return None
+    in_fd = file_stream.fileno()
+    timeout = client_socket.gettimeout()
+
+    total_sent = 0
+    while total_sent < count:
+        try:
+            sent = os.sendfile(out_fd, in_fd, offset + total_sent,
+                               min(count - total_sent, SENDFILE_MAX_CHUNK))
+        except BlockingIOError:
+            # Сокет с таймаутом неблокирующий - ждем готовности к записи
+            _, writable, _ = select.select([], [out_fd], [], timeout)
+            if not writable:
+                raise TimeoutError("send timed out")
+            continue
+        except OSError as os_error:
+            if total_sent == 0 and os_error.errno in SENDFILE_UNSUPPORTED:
+                return None
+            raise
+        if sent == 0:  # файл стал короче, чем ожидалось
+            break
+        total_sent += sent
+    # Данные ушли в сокет мимо ClientConnection.sendall
+    metrics.add_sent(total_sent)
+    return total_sent
+
+
+def send_buffered(client_socket, file_stream, offset, count):
+    """
+    Отправляем count байт файла с позиции offset, читая его частями
+    по BUFFER_SIZE байт
+
+    :return: количество отправленных байт
+    """
+    file_stream.seek(offset)
+    total_sent = 0
+    while total_sent < count:
+        file_chunk = file_stream.read(min(BUFFER_SIZE, count - total_sent))
+        if not file_chunk:
+            break
+        client_socket.sendall(file_chunk)
+        total_sent += len(file_chunk)
+    return total_sent
+
+
+async def send_file_to_client_async(writer, file_abs_path, offset=0,
+                                    count=None):
+    """
+    Асинхронная версия send_file_to_client для движка asyncio: файл
+    отдается через loop.sendfile, который использует os.sendfile, если
+    транспорт это позволяет, и буферизованную отправку в остальных случаях
+
+    :param writer: asyncio.StreamWriter клиента
+    :param file_abs_path: полный путь к файлу в хранилище
+    :param offset: смещение от начала файла
+    :param count: сколько байт отправить, None - до конца файла
+    :return: True - если файл был отправлен полностью
+    """
+    try:
+        file_stream = open(file_abs_path, 'rb')
+    except FileNotFoundError:
+        return False
+
+    with file_stream:
+        if count is None:
+            count = os.fstat(file_stream.fileno()).st_size - offset
+        if count == 0:
+            return True
+        loop = asyncio.get_running_loop()
+        sent = await loop.sendfile(writer.transport, file_stream, offset,
+                                   count)
+    metrics.add_sent(sent)
+    return sent == count
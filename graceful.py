@@ -0,0 +1,140 @@
+"""
+Плавная остановка и перезапуск сервера без потери подключений
+
+По сигналу SIGTERM (или SIGINT) сервер перестает принимать новые
+подключения, дообрабатывает уже принятые (постоянные соединения
+закрываются после текущего запроса) и завершается; если обработка не
+закончилась за DRAIN_TIMEOUT секунд, процесс завершается принудительно.
+
+По сигналу RELOAD_SIGNAL (SIGUSR2) сервер запускает свою новую копию
+с той же командной строкой и передает ей слушающий сокет (номер
+дескриптора - в переменной окружения LISTEN_FD_ENV), а сам завершается
+так же, как по SIGTERM. Сокет остается открытым все время, поэтому
+подключения, пришедшие, пока новая копия запускается, ждут в очереди
+сокета (listen) и не теряются
+"""
+import os
+import sys
+import math
+import signal
+import socket
+import threading
+import subprocess
+from typing import Callable, Optional
+from loguru import logger
+
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+RELOAD_SIGNAL = signal.SIGUSR2
+DRAIN_TIMEOUT: float = 30.0
+LISTEN_FD_ENV = 'UPLOAD_SERVER_LISTEN_FD'
+
+_draining = threading.Event()
+
+
+def begin_drain() -> bool:
+    """
+    Отмечаем, что сервер останавливается
+
+    :return: False - остановка уже идет
+    """
+    if _draining.is_set():
+        return False
+    _draining.set()
+    return True
+
+
+def is_draining() -> bool:
+    """
+    Сервер останавливается: новые подключения не принимаются, а
+    постоянные соединения закрываются после текущего запроса
+    """
+    return _draining.is_set()
+
+
+def inherited_socket() -> Optional[socket.socket]:
+    """
+    Слушающий сокет, переданный предыдущей копией сервера, None - сервер
+    запущен не перезапуском
+    """
+    fd = os.environ.pop(LISTEN_FD_ENV, '')
+    if not fd.isdigit():
+        return None
+    try:
+        server_socket = socket.socket(fileno=int(fd))
+    except OSError as socket_error:
+        logger.error("Inherited socket {} is not usable: {}", fd,
+                     socket_error)
+        return None
+    # asyncio мог сделать сокет неблокирующим, а флаг общий для процессов
+    server_socket.setblocking(True)
+    logger.info("Listening socket was inherited: {}",
+                server_socket.getsockname())
+    return server_socket
+
+
+def is_takeover() -> bool:
+    """
+    Процесс запущен перезапуском и заменит работающий сервер
+    """
+    return os.environ.get(LISTEN_FD_ENV, '').isdigit()
+
+
+def spawn_successor(server_socket: socket.socket) -> Optional[int]:
+    """
+    Запускаем новую копию сервера с той же командной строкой и передаем
+    ей слушающий сокет
+
+    :return: PID новой копии, None - запустить не удалось
+    """
+    fd = server_socket.fileno()
+    env = dict(os.environ, **{LISTEN_FD_ENV: str(fd)})
+    try:
+        successor = subprocess.Popen([sys.executable] + sys.argv,
+                                     pass_fds=(fd,), env=env)
+    except OSError as spawn_error:
+        # Из обработчика сигнала пишем в журнал в другом потоке
+        threading.Thread(target=logger.error, args=(
+            "Server was not reloaded: {}", spawn_error)).start()
+        return None
+    return successor.pid
+
+
+def install_handlers(on_drain: Callable[[], None],
+                     reload_socket: Optional[socket.socket] = None) -> bool:
+    """
+    Устанавливаем обработчики сигналов остановки и, если передан
+    reload_socket, перезапуска. on_drain вызывается в обработчике сигнала
+    один раз и должен только прервать прием подключений (например,
+    закрыть серверный сокет: accept в главном потоке после этого
+    завершится ошибкой)
+
+    :return: False - обработчики не установлены (вызов не из главного
+    потока, например, сервер в тестах)
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return False
+
+    def stop(signum, frame):  # pylint: disable=unused-argument
+        if begin_drain():
+            on_drain()
+
+    def reload(signum, frame):
+        if _draining.is_set() or reload_socket is None:
+            return
+        if spawn_successor(reload_socket) is not None:
+            stop(signum, frame)
+
+    for signum in STOP_SIGNALS:
+        signal.signal(signum, stop)
+    signal.signal(RELOAD_SIGNAL, reload if reload_socket is not None else
+                  signal.SIG_IGN)
+    return True
+
+
+def set_deadline(timeout: float = DRAIN_TIMEOUT):
+    """
+    Завершаем процесс принудительно (SIGALRM), если он не завершится сам
+    за timeout секунд, - для движков, где обработчик подключения занимает
+    главный поток
+    """
+    signal.alarm(max(1, math.ceil(timeout)))
@@ -0,0 +1,350 @@
+"""
+Инкрементальный разбор строки запроса и заголовков HTTP/1.1
+
+RequestParser получает данные в том виде, в каком они приходят из сокета,
+и хранит состояние между вызовами feed: заголовки могут прийти любыми
+частями, в том числе по одному байту. Размер строки запроса и заголовков
+ограничен, имена заголовков ищутся без учета регистра, параметры запроса
+декодируются (percent-encoding)
+
+ChunkedDecoder так же по частям декодирует тело запроса с
+Transfer-Encoding: chunked, а encode_chunk и LAST_CHUNK нужны для
+ответов, длина которых заранее неизвестна
+"""
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+# Максимальный размер строки запроса вместе с заголовками
+MAX_HEAD_SIZE: int = 65536
+
+# Максимальная длина строки с размером части chunked и строк трейлера
+MAX_CHUNK_LINE_SIZE: int = 4096
+
+HEAD_END = b'\r\n\r\n'
+CRLF = b'\r\n'
+# Завершающая часть тела chunked (без трейлера)
+LAST_CHUNK = b'0\r\n\r\n'
+# Символы, допустимые в имени заголовка (token, RFC 7230)
+TOKEN_CHARS = frozenset(
+    b"!#$%&'*+-.^_`|~0123456789"
+    b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+
+class HttpParseError(ValueError):
+    """
+    Запрос нельзя разобрать; status - код ответа (400 или 431)
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Headers(dict):
+    """
+    Заголовки запроса: имена хранятся в нижнем регистре, поэтому поиск
+    не зависит от регистра (headers['content-length'] и
+    headers['Content-Length'] - один и тот же заголовок)
+    """
+
+    def __setitem__(self, name: str, value: str):
+        super().__setitem__(name.lower(), value)
+
+    def __getitem__(self, name: str) -> str:
+        return super().__getitem__(name.lower())
+
+    def __delitem__(self, name: str):
+        super().__delitem__(name.lower())
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and super().__contains__(name.lower())
+
+    def get(self, name: str, default=None):
+        return super().get(name.lower(), default)
+
+    def add(self, name: str, value: str):
+        """
+        Повторяющийся заголовок объединяем со значением из предыдущих
+        строк через запятую (RFC 7230, 3.2.2)
+        """
+        if name in self:
+            value = self[name] + ', ' + value
+        self[name] = value
+
+
+class HttpRequest(NamedTuple):
+    """
+    Разобранный запрос
+
+    method, target, version - элементы строки запроса;
+    path - путь из target без параметров (percent-decoded);
+    query - параметры запроса (percent-decoded), для повторяющихся
+    параметров - последнее значение;
+    headers - заголовки запроса;
+    body - байты после заголовков, уже полученные вместе с ними (начало
+    тела запроса или следующие запросы в соединении)
+    """
+    method: str
+    target: str
+    version: str
+    headers: Headers
+    path: str
+    query: Dict[str, str]
+    body: bytes
+
+    @property
+    def first_line(self):
+        """
+        Строка запроса в виде списка [метод, URI, версия HTTP], как ее
+        ожидает server.check_request_by_first_line
+        """
+        return [self.method, self.target, self.version]
+
+
+def parse_query(query: str) -> Dict[str, str]:
+    """
+    Параметры из строки запроса a=1&b=%20x с декодированием
+    percent-encoding
+    """
+    return dict(parse_qsl(query, keep_blank_values=True))
+
+
+def split_target(target: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Путь и параметры из URI запроса
+    """
+    url = urlsplit(target)
+    return unquote(url.path), parse_query(url.query)
+
+
+class RequestParser:
+    """
+    Разбор одного запроса: feed вызывается с очередными данными до тех
+    пор, пока не вернет HttpRequest
+
+    Чтобы не ждать конца заголовков у явно не-HTTP данных, строка
+    запроса, первое слово которой не может быть методом (не из заглавных
+    латинских букв), отклоняется сразу (400)
+    """
+
+    def __init__(self, max_head_size: int = MAX_HEAD_SIZE):
+        self.max_head_size = max_head_size
+        self._buffer = b''
+        # С какой позиции искать конец заголовков при следующем feed
+        self._search_from = 0
+
+    def feed(self, data: bytes) -> Optional[HttpRequest]:
+        """
+        Добавляем данные, полученные из соединения
+
+        :return: разобранный запрос, если заголовки получены полностью,
+        иначе None
+        :raise HttpParseError: если запрос некорректен или заголовки
+        длиннее max_head_size
+        """
+        self._buffer += data
+        if self._buffer[:1] in (b'\r', b'\n'):
+            # Пустые строки перед строкой запроса пропускаем (RFC 7230, 3.5)
+            self._buffer = self._buffer.lstrip(b'\r\n')
+        head_end = self._buffer.find(HEAD_END, self._search_from)
+        if head_end < 0:
+            self._check_incomplete()
+            return None
+        if head_end + len(HEAD_END) > self.max_head_size:
+            raise HttpParseError(431, "Request head is too large")
+
+        head = self._buffer[:head_end]
+        body = self._buffer[head_end + len(HEAD_END):]
+        self._buffer = b''
+        self._search_from = 0
+        return parse_head(head, body)
+
+    @property
+    def started(self) -> bool:
+        """
+        Получена ли уже часть запроса
+        """
+        return bool(self._buffer)
+
+    def _check_incomplete(self):
+        if len(self._buffer) > self.max_head_size:
+            raise HttpParseError(431, "Request head is too large")
+        # Конец заголовков мог прийти не целиком
+        self._search_from = max(len(self._buffer) - len(HEAD_END) + 1, 0)
+        method, space, _ = self._buffer.partition(b' ')
+        if space and not is_method(method):
+            raise HttpParseError(400, "Not an HTTP request")
+
+
+def is_method(method: bytes) -> bool:
+    """
+    Метод запроса - непустое слово из заглавных латинских букв
+    """
+    return method.isalpha() and method.isupper() and method.isascii()
+
+
+def parse_head(head: bytes, body: bytes = b'') -> HttpRequest:
+    """
+    Разбираем строку запроса и заголовки (без завершающей пустой строки)
+
+    :raise HttpParseError: если запрос некорректен
+    """
+    lines = head.decode('latin-1').split('\r\n')
+
+    request_line = lines[0].split(' ')
+    if len(request_line) != 3 or not is_method(request_line[0].encode()) \
+            or not request_line[1]:
+        raise HttpParseError(400, "Invalid request line")
+    method, target, version = request_line
+
+    headers = Headers()
+    for line in lines[1:]:
+        name, colon, value = line.partition(':')
+        # Пробел перед двоеточием и перенос значения на новую строку
+        # (obs-fold) запрещены RFC 7230
+        if not colon or not name or not TOKEN_CHARS.issuperset(
+                name.encode('latin-1')):
+            raise HttpParseError(400, "Invalid header line")
+        headers.add(name, value.strip(' \t'))
+
+    path, query = split_target(target)
+    return HttpRequest(method, target, version, headers, path, query, body)
+
+
+def parse_request(request: bytes) -> HttpRequest:
+    """
+    Разбираем запрос, полученный целиком (вместе с пустой строкой после
+    заголовков)
+
+    :raise HttpParseError: если запрос некорректен или получен не целиком
+    """
+    parsed = RequestParser().feed(request)
+    if parsed is None:
+        raise HttpParseError(400, "Incomplete request head")
+    return parsed
+
+
+def is_chunked(headers: Dict[str, str]) -> bool:
+    """
+    Передается ли тело запроса частями (Transfer-Encoding: chunked)
+    """
+    return headers.get('Transfer-Encoding', '').strip().lower() == 'chunked'
+
+
+def encode_chunk(data: bytes) -> bytes:
+    """
+    Часть тела ответа chunked; пустые данные не кодируются, так как
+    пустая часть означает конец тела (LAST_CHUNK)
+    """
+    if not data:
+        return b''
+    return b'%x\r\n' % len(data) + data + CRLF
+
+
+def parse_chunk_size(line: bytes) -> int:
+    """
+    Размер части из строки вида 1a2b;ext=value (без CRLF)
+
+    :raise HttpParseError: если размер некорректен
+    """
+    size = line.split(b';', 1)[0].strip(b' \t')
+    if not size or not all(symbol in b'0123456789abcdefABCDEF'
+                           for symbol in size):
+        raise HttpParseError(400, "Invalid chunk size")
+    return int(size, 16)
+
+
+class ChunkedDecoder:
+    """
+    Инкрементальное декодирование тела Transfer-Encoding: chunked
+
+    feed возвращает данные, полученные из очередной порции тела. После
+    завершающей части и трейлера done становится True, а все, что пришло
+    после тела (следующий запрос в соединении), остается в unused
+    """
+    _SIZE, _DATA, _DATA_END, _TRAILER, _DONE = range(5)
+
+    def __init__(self, max_line_size: int = MAX_CHUNK_LINE_SIZE):
+        self.max_line_size = max_line_size
+        self.done = False
+        self.unused = b''
+        self._state = self._SIZE
+        self._line = b''
+        # Сколько байт осталось до конца текущей части (вместе с CRLF)
+        self._remaining = 0
+
+    @property
+    def wants_line(self) -> bool:
+        """
+        Ожидается строка (размер части или трейлер), а не данные части
+        """
+        return self._state in (self._SIZE, self._TRAILER)
+
+    @property
+    def remaining(self) -> int:
+        """
+        Сколько байт можно передать в feed, не заходя за конец текущей
+        части (имеет смысл, пока wants_line - False)
+        """
+        return self._remaining
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        Декодируем очередную порцию тела запроса
+
+        :raise HttpParseError: если тело некорректно
+        """
+        decoded = []
+        position = 0
+        while position < len(data) and self._state != self._DONE:
+            if self._state in (self._SIZE, self._TRAILER):
+                line_end = data.find(b'\n', position)
+                if line_end < 0:
+                    self._add_line_part(data[position:])
+                    position = len(data)
+                    break
+                self._add_line_part(data[position:line_end + 1])
+                position = line_end + 1
+                self._end_line()
+            else:  # _DATA, _DATA_END
+                size = min(self._remaining, len(data) - position)
+                if self._state == self._DATA:
+                    size = min(size, self._remaining - len(CRLF))
+                    decoded.append(data[position:position + size])
+                    self._remaining -= size
+                    if self._remaining == len(CRLF):
+                        self._state = self._DATA_END
+                else:
+                    if data[position:position + size] != \
+                            CRLF[len(CRLF) - self._remaining:][:size]:
+                        raise HttpParseError(400, "Chunk is not followed "
+                                                  "by CRLF")
+                    self._remaining -= size
+                    if not self._remaining:
+                        self._state = self._SIZE
+                position += size
+
+        if self._state == self._DONE:
+            self.unused += data[position:]
+        return b''.join(decoded)
+
+    def _add_line_part(self, part: bytes):
+        self._line += part
+        if len(self._line) > self.max_line_size:
+            raise HttpParseError(400, "Chunk line is too long")
+
+    def _end_line(self):
+        line = self._line.rstrip(b'\r\n')
+        self._line = b''
+        if self._state == self._TRAILER:
+            # Поля трейлера не используются, пустая строка - конец тела
+            if not line:
+                self._state = self._DONE
+                self.done = True
+            return
+        chunk_size = parse_chunk_size(line)
+        if chunk_size:
+            self._state = self._DATA
+            self._remaining = chunk_size + len(CRLF)
+        else:
+            self._state = self._TRAILER
@@ -8,7 +8,17 @@ import sys
 import argparse
 from loguru import logger
 from daemon import Daemon
+import engines
+import file_hashing
+import compression
+import pack_store
+import storage_paths
+import volumes
+import access_log
+import profiling
+import graceful
 import server
+import async_server
 
 version = "0.1.0"
 
@@ -22,8 +32,25 @@ class App(Daemon):
         """
         HTTPD
         """
+        if SERVER_ENGINE == 'asyncio':
+            async_server.run_async_server(SERVER_ADDR, SERVER_PORT,
+                                          LISTEN_CLIENTS_NUMB,
+                                          MAX_SERVER_BUFFER_SIZE,
+                                          KEEPALIVE_TIMEOUT, MAX_REQUESTS,
+                                          REQUEST_TIMEOUT,
+                                          HASH_ALGORITHM, COMPRESS,
+                                          PACK_SMALL, VOLUMES, PLACEMENT,
+                                          ACCESS_LOG, DUMP_PAYLOADS,
+                                          PROFILE_SECONDS)
+            return
+
         server.run_server(SERVER_ADDR, SERVER_PORT, LISTEN_CLIENTS_NUMB,
-                          MAX_SERVER_BUFFER_SIZE)
+                          MAX_SERVER_BUFFER_SIZE, SERVER_ENGINE,
+                          SERVER_WORKERS, SERVER_QUEUE_SIZE,
+                          KEEPALIVE_TIMEOUT, MAX_REQUESTS, REQUEST_TIMEOUT,
+                          HASH_ALGORITHM, COMPRESS, PACK_SMALL, VOLUMES,
+                          PLACEMENT, ACCESS_LOG, DUMP_PAYLOADS,
+                          PROFILE_SECONDS)
 
 
 def create_parser():
@@ -102,6 +129,100 @@ def create_parser():
                              default - 4096""",
                              metavar='BUFFER')
 
+    start_group.add_argument('--engine', default='threads',
+                             choices=engines.ENGINES,
+                             help="""Connection handling engine: sync,
+                             threads, prefork or asyncio,
+                             default - 'threads'""",
+                             metavar='ENGINE')
+
+    start_group.add_argument('--workers', default=engines.DEFAULT_WORKERS,
+                             help="""Number of worker threads (threads) or
+                             processes (prefork), default - {}""".format(
+                                 engines.DEFAULT_WORKERS),
+                             metavar='WORKERS')
+
+    start_group.add_argument('--queue', default=engines.DEFAULT_QUEUE_SIZE,
+                             help="""Max accepted connections waiting for a
+                             worker, extra clients get 503 (threads);
+                             listen backlog (prefork), default - {}""".format(
+                                 engines.DEFAULT_QUEUE_SIZE),
+                             metavar='QUEUE')
+
+    start_group.add_argument('--keepalive-timeout',
+                             default=server.KEEPALIVE_TIMEOUT,
+                             help="""Seconds to wait for the next request on
+                             a persistent connection, default - {}""".format(
+                                 server.KEEPALIVE_TIMEOUT),
+                             metavar='SECONDS')
+
+    start_group.add_argument('--max-requests',
+                             default=server.MAX_KEEPALIVE_REQUESTS,
+                             help="""Max requests served on one persistent
+                             connection, default - {}""".format(
+                                 server.MAX_KEEPALIVE_REQUESTS),
+                             metavar='REQUESTS')
+
+    start_group.add_argument('--request-timeout',
+                             default=server.REQUEST_TIMEOUT,
+                             help="""Seconds to wait for the first request
+                             head and for each part of a request body,
+                             default - {}""".format(server.REQUEST_TIMEOUT),
+                             metavar='SECONDS')
+
+    start_group.add_argument('--hash', default=file_hashing.DEFAULT_ALGORITHM,
+                             choices=sorted(file_hashing.HASH_ALGORITHMS),
+                             help="""Hash algorithm for keys of new files,
+                             default - '{}'""".format(
+                                 file_hashing.DEFAULT_ALGORITHM),
+                             metavar='ALGORITHM')
+
+    start_group.add_argument('--compress', default='',
+                             help="""Comma-separated encodings ({}) to
+                             precompress new files with in background,
+                             default - no compression""".format(
+                                 ','.join(compression.ENCODINGS)),
+                             metavar='ENCODINGS')
+
+    start_group.add_argument('--pack-small', default=0,
+                             help="""Store new files up to BYTES in pack
+                             files, default - 0 (every file is stored
+                             separately)""",
+                             metavar='BYTES')
+
+    start_group.add_argument('--volumes', default='',
+                             help="""Comma-separated directories of extra
+                             storage volumes (disks), default - only
+                             ./store/""",
+                             metavar='DIRS')
+
+    start_group.add_argument('--placement', default=volumes.DEFAULT_PLACEMENT,
+                             choices=volumes.PLACEMENTS,
+                             help="""How a volume is chosen for a new file:
+                             space (weighted by free space) or hash (by hash
+                             range), default - '{}'""".format(
+                                 volumes.DEFAULT_PLACEMENT),
+                             metavar='PLACEMENT')
+
+    start_group.add_argument('--access-log',
+                             default=access_log.ACCESS_LOG_FILE,
+                             help="""Access log file, one line per
+                             request; empty string disables it,
+                             default - '{}'""".format(
+                                 access_log.ACCESS_LOG_FILE),
+                             metavar='PATH')
+
+    start_group.add_argument('--dump-payloads', action='store_true',
+                             help="""Write request headers and bodies to the
+                             debug log (slow, for debugging only)""")
+
+    start_group.add_argument('--profile-seconds',
+                             default=profiling.DEFAULT_PROFILE_SECONDS,
+                             help="""How long the server is profiled after
+                             the 'profile' command (SIGUSR1), default -
+                             {}""".format(profiling.DEFAULT_PROFILE_SECONDS),
+                             metavar='SECONDS')
+
     # Создаем подпарсер для команды stop
     stop_parser = subparsers.add_parser('stop',
                                         add_help=False,
@@ -121,6 +242,84 @@ def create_parser():
     restart_parser.add_argument('--help', '-h', action="help",
                                 help='Вывести справку')
 
+    # Создаем подпарсер для команды reload
+    reload_parser = subparsers.add_parser('reload',
+                                          add_help=False,
+                                          help="""Reload server daemon
+                                          without downtime""",
+                                          description="""Start a new server
+                                          process with the same options,
+                                          hand the listening socket over to
+                                          it and stop the running one after
+                                          its connections are served""")
+
+    reload_parser.add_argument('--help', '-h', action="help",
+                               help='Вывести справку')
+
+    # Создаем подпарсер для команды profile
+    profile_parser = subparsers.add_parser('profile',
+                                           add_help=False,
+                                           help="""Profile server daemon""",
+                                           description="""Start profiling of
+                                           the running server (or stop it
+                                           early), the profile is written to
+                                           ./log/""")
+
+    profile_parser.add_argument('--help', '-h', action="help",
+                                help='Вывести справку')
+
+    # Создаем подпарсер для команды compact
+    compact_parser = subparsers.add_parser('compact',
+                                           add_help=False,
+                                           help="""Compact pack files""",
+                                           description="""Rewrite pack
+                                           files with many deleted records
+                                           and free their space""")
+
+    compact_parser.add_argument('--help', '-h', action="help",
+                                help='Вывести справку')
+
+    compact_parser.add_argument('--ratio',
+                                default=pack_store.COMPACT_DEAD_RATIO,
+                                help="""Min share of deleted records in
+                                a pack file to compact it,
+                                default - {}""".format(
+                                    pack_store.COMPACT_DEAD_RATIO),
+                                metavar='RATIO')
+
+    # Создаем подпарсер для команды reshard
+    reshard_parser = subparsers.add_parser('reshard',
+                                           add_help=False,
+                                           help="""Change store directory
+                                           layout""",
+                                           description="""Move stored files
+                                           to directories of the new layout
+                                           while the server keeps running""")
+
+    reshard_parser.add_argument('--help', '-h', action="help",
+                                help='Вывести справку')
+
+    reshard_parser.add_argument('--depth',
+                                default=storage_paths.DEFAULT_LAYOUT.depth,
+                                help="""Levels of shard directories,
+                                default - {}""".format(
+                                    storage_paths.DEFAULT_LAYOUT.depth),
+                                metavar='DEPTH')
+
+    reshard_parser.add_argument('--width',
+                                default=storage_paths.DEFAULT_LAYOUT.width,
+                                help="""Hash chars in the name of a shard
+                                directory, default - {}""".format(
+                                    storage_paths.DEFAULT_LAYOUT.width),
+                                metavar='WIDTH')
+
+    reshard_parser.add_argument('--volumes', default='',
+                                help="""Comma-separated directories of extra
+                                storage volumes, as given to start; volumes
+                                recorded in the index are resharded
+                                anyway""",
+                                metavar='DIRS')
+
     # Создаем подпарсер для команды get_pid
     get_pid_parser = subparsers.add_parser('get_pid',
                                            add_help=False,
@@ -146,7 +345,9 @@ if __name__ == '__main__':
     STD_ERR = './log/error.log'
     HOME_DIR = '.'
 
-    daemon_main = App(PID_FILE, STD_IN, STD_OUT, STD_ERR, HOME_DIR)
+    daemon_main = App(PID_FILE, STD_IN, STD_OUT, STD_ERR, HOME_DIR,
+                      stop_timeout=graceful.DRAIN_TIMEOUT + 5,
+                      reload_signal=graceful.RELOAD_SIGNAL)
 
     if namespace.control == "start":
 
@@ -155,13 +356,35 @@ if __name__ == '__main__':
         LOG_LEVEL: str = namespace.log
         LISTEN_CLIENTS_NUMB: int = int(namespace.listen)
         MAX_SERVER_BUFFER_SIZE: int = int(namespace.buffer)
+        SERVER_ENGINE: str = namespace.engine
+        SERVER_WORKERS: int = int(namespace.workers)
+        SERVER_QUEUE_SIZE: int = int(namespace.queue)
+        KEEPALIVE_TIMEOUT: float = float(namespace.keepalive_timeout)
+        MAX_REQUESTS: int = int(namespace.max_requests)
+        REQUEST_TIMEOUT: float = float(namespace.request_timeout)
+        HASH_ALGORITHM: str = namespace.hash
+        COMPRESS = tuple(encoding.strip() for encoding in
+                         namespace.compress.split(',') if encoding.strip())
+        for encoding in COMPRESS:
+            if encoding not in compression.ENCODINGS:
+                parser.error("unsupported encoding: {}".format(encoding))
+        PACK_SMALL: int = int(namespace.pack_small)
+        VOLUMES = volumes.parse_volume_dirs(namespace.volumes)
+        PLACEMENT: str = namespace.placement
+        ACCESS_LOG: str = namespace.access_log
+        DUMP_PAYLOADS: bool = namespace.dump_payloads
+        PROFILE_SECONDS: float = float(namespace.profile_seconds)
 
         logger.add("./log/daemon/debug.log", format="{time} {level} {message}",
                    level=LOG_LEVEL,
                    rotation="10MB")
         logger = logger.opt(colors=True)
 
-        daemon_main.start()
+        # Процесс запущен командой reload и заменяет работающий сервер
+        if graceful.is_takeover():
+            daemon_main.takeover()
+        else:
+            daemon_main.start()
 
     elif namespace.control == "stop":
         daemon_main.stop()
@@ -169,6 +392,35 @@ if __name__ == '__main__':
     elif namespace.control == "restart":
         daemon_main.restart()
 
+    elif namespace.control == "reload":
+        if not daemon_main.reload():
+            parser.error("server is not running or was not reloaded")
+        print("Server was reloaded: {}".format(daemon_main.get_pid()))
+
+    elif namespace.control == "profile":
+        server_pid = daemon_main.get_pid()
+        if not server_pid:
+            parser.error("server is not running")
+        os.kill(server_pid, profiling.PROFILE_SIGNAL)
+        print("Profiling signal was sent to {}".format(server_pid))
+
+    elif namespace.control == "compact":
+        reclaimed = pack_store.get_pack_store(server.STORAGE_DIR).compact(
+            float(namespace.ratio))
+        print("Reclaimed {} bytes".format(reclaimed))
+
+    elif namespace.control == "reshard":
+        try:
+            layout = storage_paths.make_layout(int(namespace.depth),
+                                               int(namespace.width))
+            moved = storage_paths.get_storage_paths(
+                server.STORAGE_DIR).reshard(
+                    layout, volume_dirs=volumes.parse_volume_dirs(
+                        namespace.volumes))
+        except ValueError as layout_error:
+            parser.error(str(layout_error))
+        print("Moved {} files to {} layout".format(moved, layout))
+
     elif namespace.control == "get_pid":
         print(daemon_main.get_pid())
 
@@ -0,0 +1,351 @@
+"""
+Метрики сервера в формате Prometheus (GET /metrics)
+
+Для каждого запроса считается время обработки и время отдельных этапов:
+first_byte - от приема подключения (для следующих запросов постоянного
+соединения - от получения заголовков) до первого байта ответа;
+header_parse - разбор строки запроса и заголовков; body_receive -
+получение тела загрузки; hash - хэширование полученных данных; commit -
+перенос файла в хранилище; send - отправка содержимого файла. Время
+этапов и количество отправленных байт записываются с метками метода и
+статус кода ответа.
+
+Этапы, которые идут внутри обработчиков, добавляются к таймеру текущего
+запроса (contextvars), поэтому обработчикам не нужно передавать его
+явно: у каждого потока и у каждой задачи asyncio таймер свой. Запись
+этапа - два вызова time.perf_counter и сложение, гистограммы обновляются
+один раз в конце запроса.
+
+Кроме того, числовые счетчики GET /stats отдаются как gauge. В prefork
+каждый процесс считает свои метрики, как и GET /stats
+"""
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from functools import partial
+from contextvars import ContextVar, copy_context
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from loguru import logger
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRIC_PREFIX = 'filestorage_'
+STAGES = ('first_byte', 'header_parse', 'body_receive', 'hash', 'commit',
+          'send')
+# Границы корзин гистограмм времени (секунды)
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class RequestTimer:
+    """
+    Время этапов, статус и размер ответа одного запроса, а также ключ
+    файла запроса - для журнала доступа (access_log)
+    """
+    __slots__ = ('started', 'stages', 'status', 'sent', 'key', 'duration')
+
+    def __init__(self, started: float):
+        self.started = started
+        self.stages: Dict[str, float] = {}
+        self.status = 0
+        self.sent = 0
+        self.key = ''
+        self.duration = 0.0
+
+    def add_stage(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count_sent(self, data: bytes):
+        """
+        Учитываем отправленную часть ответа; статус берется из первой
+        строки ответа (кроме 100 Continue), тогда же отмечается первый байт
+        """
+        if not self.status and bytes(data[:5]) == b'HTTP/':
+            status = int(bytes(data[9:12]))
+            if status >= 200:
+                self.status = status
+                self.stages['first_byte'] = time.perf_counter() - \
+                    self.started
+        self.sent += len(data)
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами: количество значений в каждой
+    корзине (не накопительное), сумма и количество значений
+    """
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Счетчики и гистограммы с метками
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def incr(self, name: str, labels: Labels, value: float = 1):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, labels: Labels, value: float):
+        with self._lock:
+            self._observe(name, labels, value)
+
+    def _observe(self, name: str, labels: Labels, value: float):
+        series = self._histograms.setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def finish(self, method: str, timer: RequestTimer):
+        """
+        Записываем метрики завершенного запроса
+        """
+        labels = (('method', method), ('status', str(timer.status)))
+        with self._lock:
+            self._observe('http_request_duration_seconds', labels,
+                          timer.duration)
+            for stage, seconds in timer.stages.items():
+                self._observe('http_request_stage_seconds',
+                              (('stage', stage),) + labels, seconds)
+            series = self._counters.setdefault('http_response_bytes_total',
+                                               {})
+            series[labels] = series.get(labels, 0) + timer.sent
+
+    def render(self, gauges: Optional[Dict] = None) -> str:
+        """
+        Все метрики в текстовом формате Prometheus
+
+        :param gauges: счетчики GET /stats (server.collect_stats)
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                self._header(lines, name, 'counter')
+                for labels, value in sorted(series.items()):
+                    lines.append(format_sample(name, labels, value))
+            for name, series in sorted(self._histograms.items()):
+                self._header(lines, name, 'histogram')
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(
+                            (*histogram.buckets, float('inf')),
+                            histogram.counts):
+                        cumulative += count
+                        lines.append(format_sample(
+                            name + '_bucket',
+                            labels + (('le', format_value(bound)),),
+                            cumulative))
+                    lines.append(format_sample(name + '_sum', labels,
+                                               histogram.total))
+                    lines.append(format_sample(name + '_count', labels,
+                                               histogram.count))
+        last_name = ''
+        for name, labels, value in stats_gauges(gauges or {}):
+            if name != last_name:
+                lines.append('# TYPE {}{} gauge'.format(METRIC_PREFIX, name))
+                last_name = name
+            lines.append(format_sample(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines: List[str], name: str, metric_type: str):
+        if name in self._help:
+            lines.append('# HELP {}{} {}'.format(METRIC_PREFIX, name,
+                                                 self._help[name]))
+        lines.append('# TYPE {}{} {}'.format(METRIC_PREFIX, name,
+                                             metric_type))
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_sample(name: str, labels: Labels,
+                  value: Union[int, float]) -> str:
+    """
+    Строка значения метрики: имя{метки} значение
+    """
+    if labels:
+        label_text = ','.join('{}="{}"'.format(
+            key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+            for key, label in labels)
+        return '{}{}{{{}}} {}'.format(METRIC_PREFIX, name, label_text,
+                                      format_value(value))
+    return '{}{} {}'.format(METRIC_PREFIX, name, format_value(value))
+
+
+def stats_gauges(stats: Dict) -> Iterator[Tuple[str, Labels, float]]:
+    """
+    Числовые счетчики GET /stats: раздел_счетчик; у разделов, где
+    счетчики сгруппированы (например, по томам), группа становится меткой
+    name
+    """
+    samples = []
+    for section, counters in stats.items():
+        if not isinstance(counters, dict):
+            continue
+        for key, value in counters.items():
+            if isinstance(value, dict):
+                samples.extend(('{}_{}'.format(section, sub_key),
+                                (('name', str(key)),), sub_value)
+                               for sub_key, sub_value in value.items()
+                               if is_number(sub_value))
+            elif is_number(value):
+                samples.append(('{}_{}'.format(section, key), (), value))
+    return iter(sorted(samples, key=lambda sample: sample[:2]))
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+_registry = MetricsRegistry()
+_registry.describe('http_request_duration_seconds',
+                   'Time from the start of a request to its last byte')
+_registry.describe('http_request_stage_seconds',
+                   'Time of request processing stages')
+_registry.describe('http_response_bytes_total', 'Bytes sent in responses')
+# Таймер запроса, который обрабатывается в текущем потоке или задаче
+_current = ContextVar('request_timer', default=None)
+
+
+def get_registry() -> MetricsRegistry:
+    """
+    Метрики текущего процесса
+    """
+    return _registry
+
+
+def start_request(started: Optional[float] = None) -> RequestTimer:
+    """
+    Начинаем учет запроса в текущем потоке или задаче asyncio
+
+    :param started: время начала (time.perf_counter), по умолчанию - сейчас
+    """
+    timer = RequestTimer(time.perf_counter() if started is None else started)
+    _current.set(timer)
+    return timer
+
+
+def finish_request(method: str) -> Optional[RequestTimer]:
+    """
+    Записываем метрики текущего запроса; запрос без ответа не учитывается
+
+    :return: таймер завершенного запроса
+    """
+    timer = _current.get()
+    _current.set(None)
+    if timer is None:
+        return None
+    timer.duration = time.perf_counter() - timer.started
+    if not timer.status:
+        return timer
+    try:
+        _registry.finish(method, timer)
+    except Exception as unknown_error:  # метрики не должны ломать ответ
+        logger.error("Metrics were not recorded: {}", unknown_error)
+    return timer
+
+
+def set_key(key: str):
+    """
+    Запоминаем ключ файла текущего запроса (ключ загруженного файла
+    известен только после его получения)
+    """
+    timer = _current.get()
+    if timer is not None:
+        timer.key = key
+
+
+def add_stage(stage: str, seconds: float):
+    """
+    Добавляем время этапа к текущему запросу
+    """
+    timer = _current.get()
+    if timer is not None:
+        timer.add_stage(stage, seconds)
+
+
+def count_sent(data: bytes):
+    """
+    Учитываем отправленную часть ответа текущего запроса
+    """
+    timer = _current.get()
+    if timer is not None:
+        timer.count_sent(data)
+
+
+def add_sent(size: int):
+    """
+    Учитываем байты, отправленные мимо count_sent (os.sendfile)
+    """
+    timer = _current.get()
+    if timer is not None:
+        timer.sent += size
+
+
+class MeteredWriter:
+    """
+    asyncio.StreamWriter, который учитывает отправленные части ответа
+    (для ClientConnection это делают send и sendall)
+    """
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def write(self, data: bytes):
+        count_sent(data)
+        self._writer.write(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self._writer, name)
+
+
+async def run_in_executor(func: Callable, *args):
+    """
+    Выполняем блокирующую функцию в пуле потоков цикла событий asyncio;
+    функция видит таймер текущего запроса (loop.run_in_executor сам
+    контекст не передает), поэтому ее этапы тоже учитываются
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(copy_context().run,
+                                                    func, *args))
+
+
+def render_metrics(gauges_source: Optional[Callable[[], Dict]] = None
+                   ) -> str:
+    """
+    Тело ответа GET /metrics
+
+    :param gauges_source: функция, которая возвращает счетчики GET /stats
+    """
+    return _registry.render(gauges_source() if gauges_source else None)
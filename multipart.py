@@ -0,0 +1,171 @@
+"""
+Потоковый разбор тела запроса multipart/form-data
+
+Тело запроса подается в MultipartParser.feed частями в том виде, в каком
+оно приходит из сокета. Разделитель (boundary) может оказаться разрезан
+между двумя частями - парсер держит в буфере только хвост длиной с
+разделитель, поэтому расход памяти не зависит от размера файлов
+"""
+from typing import Dict, List, Optional, Tuple
+
+# Максимальный размер заголовков одной части
+MAX_PART_HEAD_SIZE: int = 16384
+# Максимальная длина boundary по RFC 2046
+MAX_BOUNDARY_LENGTH: int = 70
+
+CRLF = b'\r\n'
+PART_HEAD_END = b'\r\n\r\n'
+
+# События, которые возвращает MultipartParser.feed
+PART_BEGIN = 'part_begin'  # значение - словарь заголовков части
+PART_DATA = 'part_data'  # значение - очередной фрагмент данных части
+PART_END = 'part_end'  # значение - None
+
+# Состояния парсера
+_PREAMBLE = 0
+_AFTER_DELIMITER = 1
+_PART_HEAD = 2
+_PART_DATA = 3
+_EPILOGUE = 4
+
+
+class MultipartError(ValueError):
+    """
+    Тело запроса не соответствует формату multipart/form-data
+    """
+
+
+def parse_header_params(header_value: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Разбираем значение заголовка вида
+    form-data; name="file"; filename="a.txt"
+
+    :return: кортеж из значения (в нижнем регистре) и словаря параметров
+    """
+    value, *params = header_value.split(';')
+    params_dict = {}
+    for param in params:
+        param_name, equal, param_value = param.strip().partition('=')
+        if equal:
+            params_dict[param_name.strip().lower()] = \
+                param_value.strip().strip('"')
+    return value.strip().lower(), params_dict
+
+
+def get_boundary(content_type: str) -> Optional[bytes]:
+    """
+    Разделитель частей из заголовка Content-Type, None - если заголовок
+    не multipart/form-data или разделитель некорректен
+    """
+    value, params = parse_header_params(content_type)
+    boundary = params.get('boundary', '')
+    if value != 'multipart/form-data' or not boundary or \
+            len(boundary) > MAX_BOUNDARY_LENGTH:
+        return None
+    return boundary.encode('latin-1')
+
+
+def part_filename(part_headers: Dict[str, str]) -> Optional[str]:
+    """
+    Имя файла из Content-Disposition части, None - часть не файл, а
+    обычное поле формы
+    """
+    _, params = parse_header_params(
+        part_headers.get('content-disposition', ''))
+    return params.get('filename')
+
+
+class MultipartParser:
+    """
+    Инкрементальный парсер multipart/form-data
+
+    feed возвращает список событий (тип, значение): PART_BEGIN с
+    заголовками части (имена в нижнем регистре), PART_DATA с данными,
+    PART_END. Признак done становится True после завершающего
+    разделителя, все данные после него игнорируются
+    """
+
+    def __init__(self, boundary: bytes,
+                 max_head_size: int = MAX_PART_HEAD_SIZE):
+        # Перед каждым разделителем, кроме первого, стоит CRLF. Добавив
+        # CRLF в начало потока, ищем все разделители одинаково
+        self.delimiter = CRLF + b'--' + boundary
+        self.max_head_size = max_head_size
+        self.done = False
+        self._buffer = CRLF
+        self._state = _PREAMBLE
+
+    def feed(self, data: bytes) -> List[Tuple[str, object]]:
+        """
+        Разбираем очередную часть тела запроса
+
+        :raise MultipartError: если тело запроса некорректно
+        """
+        events: List[Tuple[str, object]] = []
+        if self._state == _EPILOGUE:
+            return events
+        buffer = self._buffer + data if self._buffer else data
+
+        while True:
+            if self._state in (_PREAMBLE, _PART_DATA):
+                position = buffer.find(self.delimiter)
+                if position < 0:
+                    # Хвост может оказаться началом разделителя
+                    keep = min(len(buffer), len(self.delimiter) - 1)
+                    if self._state == _PART_DATA and len(buffer) > keep:
+                        events.append((PART_DATA, buffer[:len(buffer) - keep]))
+                    buffer = buffer[len(buffer) - keep:]
+                    break
+                if self._state == _PART_DATA:
+                    if position:
+                        events.append((PART_DATA, buffer[:position]))
+                    events.append((PART_END, None))
+                buffer = buffer[position + len(self.delimiter):]
+                self._state = _AFTER_DELIMITER
+
+            elif self._state == _AFTER_DELIMITER:
+                if len(buffer) < 2:
+                    break
+                if buffer.startswith(b'--'):
+                    self._state = _EPILOGUE
+                    self.done = True
+                    buffer = b''
+                    break
+                line_end = buffer.find(CRLF)
+                if line_end < 0:
+                    if len(buffer) > self.max_head_size:
+                        raise MultipartError("Delimiter line is too long")
+                    break
+                # После разделителя допускаются только пробелы (RFC 2046)
+                if buffer[:line_end].strip(b' \t'):
+                    raise MultipartError("Invalid delimiter line")
+                # CRLF оставляем: пустые заголовки тоже заканчиваются на
+                # CRLFCRLF
+                buffer = buffer[line_end:]
+                self._state = _PART_HEAD
+
+            else:  # self._state == _PART_HEAD
+                head_end = buffer.find(PART_HEAD_END)
+                if head_end < 0:
+                    if len(buffer) > self.max_head_size:
+                        raise MultipartError("Part headers are too long")
+                    break
+                events.append((PART_BEGIN,
+                               self._parse_head(buffer[2:head_end])))
+                buffer = buffer[head_end + len(PART_HEAD_END):]
+                self._state = _PART_DATA
+
+        self._buffer = buffer
+        return events
+
+    @staticmethod
+    def _parse_head(head: bytes) -> Dict[str, str]:
+        part_headers = {}
+        for line in head.decode('utf-8', 'replace').split('\r\n'):
+            if not line:
+                continue
+            name, colon, value = line.partition(':')
+            if not colon:
+                raise MultipartError("Invalid part header: {}".format(line))
+            part_headers[name.strip().lower()] = value.strip()
+        return part_headers
@@ -0,0 +1,326 @@
+"""
+Хранение небольших файлов в pack-файлах
+
+Вместо отдельного файла в store/<xx>/ небольшой файл дописывается в конец
+общего pack-файла store/.packs/pack-<номер>.dat, а его расположение
+(номер pack-файла, смещение, длина) записывается в индекс хранилища.
+Отдается такой файл как диапазон pack-файла (sendfile с offset), поэтому
+миллионы небольших файлов не занимают миллионы inode.
+
+Каждая запись pack-файла - заголовок (PACK_MAGIC, признак, длина ключа,
+длина данных), ключ и данные, так что расположение файлов можно
+восстановить по самим pack-файлам. При удалении в заголовке снимается
+признак записи, а место освобождается уплотнением (compact): живые
+записи переписываются в текущий pack-файл, старый pack-файл удаляется.
+
+Дописывание и уплотнение защищены блокировкой файла (flock), поэтому
+pack-файлы можно использовать из нескольких процессов prefork
+"""
+import os
+import fcntl
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional
+from loguru import logger
+from file_index import DEFAULT_STORAGE_DIR, FileIndex, PackedEntry, \
+    get_index
+
+PACKS_DIR = '.packs/'
+PACK_NAME = 'pack-{:06d}.dat'
+LOCK_FILE_NAME = 'lock'
+# Когда текущий pack-файл достигает этого размера, начинается следующий
+MAX_PACK_SIZE: int = 256 * 1024 * 1024
+# Pack-файл уплотняется, если удаленные записи занимают не меньше этой
+# доли его размера
+COMPACT_DEAD_RATIO: float = 0.5
+COPY_BUFFER_SIZE: int = 65536
+
+PACK_MAGIC = b'PKv1'
+# Заголовок записи: PACK_MAGIC, признак, длина ключа, длина данных
+RECORD_HEADER = struct.Struct('>4sBHQ')
+FLAG_OFFSET = len(PACK_MAGIC)
+LIVE = 1
+DELETED = 0
+
+
+class PackLocation(NamedTuple):
+    """
+    Откуда отдавать файл: путь к pack-файлу, смещение и длина данных
+    """
+    path: str
+    offset: int
+    length: int
+
+
+def record_size(key: str, length: int) -> int:
+    """
+    Полный размер записи в pack-файле: заголовок, ключ и данные
+    """
+    return RECORD_HEADER.size + len(key.encode()) + length
+
+
+def parse_pack_id(file_name: str) -> Optional[int]:
+    """
+    Номер pack-файла из имени pack-<номер>.dat
+    """
+    if not (file_name.startswith('pack-') and file_name.endswith('.dat')):
+        return None
+    number = file_name[len('pack-'):-len('.dat')]
+    return int(number) if number.isdigit() else None
+
+
+class PackStore:
+    """
+    Pack-файлы одного хранилища
+
+    max_object_size - файлы не больше этого размера складываются в
+    pack-файлы, 0 - новые файлы не складываются (уже сложенные все равно
+    отдаются и удаляются)
+    """
+
+    def __init__(self, storage_dir: str, max_object_size: int = 0,
+                 max_pack_size: int = MAX_PACK_SIZE,
+                 index: Optional[FileIndex] = None):
+        self.storage_dir = storage_dir
+        self.packs_dir = storage_dir + PACKS_DIR
+        self.max_object_size = max_object_size
+        self.max_pack_size = max_pack_size
+        self._index = index
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._lock_pid = 0
+        self._has_packs = bool(self.pack_ids())
+        if self._has_packs and not self.index.packed_sizes():
+            # Индекс создан заново - восстанавливаем его по pack-файлам
+            self.recover()
+
+    @property
+    def index(self) -> FileIndex:
+        return self._index or get_index(self.storage_dir)
+
+    def accepts(self, file_size: int) -> bool:
+        """
+        Складывать ли файл такого размера в pack-файл
+        """
+        return 0 < self.max_object_size and file_size <= self.max_object_size
+
+    def pack_path(self, pack_id: int) -> str:
+        return self.packs_dir + PACK_NAME.format(pack_id)
+
+    def pack_ids(self) -> List[int]:
+        """
+        Номера существующих pack-файлов по возрастанию
+        """
+        if not os.path.isdir(self.packs_dir):
+            return []
+        return sorted(pack_id for pack_id in map(
+            parse_pack_id, os.listdir(self.packs_dir)) if pack_id is not None)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Блокировка pack-файлов от других потоков и процессов
+        """
+        with self._lock:
+            if self._lock_file is None or self._lock_pid != os.getpid():
+                os.makedirs(self.packs_dir, exist_ok=True)
+                # После fork нужен свой дескриптор, иначе flock общий
+                self._lock_file = open(self.packs_dir + LOCK_FILE_NAME, 'ab')
+                self._lock_pid = os.getpid()
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def locate(self, key: str) -> Optional[PackLocation]:
+        """
+        Расположение файла в pack-файле, None - файл лежит отдельно
+        """
+        if not self._has_packs and not self.max_object_size:
+            return None
+        entry = self.index.lookup_packed(key)
+        if entry is None:
+            return None
+        return PackLocation(self.pack_path(entry.pack), entry.offset,
+                            entry.length)
+
+    def add(self, key: str, temp_file: str) -> bool:
+        """
+        Дописываем файл в текущий pack-файл
+
+        :return: True - файл добавлен, False - он уже был в pack-файле
+        """
+        with self._locked():
+            if self.index.lookup_packed(key) is not None:
+                return False
+            with open(temp_file, 'rb') as source:
+                entry = self._append(key, source,
+                                     os.fstat(source.fileno()).st_size)
+            self.index.add_packed(key, entry)
+        self._has_packs = True
+        return True
+
+    def _append(self, key: str, source, length: int) -> PackedEntry:
+        """
+        Записываем файл в конец текущего pack-файла (под блокировкой)
+        """
+        pack_ids = self.pack_ids()
+        pack_id = pack_ids[-1] if pack_ids else 1
+        pack_path = self.pack_path(pack_id)
+        if os.path.exists(pack_path) and \
+                os.path.getsize(pack_path) >= self.max_pack_size:
+            pack_id += 1
+            pack_path = self.pack_path(pack_id)
+
+        key_bytes = key.encode()
+        with open(pack_path, 'ab') as pack:
+            record_offset = pack.tell()
+            pack.write(RECORD_HEADER.pack(PACK_MAGIC, LIVE, len(key_bytes),
+                                          length))
+            pack.write(key_bytes)
+            copied = 0
+            while copied < length:
+                data = source.read(min(COPY_BUFFER_SIZE, length - copied))
+                if not data:
+                    raise ValueError("Source is shorter than expected")
+                pack.write(data)
+                copied += len(data)
+        return PackedEntry(pack_id, record_offset + RECORD_HEADER.size +
+                           len(key_bytes), length)
+
+    def delete(self, key: str) -> bool:
+        """
+        Помечаем запись файла удаленной и убираем ее из индекса
+
+        :return: True - файл был в pack-файле
+        """
+        if self.locate(key) is None:
+            return False
+        with self._locked():
+            entry = self.index.lookup_packed(key)
+            if entry is None:
+                return False
+            record_offset = entry.offset - len(key.encode()) - \
+                RECORD_HEADER.size
+            try:
+                with open(self.pack_path(entry.pack), 'r+b') as pack:
+                    pack.seek(record_offset + FLAG_OFFSET)
+                    pack.write(bytes([DELETED]))
+            except FileNotFoundError:
+                logger.error("Pack file of {} is missing", key)
+            self.index.remove_packed(key)
+        return True
+
+    def compact(self, min_dead_ratio: float = COMPACT_DEAD_RATIO) -> int:
+        """
+        Уплотняем pack-файлы, в которых много удаленных записей (кроме
+        текущего, в который идет запись)
+
+        Запрос, который получил расположение файла до уплотнения, может не
+        найти старый pack-файл - такое соединение закрывается
+
+        :return: сколько байт освобождено
+        """
+        reclaimed = 0
+        with self._locked():
+            for pack_id in self.pack_ids()[:-1]:
+                pack_path = self.pack_path(pack_id)
+                pack_size = os.path.getsize(pack_path)
+                records = self.index.packed_in(pack_id)
+                live_size = sum(record_size(key, entry.length)
+                                for key, entry in records)
+                if pack_size and \
+                        (pack_size - live_size) / pack_size < min_dead_ratio:
+                    continue
+                with open(pack_path, 'rb') as pack:
+                    for key, entry in records:
+                        pack.seek(entry.offset)
+                        self.index.add_packed(key, self._append(
+                            key, pack, entry.length))
+                os.remove(pack_path)
+                reclaimed += pack_size - live_size
+                logger.info("Pack {} was compacted: {} bytes reclaimed",
+                            pack_id, pack_size - live_size)
+        return reclaimed
+
+    def recover(self) -> int:
+        """
+        Восстанавливаем расположение файлов в индексе по записям
+        pack-файлов
+
+        :return: количество найденных файлов
+        """
+        found = 0
+        index = self.index
+        for pack_id in self.pack_ids():
+            for key, entry in scan_pack(self.pack_path(pack_id), pack_id):
+                index.add_packed(key, entry)
+                if index.lookup(key) is None:
+                    index.add(key, entry.length)
+                found += 1
+        logger.info("Pack index was recovered: {} files", found)
+        return found
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики для GET /stats: количество pack-файлов, их общий размер
+        и объем живых данных
+        """
+        pack_ids = self.pack_ids()
+        return {'packs': len(pack_ids),
+                'bytes': sum(os.path.getsize(self.pack_path(pack_id))
+                             for pack_id in pack_ids),
+                'live_bytes': sum(self.index.packed_sizes().values())}
+
+
+def scan_pack(pack_path: str, pack_id: int):
+    """
+    Живые записи pack-файла: ключ и расположение
+
+    Недописанная последняя запись (аварийная остановка) пропускается
+    """
+    pack_size = os.path.getsize(pack_path)
+    with open(pack_path, 'rb') as pack:
+        offset = 0
+        while offset + RECORD_HEADER.size <= pack_size:
+            pack.seek(offset)
+            magic, flag, key_len, length = RECORD_HEADER.unpack(
+                pack.read(RECORD_HEADER.size))
+            data_offset = offset + RECORD_HEADER.size + key_len
+            if magic != PACK_MAGIC or data_offset + length > pack_size:
+                logger.error("Pack {} is damaged at {}", pack_id, offset)
+                break
+            if flag == LIVE:
+                key = pack.read(key_len).decode()
+                yield key, PackedEntry(pack_id, data_offset, length)
+            offset = data_offset + length
+
+
+_store: Optional[PackStore] = None
+_store_lock = threading.Lock()
+
+
+def get_pack_store(storage_dir: Optional[str] = None) -> PackStore:
+    """
+    Pack-файлы хранилища storage_dir (по умолчанию - открытого последним
+    или DEFAULT_STORAGE_DIR)
+    """
+    global _store  # pylint: disable=global-statement
+    with _store_lock:
+        if storage_dir is None:
+            storage_dir = _store.storage_dir if _store else \
+                DEFAULT_STORAGE_DIR
+        if _store is None or _store.storage_dir != storage_dir:
+            _store = PackStore(storage_dir)
+        return _store
+
+
+def enable_packing(storage_dir: str, max_object_size: int) -> PackStore:
+    """
+    Складываем новые файлы не больше max_object_size байт в pack-файлы
+    """
+    store = get_pack_store(storage_dir)
+    store.max_object_size = max_object_size
+    return store
@@ -3,19 +3,52 @@ Implementation of file Uploads on POST method
 """
 
 import os
+import time
+import shutil
 import socket
+import asyncio
+import tempfile
 from pathlib import Path
-from typing import Tuple, Dict
+from typing import Tuple, Dict, List, Optional
 from loguru import logger
-from file_hashing import get_hash_md5
+from file_hashing import get_algorithm, get_hasher, make_hash_key, \
+    split_hash_key
+from connection import ClientConnection
+from http_parser import ChunkedDecoder, HttpParseError, is_chunked
+from file_index import get_index
+from stat_cache import get_stat_cache
+from pack_store import get_pack_store
+from volumes import get_volumes
+import compression
+import metrics
+import access_log
+from multipart import MultipartError, MultipartParser, PART_BEGIN, \
+    PART_DATA, get_boundary, parse_header_params, part_filename
+from tar_stream import TAR_CONTENT_TYPES, TarError, TarParser
+
+
+# Каталог временных файлов загрузок внутри хранилища
+STAGING_DIR = '.staging/'
+STAGING_PREFIX = 'upload-'
+STAGING_SUFFIX = '.part'
+# Тело запроса без разметки multipart - это сам файл
+OCTET_STREAM = 'application/octet-stream'
+# Ошибки в теле запроса, на которые отвечаем 400 Bad Request
+UPLOAD_BODY_ERRORS = (MultipartError, TarError, HttpParseError)
+# Клиент не прислал очередную часть тела за request_timeout секунд,
+# отвечаем 408 Request Timeout
+UPLOAD_TIMEOUT_ERRORS = (socket.timeout, asyncio.TimeoutError)
+
+# Клиент может заранее указать ключ загружаемого файла в этом заголовке,
+# в If-None-Match или в параметре file_hash, а с Expect: 100-continue -
+# дождаться ответа, нужно ли вообще отправлять файл
+DECLARED_HASH_HEADER = 'X-Content-Hash'
+EXPECT_CONTINUE = '100-continue'
+CONTINUE_RESPONSE = b'HTTP/1.1 100 Continue\r\n\r\n'
 
 
-# Можно добавлять хэши файлов в отдельное хранилище ключ-значение
-# STORE = {}
-# Потребуется реализовать проверку файлов на дубликаты в хранилище
-
 def post_request_handler(client_socket, buffer_size, req_headers_dict,
-                         req_body) -> Tuple[str, int]:
+                         req_body, declared_hash: str = '') -> Tuple[str, int]:
     """
     Функция позволяет обработать POST-запрос от клиента
 
@@ -23,44 +56,222 @@ def post_request_handler(client_socket, buffer_size, req_headers_dict,
     :param buffer_size: размер серверного буфера
     :param req_headers_dict: словарь с заголовками запроса (без первой строки)
     :param req_body: тело запроса от клиента или его часть
+    :param declared_hash: ключ файла, указанный клиентом (см.
+    check_declared_hash); файл хэшируется тем же алгоритмом и
+    принимается, только если ключи совпали
     :return: возвращаем кортеж из:
-    file_hash - символьная строка с хэшом, в случае проблем
-    возвращаем пустую строку
+    file_hash - символьная строка с хэшом (если в запросе несколько
+    файлов - хэши через перевод строки), в случае проблем возвращаем
+    пустую строку
     status - целое число, определяюще статус код, который требуется отдать
     """
     storage_dir = str(Path().parent.absolute()) + '/store/'
-    temp_file = storage_dir + 'temp.data'
 
-    # возвращаем True, если проверка прошла успешно
-    if check_post_request(req_headers_dict,
-                          req_body):
+    receiver, status = receive_upload(client_socket, buffer_size,
+                                      req_headers_dict, req_body,
+                                      storage_dir,
+                                      declared_algorithm(declared_hash))
+    if receiver is None:
+        return '', status
 
-        try:
-            is_file_received = receive_file_from_client(
-                client_socket, buffer_size,
-                req_headers_dict,
-                req_body,
-                temp_file)
+    return serve_received_files(receiver.files, storage_dir, declared_hash)
 
-        except Exception as unknown_error:
-            logger.error("Unknown Error was occurred: {}", unknown_error)
-            file_hash = ''  # Can't get file_hash
-            status = 500  # 500 Internal Server Error
 
-            return file_hash, status
+async def post_request_handler_async(reader, buffer_size, req_headers_dict,
+                                     req_body, declared_hash: str = ''
+                                     ) -> Tuple[str, int]:
+    """
+    Асинхронная версия post_request_handler для движка asyncio
 
-        else:
-            file_hash, status = serve_post_request(is_file_received,
-                                                   storage_dir, temp_file)
-            return file_hash, status
+    Тело запроса читается из asyncio.StreamReader и хэшируется по мере
+    получения, поэтому перемещение файла в хранилище не требует повторного
+    чтения файла; само перемещение выполняется в пуле потоков
 
-    else:
+    :param reader: asyncio.StreamReader клиента
+    :param buffer_size: размер серверного буфера
+    :param req_headers_dict: словарь с заголовками запроса (без первой строки)
+    :param req_body: уже прочитанная часть тела запроса
+    :param declared_hash: ключ файла, указанный клиентом
+    :return: кортеж из хэша файла и статус кода, как у post_request_handler
+    """
+    storage_dir = str(Path().parent.absolute()) + '/store/'
+
+    receiver, status = await receive_upload_async(
+        reader, buffer_size, req_headers_dict, req_body, storage_dir,
+        declared_algorithm(declared_hash))
+    if receiver is None:
+        return '', status
+
+    # Перенос в хранилище (копирование между томами, os.link, индекс)
+    # блокирует, поэтому выполняется в пуле потоков
+    return await metrics.run_in_executor(serve_received_files,
+                                         receiver.files, storage_dir,
+                                         declared_hash)
+
+
+def receive_upload(client_socket, buffer_size, req_headers_dict, req_body,
+                   storage_dir: str, algorithm: Optional[str] = None
+                   ) -> Tuple[Optional['UploadReceiver'], int]:
+    """
+    Проверяем POST-запрос и получаем все файлы из его тела во временные
+    файлы; в хранилище они переносятся отдельно (serve_post_request)
+
+    :param client_socket: клиентский сокет
+    :param buffer_size: размер серверного буфера
+    :param req_headers_dict: словарь с заголовками запроса
+    :param req_body: тело запроса от клиента или его часть
+    :param storage_dir: каталог хранилища
+    :param algorithm: алгоритм хэширования, по умолчанию - выбранный
+    :return: кортеж из приемника с полученными файлами (files, names) и
+    статус кода 200, при ошибке - None и статус код 400, 408 или 500
+    """
+    # возвращаем True, если проверка прошла успешно
+    if not check_post_request(req_headers_dict, req_body):
+        log_bad_post_request(req_headers_dict, req_body)
+        return None, 400  # 400 Bad Request
+
+    receiver = UploadReceiver(req_headers_dict, storage_dir, algorithm)
+    started = time.perf_counter()
+    try:
+        receive_files_from_client(client_socket, buffer_size,
+                                  req_headers_dict, req_body, receiver)
+    except UPLOAD_BODY_ERRORS as body_error:
+        logger.error("400 Bad Request: {}", body_error)
+        receiver.discard()
+        return None, 400
+    except UPLOAD_TIMEOUT_ERRORS:
+        logger.debug("408 Request Timeout: request body was not received")
+        receiver.discard()
+        return None, 408
+    except Exception as unknown_error:
+        logger.error("Unknown Error was occurred: {}", unknown_error)
+        receiver.discard()
+        return None, 500  # 500 Internal Server Error
+    finally:
+        metrics.add_stage('body_receive', time.perf_counter() - started)
+
+    return receiver, 200
+
+
+async def receive_upload_async(reader, buffer_size, req_headers_dict,
+                               req_body, storage_dir: str,
+                               algorithm: Optional[str] = None
+                               ) -> Tuple[Optional['UploadReceiver'], int]:
+    """
+    Асинхронная версия receive_upload
+    """
+    if not check_post_request(req_headers_dict, req_body):
+        log_bad_post_request(req_headers_dict, req_body)
+        return None, 400
+
+    receiver = UploadReceiver(req_headers_dict, storage_dir, algorithm)
+    started = time.perf_counter()
+    try:
+        await receive_files_from_client_async(
+            reader, buffer_size, req_headers_dict, req_body, receiver)
+    except UPLOAD_BODY_ERRORS as body_error:
+        logger.error("400 Bad Request: {}", body_error)
+        receiver.discard()
+        return None, 400
+    except UPLOAD_TIMEOUT_ERRORS:
+        logger.debug("408 Request Timeout: request body was not received")
+        receiver.discard()
+        return None, 408
+    except Exception as unknown_error:
+        logger.error("Unknown Error was occurred: {}", unknown_error)
+        receiver.discard()
+        return None, 500
+    finally:
+        metrics.add_stage('body_receive', time.perf_counter() - started)
+
+    return receiver, 200
+
+
+def log_bad_post_request(req_headers_dict: Dict, req_body: bytes):
+    """
+    Отладочная запись о некорректном POST-запросе: заголовки и тело
+    запроса выводятся, только если это включено (access_log)
+    """
+    if access_log.dumps_payloads():
         logger.debug(
             "400 Bad Request: \nRequest header: {} \n Request body: {}",
             req_headers_dict, req_body)
-        file_hash = ''  # Can't get file_hash
-        status = 400  # 400 Bad Request
-        return file_hash, status
+    else:
+        logger.debug("400 Bad Request: Content-Type {!r}",
+                     req_headers_dict.get('Content-Type'))
+
+
+def get_declared_hash(req_headers: Dict,
+                      params: Dict[str, str]) -> Optional[str]:
+    """
+    Ключ загружаемого файла, указанный клиентом в параметре file_hash,
+    заголовке X-Content-Hash или If-None-Match (ETag файла - это его ключ
+    в кавычках)
+
+    :param req_headers: словарь с заголовками запроса
+    :param params: параметры запроса (HttpRequest.query)
+    :return: ключ в каноническом виде; пустая строка, если указан
+    некорректный ключ; None, если клиент ключ не указал
+    """
+    declared = params.get('file_hash')
+    if declared is None:
+        declared = req_headers.get(DECLARED_HASH_HEADER)
+    if declared is None and \
+            req_headers.get('If-None-Match', '*').strip() != '*':
+        declared = req_headers['If-None-Match'].strip().strip('"')
+    if declared is None:
+        return None
+
+    hash_key = split_hash_key(declared.strip())
+    if not hash_key:
+        return ''
+    return make_hash_key(*hash_key)
+
+
+def declared_algorithm(declared_hash: str) -> Optional[str]:
+    """
+    Алгоритм ключа, указанного клиентом, None - используем выбранный для
+    хранилища
+    """
+    return split_hash_key(declared_hash)[0] if declared_hash else None
+
+
+def check_declared_hash(req_headers: Dict,
+                        params: Dict[str, str]) -> Tuple[str, int]:
+    """
+    Проверка POST-запроса до чтения тела: если клиент указал ключ файла,
+    который уже есть в хранилище, и ждет разрешения на отправку тела
+    (Expect: 100-continue), загрузка не нужна - добавляем ссылку на
+    файл и сразу отвечаем 409
+
+    :param req_headers: словарь с заголовками запроса
+    :param params: параметры запроса (HttpRequest.query)
+    :return: кортеж из указанного клиентом ключа (или пустой строки) и
+    статус кода: 100 - отправить клиенту 100 Continue и принимать файл,
+    200 - принимать файл, 409 - файл уже есть, 400 - некорректный ключ;
+    при 409 и 400 тело запроса не прочитано
+    """
+    declared_hash = get_declared_hash(req_headers, params)
+    if declared_hash == '':
+        logger.debug("400 Bad Request: invalid declared hash")
+        return '', 400
+
+    if not expects_continue(req_headers):
+        return declared_hash or '', 200
+
+    if declared_hash and get_index().add_reference(declared_hash):
+        get_stat_cache().invalidate(declared_hash)
+        logger.debug("409 Conflict: upload of {} was skipped",
+                     declared_hash)
+        return declared_hash, 409
+    return declared_hash or '', 100
+
+
+def expects_continue(req_headers: Dict) -> bool:
+    """
+    Клиент ждет 100 Continue, прежде чем отправить тело запроса
+    """
+    return req_headers.get('Expect', '').strip().lower() == EXPECT_CONTINUE
 
 
 @logger.catch
@@ -69,9 +280,13 @@ def check_post_request(req_headers: Dict, req_body: bytes) -> bool:
     Проверка POST-запроса перед обработкой
 
     Функция для проверки структуры содержимого POST-запроса, который должен
-    содержать заголовок Content-Type с указанием boundary для границ данных
-    в виде байт для файла, Content-Length для размера файла и проверки
-    его правильной загрузки на сервер, а также что-либо в Request Body,
+    содержать заголовок Content-Type (multipart/form-data с указанием
+    boundary, архив application/x-tar или application/octet-stream) и
+    Content-Length с размером
+    тела запроса для проверки его правильной загрузки на сервер либо
+    Transfer-Encoding: chunked, если размер тела заранее неизвестен. Тело
+    запроса может прийти отдельно от заголовков, поэтому здесь оно не
+    проверяется
 
     :param req_headers:
     :param req_body:
@@ -79,121 +294,492 @@ def check_post_request(req_headers: Dict, req_body: bytes) -> bool:
     """
     try:
         content_type = req_headers["Content-Type"]
-        content_length = req_headers["Content-Length"]
-        boundary = content_type.split('; ')[1].split('=')[1]
+        if "Transfer-Encoding" in req_headers:
+            # Content-Length при этом не учитывается (RFC 7230, 3.3.3)
+            content_length = 0 if is_chunked(req_headers) else -1
+        else:
+            # Возможность привести Content-Length к целочисленному типу
+            content_length = int(req_headers["Content-Length"])
     except KeyError as key_error:
         logger.error("{}", key_error)
         return False
-    except IndexError as index_error:
-        logger.error("{}", index_error)
+    except ValueError:
         return False
 
-    # проверим, что каждый элемент что-либо содержит
-    if not (content_type and content_length and boundary and req_body):
+    if content_length < 0:
         return False
 
-    # Возможность привести содержимое Content-Length к целочисленному типу int
-    try:
-        int(content_length)
-    except ValueError:
+    if get_boundary(content_type) is None and \
+            parse_header_params(content_type)[0] not in \
+            (OCTET_STREAM,) + TAR_CONTENT_TYPES:
         return False
 
     return True  # 200 OK
 
 
-@logger.catch
-def serve_post_request(is_file_received, storage_dir, temp_file) -> Tuple:
+def serve_received_files(received_files: List[Tuple[str, str]],
+                         storage_dir: str,
+                         declared_hash: str = '') -> Tuple[str, int]:
     """
-    Основной обработчик для POST запросов
+    Переносим в хранилище все файлы, полученные в одном запросе
+
+    :param received_files: список из ключей и временных файлов
+    (UploadReceiver.finish)
+    :param storage_dir: каталог хранилища
+    :param declared_hash: ключ, указанный клиентом, - тогда в запросе
+    должен быть ровно один файл
+    :return: кортеж из ключей файлов через перевод строки и статус кода:
+    200, если добавлен хотя бы один новый файл, 409 - если все файлы уже
+    были в хранилище
+    """
+    if not received_files or (declared_hash and len(received_files) > 1):
+        logger.error("400 Bad Request: {} files in request",
+                     len(received_files))
+        for _, temp_file in received_files:
+            remove_staging_file(temp_file)
+        return '', 400
+
+    file_hashes = []
+    statuses = []
+    for file_hash, temp_file in received_files:
+        started = time.perf_counter()
+        file_hash, status = serve_post_request(file_hash, storage_dir,
+                                               temp_file, declared_hash)
+        metrics.add_stage('commit', time.perf_counter() - started)
+        if status not in (200, 409):
+            return file_hash, status
+        file_hashes.append(file_hash)
+        statuses.append(status)
 
-    :param is_file_received: клиентский сокет
-    :param storage_dir: размер буфера обмена для сервера
-    :param temp_file: словарь из заголовков запроса клиента
+    return '\n'.join(file_hashes), 200 if 200 in statuses else 409
+
+
+@logger.catch
+def serve_post_request(file_hash, storage_dir, temp_file,
+                       declared_hash: str = '') -> Tuple:
+    """
+    Основной обработчик для POST запросов: переносим полученный файл из
+    каталога временных файлов в хранилище
+
+    Если такое содержимое уже есть в индексе хранилища, файл не
+    переносится, а только добавляется ссылка на него (409). Новый файл
+    появляется в хранилище атомарно через os.link, который не
+    перезаписывает существующий файл, поэтому параллельные загрузки
+    одинакового содержимого не мешают друг другу: одна получит 200,
+    остальные 409
+
+    :param file_hash: хэш полученного файла, посчитанный при получении,
+    пустая строка - файл не был получен
+    :param storage_dir: каталог хранилища
+    :param temp_file: временный файл с полученными данными
+    :param declared_hash: ключ, указанный клиентом; если хэш полученного
+    файла с ним не совпал, файл отбрасывается (400)
     :return: Кортеж из хэша записанного файла и статус код, определяющий
     успешность работы функции, если возникли проблемы, то возвращается
     пустая строка и статус код, определяющий тип проблемы
     """
 
-    # Если is_file_received = False, возвращаем 500 Internal Server Error
-    if not is_file_received:
+    # Если файл не был получен, возвращаем 500 Internal Server Error
+    if not file_hash:
+        remove_staging_file(temp_file)
         return '', 500
 
-    # Если файл был успешно загружен, то получаем его хэш
-    file_hash = get_hash_md5(temp_file)
-    # Пара первых символов хэша становится названием каталога для файла
-    hash_first_symbols = file_hash[:2]
-    # Полное имя файла
-    new_dir = storage_dir + hash_first_symbols
+    if declared_hash and file_hash != declared_hash:
+        logger.error("400 Bad Request: file hash {} does not match declared "
+                     "{}", file_hash, declared_hash)
+        remove_staging_file(temp_file)
+        return '', 400
+
+    index = get_index(storage_dir)
+    if index.add_reference(file_hash):
+        # Дубликат - файл уже в хранилище, добавлена только ссылка
+        get_stat_cache().invalidate(file_hash)
+        remove_staging_file(temp_file)
+        logger.error("409 Conflict: File Exists")
+        return file_hash, 409
 
-    # Проверяем правильность создания директории
-    check_dir = Path(new_dir)
-    if not check_dir.is_dir():
+    file_size = os.path.getsize(temp_file)
+    pack_store = get_pack_store(storage_dir)
+    if pack_store.accepts(file_size):
+        # Небольшой файл дописывается в pack-файл
         try:
-            os.mkdir(new_dir)
-        except OSError:
-            logger.error("Creation of the directory {} failed", new_dir)
-        else:
-            logger.success("Successfully created the directory {} ", new_dir)
+            status = 200 if pack_store.add(file_hash, temp_file) else 409
+        finally:
+            remove_staging_file(temp_file)
+        index.add(file_hash, file_size)
+        get_stat_cache().invalidate(file_hash)
+        return file_hash, status
 
-    new_file_name = new_dir + '/' + file_hash
+    # Файл сохраняется на одном из томов хранилища (volumes), первые
+    # символы хэша становятся названиями каталогов для файла
+    # (storage_paths), имя файла - ключ с указанием алгоритма хэширования
+    volumes = get_volumes(storage_dir)
+    volume_dir = volumes.target_volume(file_hash, temp_file)
+    if volumes.volume_of(temp_file) != volume_dir:
+        # Файл получен на другом томе, os.link между томами невозможен
+        temp_file = copy_staging_file(temp_file, volume_dir)
+    new_file_name = volumes.file_path(file_hash, volume_dir)
+    new_dir = os.path.dirname(new_file_name)
 
-    check_file = Path(new_file_name)
-    if check_file.is_file():
-        os.remove(temp_file)
+    try:
+        # Каталог может удалить параллельный DELETE последнего файла в нем,
+        # поэтому создаем его заново при неудачной попытке
+        for _ in range(2):
+            os.makedirs(new_dir, exist_ok=True)
+            try:
+                os.link(temp_file, new_file_name)
+            except FileNotFoundError:
+                continue
+            break
+        else:
+            # Файл не сохранен - в индекс его не добавляем
+            logger.error("500 Internal Server Error: {} was not linked",
+                         new_file_name)
+            return '', 500
+    except FileExistsError:
         status = 409
         logger.error("409 Conflict: File Exists")
-        return file_hash, status
+    else:
+        # Добавлен новый файл
+        status = 200
+        if not volumes.claim(file_hash, volume_dir):
+            # То же содержимое одновременно сохранено на другом томе
+            os.remove(new_file_name)
+            status = 409
+    finally:
+        remove_staging_file(temp_file)
+
+    index.add(file_hash, file_size)
+    get_stat_cache().invalidate(file_hash)
+    if status == 200:
+        # Сжатые копии нового файла создаются в фоне, если это включено
+        compression.submit(file_hash, new_file_name)
+    return file_hash, status
 
-    # Добавлен новый файл
-    os.rename(temp_file, new_file_name)
-    status = 200
 
-    # Add new entity to key:value STORE
-    # STORE[file_hash] = new_file_name
-    # print(STORE)
+def create_staging_file(storage_dir: str) -> str:
+    """
+    Создаем уникальный временный файл для загрузки в каталоге
+    STAGING_DIR внутри хранилища (та же файловая система, что и у
+    хранилища, поэтому перенос файла не требует копирования).
+    В имени файла сохраняется PID процесса, чтобы при запуске сервера
+    можно было отличить брошенные файлы от загружаемых прямо сейчас
+
+    :param storage_dir: каталог хранилища
+    :return: полный путь к временному файлу
+    """
+    staging_dir = storage_dir + STAGING_DIR
+    os.makedirs(staging_dir, exist_ok=True)
+    file_descriptor, temp_file = tempfile.mkstemp(
+        prefix='{}{}-'.format(STAGING_PREFIX, os.getpid()),
+        suffix=STAGING_SUFFIX, dir=staging_dir)
+    os.close(file_descriptor)
+    return temp_file
 
-    return file_hash, status
 
+def copy_staging_file(temp_file: str, storage_dir: str) -> str:
+    """
+    Переносим временный файл в каталог временных файлов другого тома
 
-@logger.catch
-def receive_file_from_client(client_sock: socket.socket, server_buffer: int,
-                             req_headers: Dict, req_body: bytes,
-                             filename: str) -> bool:
+    :param storage_dir: каталог тома
+    :return: полный путь к новому временному файлу
+    """
+    new_temp_file = create_staging_file(storage_dir)
+    try:
+        shutil.copyfile(temp_file, new_temp_file)
+    except OSError:
+        remove_staging_file(new_temp_file)
+        raise
+    finally:
+        remove_staging_file(temp_file)
+    return new_temp_file
+
+
+def remove_staging_file(temp_file: str):
+    """
+    Удаляем временный файл, если он еще существует
+    """
+    try:
+        os.remove(temp_file)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_staging_files(storage_dir: str) -> int:
+    """
+    Удаляем временные файлы, оставшиеся от прерванных загрузок: файлы
+    процессов, которые уже не работают, и temp.data прежних версий
+
+    :param storage_dir: каталог хранилища
+    :return: количество удаленных файлов
+    """
+    removed = 0
+    legacy_temp_file = storage_dir + 'temp.data'
+    if os.path.isfile(legacy_temp_file):
+        remove_staging_file(legacy_temp_file)
+        removed += 1
+
+    staging_dir = storage_dir + STAGING_DIR
+    if not os.path.isdir(staging_dir):
+        return removed
+
+    for file_name in os.listdir(staging_dir):
+        owner_pid = file_name[len(STAGING_PREFIX):].split('-')[0]
+        if owner_pid.isdigit() and is_process_alive(int(owner_pid)):
+            continue
+        remove_staging_file(staging_dir + file_name)
+        removed += 1
+
+    if removed:
+        logger.info("Removed {} orphaned staging files", removed)
+    return removed
+
+
+def is_process_alive(pid: int) -> bool:
     """
-    Функция позволяет получить файл от клиента и записать его в filename
+    Проверяем, работает ли процесс с идентификатором pid
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # процесс есть, но принадлежит другому
+        return True
+    return True
+
+
+class BodyReceiver:
+    """
+    Приемник тела запроса для receive_files_from_client: получает тело по
+    частям и возвращает результат, когда тело получено полностью
+    """
+
+    def feed(self, data: bytes):
+        """
+        Обрабатываем очередную часть тела запроса
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        Тело запроса получено полностью, возвращаем результат
+        """
+        raise NotImplementedError
+
+    def discard(self):
+        """
+        Освобождаем все, что осталось от запроса (после ошибки или обрыва
+        соединения)
+        """
+        raise NotImplementedError
 
-    :param client_sock: объект socket для клиента, сделавшего запрос
+
+class UploadReceiver(BodyReceiver):
+    """
+    Приемник тела POST-запроса: тело application/octet-stream целиком,
+    каждая часть multipart/form-data с именем файла (filename) или каждый
+    обычный файл архива tar пишется в свой временный файл и хэшируется по
+    мере получения. Остальные части (обычные поля формы, каталоги архива)
+    пропускаются
+    """
+
+    def __init__(self, req_headers: Dict, storage_dir: str,
+                 algorithm: Optional[str] = None):
+        self.storage_dir = storage_dir
+        self.algorithm = algorithm or get_algorithm()
+        # Полученные файлы: ключ и временный файл
+        self.files: List[Tuple[str, str]] = []
+        # Имена полученных файлов (из multipart или tar) в том же порядке
+        self.names: List[str] = []
+        content_type = req_headers['Content-Type']
+        boundary = get_boundary(content_type)
+        if boundary:
+            self.parser = MultipartParser(boundary)
+        elif parse_header_params(content_type)[0] in TAR_CONTENT_TYPES:
+            self.parser = TarParser()
+        else:
+            self.parser = None
+        self._name = ''
+        self._temp_file = ''
+        self._stream = None
+        self._hasher = None
+        if self.parser is None:
+            self._begin_file()
+
+    def feed(self, data: bytes):
+        """
+        Обрабатываем очередную часть тела запроса
+
+        :raise MultipartError: если тело multipart/form-data некорректно
+        :raise TarError: если архив tar некорректен
+        """
+        if self.parser is None:
+            self._write(data)
+            return
+        for event, value in self.parser.feed(data):
+            if event == PART_BEGIN:
+                # У tar значение - имя файла, у multipart - заголовки части
+                name = value if isinstance(value, str) else \
+                    part_filename(value)
+                if name is not None:
+                    self._begin_file(name)
+            elif event == PART_DATA:
+                if self._stream is not None:
+                    self._write(value)
+            else:  # event == PART_END
+                self._end_file()
+
+    def finish(self) -> List[Tuple[str, str]]:
+        """
+        Тело запроса получено полностью
+
+        :return: список из ключей и временных файлов полученных файлов
+        :raise MultipartError: если не было завершающего разделителя
+        :raise TarError: если архив закончился раньше пустого блока
+        """
+        if isinstance(self.parser, TarParser) and not self.parser.done:
+            raise TarError("Request body ended before the end of archive")
+        if self.parser is not None and not self.parser.done:
+            raise MultipartError("Request body ended before the closing "
+                                 "delimiter")
+        self._end_file()
+        return self.files
+
+    def discard(self):
+        """
+        Удаляем временные файлы запроса, которые еще не перенесены в
+        хранилище, например, после ошибки
+        """
+        if self._stream is not None:
+            self._stream.close()
+            remove_staging_file(self._temp_file)
+            self._stream = None
+        for _, temp_file in self.files:
+            remove_staging_file(temp_file)
+        self.files = []
+        self.names = []
+
+    def _begin_file(self, name: str = ''):
+        self._end_file()
+        self._name = name
+        self._temp_file = create_staging_file(
+            get_volumes(self.storage_dir).staging_volume())
+        self._stream = open(self._temp_file, 'wb')
+        self._hasher = get_hasher(self.algorithm)
+
+    def _write(self, data: bytes):
+        self._stream.write(data)
+        started = time.perf_counter()
+        self._hasher.update(data)
+        metrics.add_stage('hash', time.perf_counter() - started)
+
+    def _end_file(self):
+        if self._stream is None:
+            return
+        self._stream.close()
+        self._stream = None
+        self.files.append((make_hash_key(self.algorithm,
+                                         self._hasher.hexdigest()),
+                           self._temp_file))
+        self.names.append(self._name)
+
+
+def receive_files_from_client(client_sock: ClientConnection,
+                              server_buffer: int,
+                              req_headers: Dict, req_body: bytes,
+                              receiver: BodyReceiver
+                              ) -> List[Tuple[str, str]]:
+    """
+    Функция позволяет получить тело запроса (ровно Content-Length байт
+    или все части тела chunked) от клиента и передать его по частям в
+    receiver, который записывает файлы и считает их хэши по мере
+    получения данных из сокета
+
+    :param client_sock: подключение клиента (connection.ClientConnection)
     :param server_buffer: максимальный размер серверного буфера
     :param req_headers: словарь с заголовками запроса клиента
-    :param req_body: тело запроса клиента с данными для записи
-    :param filename: имя файла для записи данных
-    :return: True - если файл был записан без ошибок
-    """
-
-    content_len = req_headers["Content-Length"]
-    boundary = \
-        req_headers["Content-Type"].split('; ')[1].split(
-            '=')[1]
-
-    chunk_start = req_body.find(boundary.encode()) + len(boundary)
-    chunk = req_body[chunk_start:]
-
-    write_file = open(filename, 'wb')
-    write_file.write(chunk)
-
-    start_count_len = len(chunk)
-    while start_count_len < int(content_len):
-        chunk = client_sock.recv(server_buffer)
-        if chunk == '':
-            write_file.close()
-            logger.error("500 Internal Server Error: Socket connection broken")
-            return False
-        write_file.write(chunk)
-        start_count_len += len(chunk)
-    write_file.close()
-    if int(content_len) != int(
-            Path(filename).stat().st_size):
-        logger.error("500 Internal Server Error: Socket connection broken")
-        return False
+    :param req_body: уже полученное начало тела запроса
+    :param receiver: приемник файлов запроса
+    :return: список из ключей и временных файлов полученных файлов
+    :raise ConnectionError: если клиент закрыл соединение раньше времени
+    :raise MultipartError: если тело multipart/form-data некорректно
+    :raise HttpParseError: если некорректно тело chunked
+    """
+    if is_chunked(req_headers):
+        decoder = ChunkedDecoder()
+        chunk = req_body
+        while True:
+            receiver.feed(decoder.feed(chunk))
+            if decoder.done:
+                break
+            chunk = client_sock.recv(server_buffer)
+            if not chunk:
+                raise ConnectionError("Socket connection broken")
+        # Все, что пришло после тела запроса, относится к следующему запросу
+        client_sock.unread(decoder.unused)
+        return receiver.finish()
+
+    content_len = int(req_headers["Content-Length"])
+    # Все, что пришло после тела запроса, относится к следующему запросу
+    client_sock.unread(req_body[content_len:])
+    chunk = req_body[:content_len]
+    receiver.feed(chunk)
+
+    received_len = len(chunk)
+    while received_len < content_len:
+        chunk = client_sock.recv(
+            min(server_buffer, content_len - received_len))
+        if not chunk:
+            raise ConnectionError("Socket connection broken")
+        receiver.feed(chunk)
+        received_len += len(chunk)
+
+    return receiver.finish()
+
+
+async def receive_files_from_client_async(reader: asyncio.StreamReader,
+                                          server_buffer: int,
+                                          req_headers: Dict, req_body: bytes,
+                                          receiver: BodyReceiver
+                                          ) -> List[Tuple[str, str]]:
+    """
+    Асинхронная версия receive_files_from_client: тело запроса читается из
+    asyncio.StreamReader
 
-    return True
+    :param reader: asyncio.StreamReader клиента
+    :param server_buffer: максимальный размер серверного буфера
+    :param req_headers: словарь с заголовками запроса клиента
+    :param req_body: уже прочитанное начало тела запроса
+    :param receiver: приемник файлов запроса
+    :return: список из ключей и временных файлов полученных файлов
+    """
+    if is_chunked(req_headers):
+        decoder = ChunkedDecoder()
+        receiver.feed(decoder.feed(req_body))
+        while not decoder.done:
+            # Читаем не дальше конца тела: следующий запрос должен
+            # остаться в reader
+            if decoder.wants_line:
+                chunk = await reader.readuntil(b'\n')
+            else:
+                chunk = await reader.read(min(server_buffer,
+                                              decoder.remaining))
+            if not chunk:
+                raise ConnectionError("Socket connection broken")
+            receiver.feed(decoder.feed(chunk))
+        return receiver.finish()
+
+    content_len = int(req_headers["Content-Length"])
+    chunk = req_body[:content_len]
+    receiver.feed(chunk)
+
+    received_len = len(chunk)
+    while received_len < content_len:
+        chunk = await reader.read(
+            min(server_buffer, content_len - received_len))
+        if not chunk:
+            raise ConnectionError("Socket connection broken")
+        receiver.feed(chunk)
+        received_len += len(chunk)
+
+    return receiver.finish()
@@ -0,0 +1,260 @@
+"""
+Профилирование работающего сервера по сигналу
+
+По сигналу SIGUSR1 процесс сервера начинает собирать профиль: фоновый
+поток каждые SAMPLE_INTERVAL секунд снимает стеки всех потоков процесса
+(sys._current_frames). Через заданное количество секунд (или по
+повторному сигналу) профиль записывается в каталог ./log/:
+profile-<pid>-<время>.txt - функции, которые чаще всего выполнялись
+(собственное время) и чаще всего были в стеке (общее время), в долях
+от количества снимков; profile-<pid>-<время>.folded - все стеки в
+формате flamegraph.pl (кадры через ';' и количество снимков).
+
+Снимки стеков, в отличие от cProfile, видят все потоки (пул потоков,
+цикл событий asyncio), не замедляют вызовы функций и не требуют
+перезапуска сервера. В prefork родительский процесс передает сигнал
+всем процессам-обработчикам, и каждый записывает свой профиль
+"""
+import os
+import sys
+import time
+import signal
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+from loguru import logger
+
+PROFILE_SIGNAL = signal.SIGUSR1
+PROFILE_DIR = './log/'
+DEFAULT_PROFILE_SECONDS: float = 30.0
+# Как часто снимаются стеки потоков (секунды)
+SAMPLE_INTERVAL: float = 0.005
+# Сколько функций выводится в каждой таблице отчета
+TOP_FUNCTIONS: int = 40
+
+# Кадр стека: файл, первая строка функции, имя функции
+Frame = Tuple[str, int, str]
+
+
+def frame_name(frame: Frame) -> str:
+    file_name, line_number, function_name = frame
+    return '{} ({}:{})'.format(function_name, os.path.basename(file_name),
+                               line_number)
+
+
+class SamplingProfiler:
+    """
+    Профиль процесса по периодическим снимкам стеков всех потоков
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = 0.0
+        self.elapsed = 0.0
+        # Потоки самого профилирования в профиль не попадают
+        self.ignored_threads: Set[int] = set()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and \
+                self._thread is not threading.current_thread():
+            self._thread.join()
+        self.elapsed = time.monotonic() - self.started
+
+    def sample(self):
+        """
+        Снимаем стеки всех потоков, кроме ignored_threads
+        """
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        for thread_id, frame in frames.items():
+            if thread_id in self.ignored_threads:
+                continue
+            stack: List[Frame] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno,
+                              code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        self.ignored_threads.add(threading.get_ident())
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def top_functions(self) -> Tuple[Dict[Frame, int], Dict[Frame, int]]:
+        """
+        Количество снимков, в которых функция выполнялась сама (вершина
+        стека) и в которых она была в стеке
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for frame in set(stack):
+                total[frame] += count
+        return own, total
+
+    def report(self) -> str:
+        """
+        Текстовый отчет: самые частые функции по собственному и общему
+        времени
+        """
+        own, total = self.top_functions()
+        stack_samples = sum(self.stacks.values()) or 1
+        lines = ['Process {}: {} samples of {} thread stacks in {:.1f} s, '
+                 'interval {} ms'.format(os.getpid(), self.samples,
+                                         stack_samples, self.elapsed,
+                                         self.interval * 1000)]
+        for title, counts in (('Own time', own), ('Total time', total)):
+            lines.append('')
+            lines.append('{:>8} {:>7}  {}'.format('samples', '%', title))
+            for frame, count in Counter(counts).most_common(TOP_FUNCTIONS):
+                lines.append('{:>8} {:>6.1f}%  {}'.format(
+                    count, 100.0 * count / stack_samples, frame_name(frame)))
+        return '\n'.join(lines) + '\n'
+
+    def folded(self) -> str:
+        """
+        Стеки в формате flamegraph.pl
+        """
+        return ''.join('{} {}\n'.format(
+            ';'.join(frame_name(frame) for frame in stack), count)
+            for stack, count in self.stacks.most_common())
+
+    def dump(self, directory: str = PROFILE_DIR) -> str:
+        """
+        Записываем отчет и стеки в каталог directory
+
+        :return: путь к отчету (стеки - рядом, с расширением .folded)
+        """
+        os.makedirs(directory, exist_ok=True)
+        base_path = os.path.join(directory, 'profile-{}-{}'.format(
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S')))
+        with open(base_path + '.txt', 'w') as report_file:
+            report_file.write(self.report())
+        with open(base_path + '.folded', 'w') as folded_file:
+            folded_file.write(self.folded())
+        return base_path + '.txt'
+
+
+class ProfileSession:
+    """
+    Профилирование в течение seconds секунд с записью профиля в directory
+    """
+
+    def __init__(self, seconds: float = DEFAULT_PROFILE_SECONDS,
+                 directory: str = PROFILE_DIR):
+        self.seconds = seconds
+        self.directory = directory
+        self.profiler: Optional[SamplingProfiler] = None
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def toggle(self):
+        """
+        Начинаем профилирование, а если оно уже идет - заканчиваем его
+        раньше времени
+        """
+        with self._lock:
+            if self.profiler is None:
+                self.profiler = SamplingProfiler()
+                self.profiler.start()
+                self._timer = threading.Timer(self.seconds, self.finish)
+                self._timer.daemon = True
+                self._timer.start()
+                self.profiler.ignored_threads.update(
+                    (self._timer.ident, threading.get_ident()))
+                logger.info("Profiling for {} s was started", self.seconds)
+                return
+        self.finish()
+
+    def finish(self) -> Optional[str]:
+        """
+        Заканчиваем профилирование и записываем профиль
+
+        :return: путь к отчету, None - профилирование не шло
+        """
+        with self._lock:
+            profiler, self.profiler = self.profiler, None
+            timer, self._timer = self._timer, None
+        if profiler is None:
+            return None
+        if timer is not None:
+            timer.cancel()
+        profiler.stop()
+        try:
+            report_path = profiler.dump(self.directory)
+        except OSError as write_error:
+            logger.error("Profile was not written: {}", write_error)
+            return None
+        logger.info("Profile was written to {}", report_path)
+        return report_path
+
+
+_session: Optional[ProfileSession] = None
+
+
+def enable_profiling(seconds: float = DEFAULT_PROFILE_SECONDS,
+                     directory: str = PROFILE_DIR) -> bool:
+    """
+    Включаем профилирование по сигналу PROFILE_SIGNAL
+
+    :return: False - обработчик сигнала не установлен (вызов не из
+    главного потока, например, сервер в тестах)
+    """
+    global _session  # pylint: disable=global-statement
+    if threading.current_thread() is not threading.main_thread():
+        logger.debug("Profiling signal is not installed: not a main thread")
+        return False
+    _session = ProfileSession(seconds, directory)
+    signal.signal(PROFILE_SIGNAL, handle_profile_signal)
+    return True
+
+
+def handle_profile_signal(signum, frame):  # pylint: disable=unused-argument
+    """
+    Обработчик сигнала: начинаем или заканчиваем профилирование.
+    Профилирование включается в отдельном потоке: в обработчике сигнала
+    нельзя ждать блокировок журнала и писать файлы
+    """
+    if _session is not None:
+        threading.Thread(target=_session.toggle, daemon=True).start()
+
+
+def forward_profile_signal(get_children):
+    """
+    Для prefork: родительский процесс передает сигнал процессам, список
+    которых возвращает get_children, а сами процессы-обработчики
+    профилируются обычным обработчиком (reset_profile_signal)
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+
+    def forward(signum, frame):  # pylint: disable=unused-argument
+        for pid in get_children():
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(PROFILE_SIGNAL, forward)
+
+
+def reset_profile_signal():
+    """
+    В процессе-обработчике prefork: профилируем сам процесс
+    """
+    if _session is not None:
+        signal.signal(PROFILE_SIGNAL, handle_profile_signal)
@@ -0,0 +1,147 @@
+"""
+Кэш содержимого часто скачиваемых файлов для GET
+
+Небольшие файлы (до SMALL_OBJECT_SIZE) читаются в память целиком и
+хранятся, пока их общий размер не превысит бюджет max_bytes; файлы
+среднего размера (до MMAP_MAX_SIZE) отображаются в память через mmap и
+отдаются из страничного кэша без повторного открытия файла. Большие
+файлы в кэш не попадают и отдаются через sendfile (get_handler).
+
+Содержимое файла по ключу не меняется, поэтому кэш достаточно сбрасывать
+только при удалении файла (DELETE). В других процессах prefork запись
+удаленного файла остается до вытеснения, но GET сначала проверяет индекс
+и на удаленный файл отвечает 404, не обращаясь к кэшу
+"""
+import mmap
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from loguru import logger
+
+# Файлы не больше этого размера хранятся в памяти
+SMALL_OBJECT_SIZE: int = 256 * 1024
+# Общий размер файлов в памяти
+READ_CACHE_BYTES: int = 64 * 1024 * 1024
+# Файлы не больше этого размера отдаются через mmap
+MMAP_MAX_SIZE: int = 64 * 1024 * 1024
+# Сколько файлов держать отображенными в память
+MAX_MAPPED_FILES: int = 64
+
+
+class ReadCache:
+    """
+    Кэш содержимого файлов с вытеснением давно не использованных (LRU)
+
+    get возвращает memoryview на содержимое файла: срез такого буфера не
+    копирует данные. Отображение mmap не закрывается явно при вытеснении -
+    оно освобождается, когда последний отправляющий его поток отпустит
+    буфер
+    """
+
+    def __init__(self, max_bytes: int = READ_CACHE_BYTES,
+                 small_object_size: int = SMALL_OBJECT_SIZE,
+                 mmap_max_size: int = MMAP_MAX_SIZE,
+                 max_mapped: int = MAX_MAPPED_FILES):
+        self.max_bytes = max_bytes
+        self.small_object_size = small_object_size
+        self.mmap_max_size = mmap_max_size
+        self.max_mapped = max_mapped
+        self.hits = 0
+        self.misses = 0
+        self._objects: OrderedDict = OrderedDict()  # ключ -> bytes
+        self._mapped: OrderedDict = OrderedDict()  # ключ -> срез mmap
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, file_hash: str, file_abs_path: str, file_size: int,
+            offset: int = 0) -> Optional[memoryview]:
+        """
+        Содержимое файла из кэша; если файла в кэше нет, он читается или
+        отображается в память и добавляется в кэш
+
+        :param offset: смещение данных файла (файл в pack-файле)
+        :return: содержимое файла или None, если файл слишком большой
+        для кэша или не может быть прочитан (тогда его нужно отдать
+        обычным способом)
+        """
+        if file_size > self.mmap_max_size:
+            return None
+        small = file_size <= self.small_object_size
+        entries = self._objects if small else self._mapped
+        with self._lock:
+            content = entries.get(file_hash)
+            if content is not None:
+                entries.move_to_end(file_hash)
+                self.hits += 1
+                return memoryview(content)
+            self.misses += 1
+
+        try:
+            with open(file_abs_path, 'rb') as file_stream:
+                if small:
+                    file_stream.seek(offset)
+                    content = file_stream.read(file_size)
+                else:
+                    content = map_file_range(file_stream.fileno(), offset,
+                                             file_size)
+        except (OSError, ValueError) as read_error:
+            logger.debug("File is not cached: {}", read_error)
+            return None
+
+        if len(content) != file_size:  # файл короче, чем ожидалось
+            return None
+        with self._lock:
+            if small and len(content) <= self.max_bytes:
+                if file_hash not in self._objects:
+                    self._bytes += len(content)
+                self._objects[file_hash] = content
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._objects.popitem(last=False)
+                    self._bytes -= len(evicted)
+            elif not small:
+                self._mapped[file_hash] = content
+                while len(self._mapped) > self.max_mapped:
+                    self._mapped.popitem(last=False)
+        return memoryview(content)
+
+    def evict(self, file_hash: str):
+        """
+        Убираем файл из кэша, когда он удален из хранилища
+        """
+        with self._lock:
+            content = self._objects.pop(file_hash, None)
+            if content is not None:
+                self._bytes -= len(content)
+            self._mapped.pop(file_hash, None)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики кэша для GET /stats
+        """
+        with self._lock:
+            return {'objects': len(self._objects), 'bytes': self._bytes,
+                    'mapped': len(self._mapped), 'hits': self.hits,
+                    'misses': self.misses}
+
+
+def map_file_range(file_descriptor: int, offset: int,
+                   length: int) -> memoryview:
+    """
+    Отображаем в память length байт файла с позиции offset. Смещение mmap
+    должно быть кратно mmap.ALLOCATIONGRANULARITY, поэтому отображается
+    чуть больший участок, а возвращается срез нужной длины
+    """
+    shift = offset % mmap.ALLOCATIONGRANULARITY
+    mapped = mmap.mmap(file_descriptor, length + shift,
+                       offset=offset - shift, access=mmap.ACCESS_READ)
+    return memoryview(mapped)[shift:shift + length]
+
+
+_cache = ReadCache()
+
+
+def get_read_cache() -> ReadCache:
+    """
+    Кэш содержимого файлов текущего процесса
+    """
+    return _cache
@@ -3,31 +3,150 @@
 """
 Модуль с основной реализацие http-сервера
 """
-import os
 import sys
+import json
+import time
 import socket
+from functools import partial
 from pathlib import Path
-from typing import Union, Tuple, List, Dict
+from typing import Union, Tuple, List, Dict, Callable, Optional
 from loguru import logger
 import post_handler as post
 import get_handler as get
 import delete_handler
-
-METHODS: Tuple[str, ...] = ('GET', 'POST', 'DELETE')
+import batch_handler as batch
+import engines
+from connection import ClientConnection
+from http_parser import HttpParseError, HttpRequest, parse_request
+import file_hashing
+import file_index
+import compression
+import metrics
+import access_log
+import profiling
+import graceful
+from file_index import IndexEntry
+from stat_cache import get_stat_cache
+from read_cache import get_read_cache
+from pack_store import enable_packing, get_pack_store
+from volumes import DEFAULT_PLACEMENT, enable_volumes, get_volumes
+from file_hashing import make_hash_key, split_hash_key
+
+METHODS: Tuple[str, ...] = ('GET', 'HEAD', 'POST', 'DELETE')
 HTTP_VERSIONS: Tuple[str, ...] = ('HTTP/1.1',)
 STORAGE_DIR = str(Path().parent.absolute()) + '/store/'
+STATS_PATH = '/stats'
+METRICS_PATH = '/metrics'
+META_PATH = '/meta'
+KEEPALIVE_TIMEOUT: float = 5.0
+# Сколько секунд ждать данные запроса от клиента: заголовки первого
+# запроса в соединении и каждую часть тела
+REQUEST_TIMEOUT: float = 30.0
+MAX_KEEPALIVE_REQUESTS: int = 100
+STATS_PROVIDERS: Dict[str, Callable[[], Dict]] = {}
+RESPONSE_REASONS: Dict[int, str] = {
+    200: 'OK',
+    206: 'Partial Content',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    409: 'Conflict',
+    416: 'Range Not Satisfiable',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+    505: 'HTTP Version Not Supported',
+}
 
 
 @logger.catch
 def run_server(hostname_ipv4: str = '0.0.0.0', host_port: int = 9000,
                waiting_clients: int = 5,
-               max_buffer_size: int = 4096) -> socket.socket:
+               max_buffer_size: int = 4096,
+               engine: str = 'threads',
+               workers: int = engines.DEFAULT_WORKERS,
+               queue_size: int = engines.DEFAULT_QUEUE_SIZE,
+               keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+               max_requests: int = MAX_KEEPALIVE_REQUESTS,
+               request_timeout: float = REQUEST_TIMEOUT,
+               hash_algorithm: str = file_hashing.DEFAULT_ALGORITHM,
+               compress: Tuple[str, ...] = (),
+               pack_max_size: int = 0,
+               volume_dirs: Tuple[str, ...] = (),
+               placement: str = DEFAULT_PLACEMENT,
+               access_log_path: str = '',
+               dump_payloads: bool = False,
+               profile_seconds: float = profiling.DEFAULT_PROFILE_SECONDS
+               ) -> socket.socket:
     """
     Функция для запуска сервера, которая возвращает серверный сокет
+
+    engine - способ обработки подключений: 'threads' (пул потоков),
+    'prefork' (процессы с общим сокетом) или 'sync' (по одному клиенту,
+    простаивающее постоянное соединение задерживает остальных клиентов)
+    workers - количество потоков или процессов-обработчиков
+    queue_size - максимальная очередь принятых подключений для пула потоков,
+    для prefork она же становится backlog слушающего сокета (listen)
+    keepalive_timeout - сколько секунд ждать следующий запрос в постоянном
+    соединении (keep-alive)
+    max_requests - максимальное количество запросов в одном соединении
+    request_timeout - сколько секунд ждать заголовки первого запроса в
+    соединении и каждую часть тела запроса, после этого соединение
+    закрывается (простаивающие клиенты не занимают обработчики)
+    hash_algorithm - алгоритм хэширования новых файлов из
+    file_hashing.HASH_ALGORITHMS
+    compress - кодирования из compression.ENCODINGS, в которых новые файлы
+    сжимаются в фоне; пустой кортеж - не сжимать
+    pack_max_size - файлы не больше этого размера складываются в
+    pack-файлы (pack_store), 0 - каждый файл хранится отдельно
+    volume_dirs - каталоги дополнительных томов хранилища (volumes)
+    placement - способ выбора тома для нового файла из volumes.PLACEMENTS
+    access_log_path - файл журнала доступа (access_log), пустая строка -
+    журнал не ведется
+    dump_payloads - выводить заголовки и тело запросов в отладочный журнал
+    profile_seconds - сколько секунд собирать профиль по сигналу
+    profiling.PROFILE_SIGNAL
     """
-    server_socket = get_server_socket(hostname_ipv4, host_port,
-                                      waiting_clients)
-    accept_connections(server_socket, METHODS, HTTP_VERSIONS, max_buffer_size)
+    file_hashing.set_algorithm(hash_algorithm)
+    enable_request_logging(access_log_path, dump_payloads)
+    profiling.enable_profiling(profile_seconds)
+    volumes = enable_volumes(STORAGE_DIR, volume_dirs, placement)
+    # Удаляем временные файлы загрузок, прерванных прошлым запуском
+    for volume_dir in volumes.volumes:
+        post.sweep_staging_files(volume_dir)
+    if compress:
+        compressor = compression.enable_background_compression(
+            STORAGE_DIR, compress, post.create_staging_file)
+        register_stats_provider('compression', compressor.stats)
+    register_stats_provider('packs', enable_packing(STORAGE_DIR,
+                                                    pack_max_size).stats)
+    register_stats_provider('index', file_index.get_index(STORAGE_DIR).stats)
+    register_stats_provider('volumes', volumes.stats)
+    register_stats_provider('stat_cache', get_stat_cache().stats)
+    register_stats_provider('read_cache', get_read_cache().stats)
+    if engine == 'prefork':
+        waiting_clients = queue_size
+    server_socket = open_server_socket(hostname_ipv4, host_port,
+                                       waiting_clients)
+    if engine == 'sync':
+        accept_connections(server_socket, METHODS, HTTP_VERSIONS,
+                           max_buffer_size, keepalive_timeout, max_requests,
+                           request_timeout)
+        return server_socket
+
+    handler = partial(handle_client, methods=METHODS,
+                      http_versions=HTTP_VERSIONS,
+                      buffer_size=max_buffer_size,
+                      keepalive_timeout=keepalive_timeout,
+                      max_requests=max_requests,
+                      request_timeout=request_timeout)
+    server_engine = engines.create_engine(engine, server_socket, handler,
+                                          workers, queue_size)
+    register_stats_provider('engine', server_engine.stats.snapshot)
+    server_engine.serve_forever()
     return server_socket
 
 
@@ -38,7 +157,7 @@ def get_server_socket(host_addr: str = '0.0.0.0', port: int = 9000,
     Создаем объект socket c IPv4 и TCP с указанными в аргументах адресом и
     портом сервера.
     Принимаем указанное в clients_queue_size количество подключений от клиентов
-    Пока что будем их обрабатывать по очереди синхронно - одно за другим
+    Обрабатываются они движком, выбранным в run_server
     Аргументы:
     host_addr - адрес сервера IPv4 в виде строки str
     port - порт, на котором будет осуществляться доступ к серверу, int
@@ -53,158 +172,521 @@ def get_server_socket(host_addr: str = '0.0.0.0', port: int = 9000,
     return server_socket
 
 
+def open_server_socket(host_addr: str = '0.0.0.0', port: int = 9000,
+                       clients_queue_size: int = 5) -> socket.socket:
+    """
+    Слушающий сокет сервера: при перезапуске (graceful) - сокет,
+    переданный предыдущей копией сервера, иначе - новый
+    (get_server_socket)
+    """
+    server_socket = graceful.inherited_socket()
+    if server_socket is None:
+        return get_server_socket(host_addr, port, clients_queue_size)
+    server_socket.listen(clients_queue_size)
+    return server_socket
+
+
 @logger.catch
 def accept_connections(server_socket: socket.socket, methods: Tuple = METHODS,
                        http_versions: Tuple = HTTP_VERSIONS,
-                       buffer_size: int = 4096):
+                       buffer_size: int = 4096,
+                       keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+                       max_requests: int = MAX_KEEPALIVE_REQUESTS,
+                       request_timeout: float = REQUEST_TIMEOUT):
     """
-    Принимаем запросы от клиентов в бесконечном цикле
+    Принимаем запросы от клиентов в бесконечном цикле и обрабатываем их
+    по очереди синхронно - одно за другим (engine='sync').
+    Пока клиент держит постоянное соединение, остальные ждут, поэтому для
+    этого движка стоит уменьшить keepalive_timeout
     """
+    def drain():
+        # Текущее подключение дообрабатывается, но не дольше
+        # graceful.DRAIN_TIMEOUT
+        server_socket.close()
+        graceful.set_deadline()
+
+    graceful.install_handlers(drain, server_socket)
     while True:
         try:
             client_socket, client_addr = server_socket.accept()
+        except OSError as os_error:
+            logger.debug("Server socket was closed: {}", os_error)
+            break
         except KeyboardInterrupt as interruption_error:
             server_socket.close()
             logger.debug("Connection was close by peer: {}",
                          interruption_error)
             break
         else:
-            logger.debug("New connection from: {}", client_addr)
-
-            client_request = client_socket.recv(buffer_size)
-            first_req_line, req_headers_dict, req_body = get_request_elements(
-                client_request)
-
-            logger.debug("<cyan>Request first line:</>{}", first_req_line)
-            logger.debug("<cyan>Request headers:</>\n{}", req_headers_dict)
-            logger.debug("<cyan>Request body:</>\n{}", req_body)
-
-            first_status = check_request_by_first_line(first_req_line,
-                                                       methods,
-                                                       http_versions)
-            if first_status == 200:  # 200 OK
+            handle_client(client_socket, client_addr, methods,
+                          http_versions, buffer_size, keepalive_timeout,
+                          max_requests, request_timeout)
 
-                method = first_req_line[0]
-                url_string = first_req_line[1]
 
-                if method == 'GET':
-                    logger.debug('GET method')
+def set_no_delay(client_socket: socket.socket):
+    """
+    Отключаем алгоритм Нейгла: заголовки и тело ответа отправляются
+    отдельно, и без TCP_NODELAY тело небольшого ответа ждет подтверждения
+    заголовков (delayed ACK клиента, до 40 мс)
+    """
+    try:
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:  # не TCP-сокет
+        pass
 
-                    file_hash, file_abs_path = find_file_hash_in_req(
-                        url_string)
 
-                    if file_hash == '400':
-                        client_socket.send(
-                            "HTTP/1.1 400 Bad Request\n\n".encode())
-                    elif file_hash == '404':
-                        client_socket.send(
-                            "HTTP/1.1 404 Not Found\n\n".encode())
-                    else:
-                        client_socket.send("HTTP/1.1 200 OK\n\n".encode())
+@logger.catch
+def handle_client(client_socket: socket.socket, client_addr: Tuple,
+                  methods: Tuple = METHODS,
+                  http_versions: Tuple = HTTP_VERSIONS,
+                  buffer_size: int = 4096,
+                  keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+                  max_requests: int = MAX_KEEPALIVE_REQUESTS,
+                  request_timeout: float = REQUEST_TIMEOUT):
+    """
+    Обслуживаем одно клиентское подключение и закрываем клиентский сокет.
+    Функция не зависит от способа приема подключений, поэтому вызывается
+    как из синхронного цикла accept_connections, так и из движков
+    модуля engines (пул потоков, prefork-процессы)
+
+    В постоянном соединении (HTTP/1.1 keep-alive) обрабатываем запросы
+    один за другим, пока клиент не попросит закрыть соединение
+    (Connection: close), не пройдет keepalive_timeout секунд без нового
+    запроса или не будет обработано max_requests запросов.
+    Заголовки первого запроса и каждая часть тела ждутся не дольше
+    request_timeout секунд
+    """
+    accepted = time.perf_counter()
+    logger.debug("New connection from: {}", client_addr)
+    set_no_delay(client_socket)
+    connection = ClientConnection(client_socket)
 
-                        is_ok = get.send_file_to_client(client_socket,
-                                                        file_abs_path)
+    try:
+        for request_number in range(1, max_requests + 1):
+            connection.settimeout(request_timeout if request_number == 1
+                                  else keepalive_timeout)
+            try:
+                request = connection.read_request(buffer_size)
+            except socket.timeout:
+                logger.debug("{} timeout for: {}", 'Request' if
+                             request_number == 1 else 'Keep-alive',
+                             client_addr)
+                break
+            except HttpParseError as parse_error:
+                logger.debug('{} Bad Request: {}', parse_error.status,
+                             parse_error)
+                connection.send(make_response(parse_error.status))
+                break
+            # Тело запроса тоже ждем не дольше request_timeout на часть
+            connection.settimeout(request_timeout)
+
+            if request is None:  # клиент закрыл соединение
+                break
+
+            # Первый запрос считаем от приема подключения, следующие - от
+            # получения их заголовков
+            timer = metrics.start_request(
+                accepted if request_number == 1 else
+                connection.head_received)
+            timer.add_stage('header_parse', connection.head_parse_time)
+            try:
+                # Во время остановки (graceful) соединение закрывается
+                # после текущего запроса
+                keep_alive = serve_request(
+                    connection, request, methods, http_versions,
+                    buffer_size, request_number < max_requests and
+                    not graceful.is_draining())
+            finally:
+                finish_request(client_addr, request)
+            if not keep_alive:
+                break
+    finally:
+        connection.close()
+
+
+def serve_request(connection: ClientConnection, request: HttpRequest,
+                  methods: Tuple, http_versions: Tuple, buffer_size: int,
+                  keep_alive_allowed: bool = True) -> bool:
+    """
+    Обрабатываем один запрос из соединения и отправляем ответ.
+    Возвращаем True, если соединение можно использовать для следующего
+    запроса
+    """
+    first_req_line = request.first_line
+    req_headers_dict = request.headers
+    req_body = request.body
+
+    logger.debug("<cyan>Request first line:</>{}", first_req_line)
+    if access_log.dumps_payloads():
+        logger.debug("<cyan>Request headers:</>\n{}", req_headers_dict)
+        logger.debug("<cyan>Request body:</>\n{}", req_body)
+
+    first_status = check_request_by_first_line(first_req_line,
+                                               methods,
+                                               http_versions)
+    if first_status != 200:
+        if first_status == 405:
+            logger.debug('405 Method Not Allowed: {}',
+                         first_req_line[0])
+        elif first_status == 505:
+            logger.debug('505 HTTP Version Not Supported: {}',
+                         first_req_line[2])
+        else:  # resp_status_code == 400
+            logger.debug('400 Bad Request\n{}', first_req_line)
+        # Границы тела такого запроса неизвестны - закрываем соединение
+        connection.send(make_response(first_status))
+        return False
+
+    keep_alive = keep_alive_allowed and is_keep_alive(req_headers_dict)
+    method = request.method
+
+    if method == 'POST' and request.path in batch.BATCH_PATHS:
+        return serve_batch_request(connection, request, buffer_size,
+                                   keep_alive)
+
+    if method == 'POST':
+        declared_hash, status = post.check_declared_hash(req_headers_dict,
+                                                         request.query)
+        if status == 100:
+            connection.send(post.CONTINUE_RESPONSE)
+        elif status != 200:
+            # Тело запроса не прочитано - закрываем соединение
+            connection.send(make_response(status, declared_hash, False,
+                                          hash_headers(declared_hash)))
+            return False
+
+        file_hash, status = post.post_request_handler(
+            connection, buffer_size,
+            req_headers_dict,
+            req_body,
+            declared_hash)
+        metrics.set_key(file_hash)
+        # После 400 и 500 тело запроса могло остаться непрочитанным
+        keep_alive = keep_alive and status in (200, 409)
+        connection.send(make_response(status, file_hash, keep_alive,
+                                      hash_headers(file_hash)))
+        return keep_alive
+
+    # У GET, HEAD и DELETE тела нет, остаток данных - следующий запрос
+    connection.unread(req_body)
+
+    if method == 'GET' and request.path == STATS_PATH:
+        stats_body = json.dumps(collect_stats())
+        connection.send(make_response(200, stats_body, keep_alive))
+
+    elif method == 'GET' and request.path == METRICS_PATH:
+        connection.send(make_metrics_response(keep_alive))
+
+    elif method == 'GET' and request.path == META_PATH:
+        connection.send(make_meta_response(request.query, keep_alive))
+
+    elif method == 'HEAD':
+        connection.send(make_head_response(req_headers_dict, request.query,
+                                           keep_alive))
+
+    elif method == 'GET':
+        logger.debug('GET method')
+
+        file_hash, file_abs_path = find_file_hash_in_req(request.query)
+
+        if file_hash in ('400', '404'):
+            connection.send(make_response(int(file_hash), '', keep_alive))
+        else:
+            index_entry = file_index.get_index().lookup(file_hash)
+            if index_entry is None:  # файл удалили параллельным запросом
+                connection.send(make_response(404, '', keep_alive))
+                return keep_alive
+            file_size = index_entry.size
+
+            plan = get.plan_download(req_headers_dict, file_hash, file_size,
+                                     file_variants(req_headers_dict,
+                                                   file_hash))
+            connection.send(make_response_head(
+                plan.status, plan.content_length, keep_alive, plan.headers))
+
+            file_abs_path, offset = file_source(file_hash, file_abs_path)
+            started = time.perf_counter()
+            is_ok = get.send_planned_to_client(connection, file_abs_path,
+                                               plan, file_size, file_hash,
+                                               offset)
+            metrics.add_stage('send', time.perf_counter() - started)
+            # Заголовки уже отправлены, поэтому при ошибке остается
+            # только закрыть соединение
+            keep_alive = keep_alive and is_ok
+
+    else:  # method == DELETE
+        logger.debug('DELETE method')
+
+        file_hash, abs_path = find_file_hash_in_req(request.query)
+
+        if file_hash in ('400', '404'):
+            connection.send(make_response(int(file_hash), '', keep_alive))
+        elif delete_handler.delete_file(file_hash, abs_path):
+            connection.send(make_response(200, ' DELETE method', keep_alive))
+        else:
+            connection.send(make_response(500, '', keep_alive))
 
-                        if not is_ok:
-                            client_socket.send("HTTP/1.1 500 \
-Internal Server Error\n\n".encode())
+    return keep_alive
 
-                elif method == 'POST':
-                    file_hash, status = post.post_request_handler(
-                        client_socket, buffer_size,
-                        req_headers_dict,
-                        req_body)
 
-                    if status == 200:
-                        client_socket.send(
-                            "HTTP/1.1 200 OK\n\n{}".format(file_hash).encode())
+def serve_batch_request(connection: ClientConnection, request: HttpRequest,
+                        buffer_size: int, keep_alive: bool) -> bool:
+    """
+    Обрабатываем пакетный POST-запрос (batch_handler.BATCH_PATHS): ответ -
+    JSON-массив с результатом для каждого объекта, который отправляется
+    частями по мере обработки объектов.
+    Возвращаем True, если соединение можно использовать для следующего
+    запроса
+    """
+    req_headers_dict = request.headers
+    if request.path == batch.BATCH_UPLOAD_PATH:
+        status = 200 if post.check_post_request(req_headers_dict,
+                                                request.body) else 400
+    else:
+        status = batch.check_batch_request(req_headers_dict)
+    if status != 200:
+        # Тело запроса не прочитано - закрываем соединение
+        connection.send(make_response(status))
+        return False
+    if post.expects_continue(req_headers_dict):
+        connection.send(post.CONTINUE_RESPONSE)
+
+    receiver = None
+    if request.path == batch.BATCH_UPLOAD_PATH:
+        receiver, status = post.receive_upload(
+            connection, buffer_size, req_headers_dict, request.body,
+            STORAGE_DIR)
+        results = batch.upload_objects(receiver, STORAGE_DIR) \
+            if receiver else None
+    else:
+        keys, status = batch.receive_key_list(
+            connection, buffer_size, req_headers_dict, request.body)
+        if keys is None:
+            results = None
+        elif request.path == batch.BATCH_STAT_PATH:
+            results = batch.stat_objects(keys, find_file_hash_in_req)
+        else:
+            results = batch.delete_objects(keys, find_file_hash_in_req)
+    if results is None:
+        # Тело запроса могло остаться непрочитанным
+        connection.send(make_response(status))
+        return False
 
-                    elif status == 409:
-                        client_socket.send(
-                            "HTTP/1.1 409 Conflict\n\n{}".format(
-                                file_hash).encode())
+    try:
+        connection.send(make_chunked_response_head(
+            200, keep_alive, {'Content-Type': batch.JSON_CONTENT_TYPE}))
+        for chunk in batch.iter_json_chunks(results):
+            connection.send(chunk)
+    finally:
+        # Если ответ прерван (клиент отключился), файлы, которые не успели
+        # перенести в хранилище, не должны остаться во временном каталоге
+        if receiver is not None:
+            receiver.discard()
+    return keep_alive
+
+
+def make_head_response(req_headers: Dict, params: Dict[str, str],
+                       keep_alive: bool) -> bytes:
+    """
+    Ответ на HEAD-запрос: те же статус и заголовки, что и у GET, но без
+    тела. Запись о файле берется из кэша (stat_cache), файл не
+    открывается
+    """
+    file_hash, index_entry = find_file_entry(params)
+    if index_entry is None:
+        return make_response(int(file_hash), '', keep_alive)
+    plan = get.plan_download(req_headers, file_hash, index_entry.size,
+                             file_variants(req_headers, file_hash))
+    return make_response_head(plan.status, plan.content_length, keep_alive,
+                              plan.headers)
 
-                    elif status == 400:
-                        client_socket.send(
-                            "HTTP/1.1 400 Bad Request\n\n".encode())
 
-                    else:
-                        client_socket.send(
-                            "HTTP/1.1 500 Internal Server Error\n\n".encode())
+def file_source(file_hash: str, file_abs_path: str) -> Tuple[str, int]:
+    """
+    Откуда отдавать файл: небольшой файл может лежать в pack-файле
 
-                else:  # method == DELETE
-                    logger.debug('DELETE method')
+    :return: кортеж из пути к файлу (или pack-файлу) и смещения данных
+    """
+    location = get_pack_store().locate(file_hash)
+    if location is None:
+        return file_abs_path, 0
+    return location.path, location.offset
 
-                    file_hash, abs_path = find_file_hash_in_req(
-                        url_string)
 
-                    if file_hash == '400':
-                        client_socket.send(
-                            "HTTP/1.1 400 Bad Request\n\n".encode())
-                    elif file_hash == '404':
-                        client_socket.send(
-                            "HTTP/1.1 404 Not Found\n\n".encode())
-                    else:
-                        is_ok = delete_handler.delete_file(file_hash, abs_path)
+def file_variants(req_headers: Dict,
+                  file_hash: str) -> Optional[Dict[str, int]]:
+    """
+    Сжатые копии файла из индекса, если клиент принимает сжатые ответы
+    (Accept-Encoding)
+    """
+    if 'Accept-Encoding' not in req_headers:
+        return None
+    return file_index.get_index().variants(file_hash)
 
-                        if is_ok:
-                            client_socket.send(
-                                "HTTP/1.1 200 OK\n\n DELETE method".encode())
-                        else:
-                            client_socket.send("HTTP/1.1 500 Internal Server \
-Error\n\n".encode())
 
-            else:
-                if first_status == 405:
-                    logger.debug('405 Method Not Allowed: {}',
-                                 first_req_line[0])
-                    client_socket.send(
-                        "HTTP/1.1 405 Method Not Allowed\n\n".encode())
+def make_meta_response(params: Dict[str, str], keep_alive: bool) -> bytes:
+    """
+    Ответ на GET /meta?file_hash=<ключ>: метаданные файла в JSON
+    (get_handler.file_metadata)
+    """
+    file_hash, index_entry = find_file_entry(params)
+    if index_entry is None:
+        return make_response(int(file_hash), '', keep_alive)
+    return make_response(200, json.dumps(get.file_metadata(
+        file_hash, index_entry)), keep_alive,
+        {'Content-Type': 'application/json'})
 
-                elif first_status == 505:
-                    logger.debug('505 HTTP Version Not Supported: {}',
-                                 first_req_line[2])
-                    client_socket.send(
-                        "HTTP/1.1 505 HTTP Version Not Supported\n\n".encode())
 
-                else:  # resp_status_code == 400
-                    logger.debug('400 Bad Request\n{}', client_request)
-                    client_socket.send("HTTP/1.1 400 Bad Request\n\n".encode())
-
-            client_socket.close()
+def hash_headers(file_hash: str) -> Dict[str, str]:
+    """
+    Заголовок с алгоритмом, которым получен ключ файла
+    """
+    hash_key = split_hash_key(file_hash) if file_hash else None
+    if not hash_key:
+        return {}
+    return {'X-Hash-Algorithm': hash_key[0]}
 
 
-def find_file_hash_in_req(uri: str) -> Tuple[str, str]:
-    """
-
-    :param uri:
-    :return:
+def is_keep_alive(req_headers: Dict) -> bool:
     """
-    try:
-        params = {}
-        for param in uri.split('?')[1].split('&'):
-            param_key, param_value = param.split('=')
-            params[param_key] = param_value
-        print("All parameters in request", params)
+    В HTTP/1.1 соединение постоянное, если клиент не передал
+    заголовок Connection: close
+    """
+    return req_headers.get('Connection', '').lower() != 'close'
 
-        file_hash = params['file_hash']
 
-        if file_hash:
-            file_store_dir = file_hash[:2]
-            file_abs_path = STORAGE_DIR + file_store_dir + "/" + file_hash
+def make_response_head(status: int, content_length: Optional[int] = 0,
+                       keep_alive: bool = False,
+                       headers: Dict[str, str] = None) -> bytes:
+    """
+    Формируем строку статуса и заголовки ответа, включая Content-Length и
+    Connection, после которых можно отправлять тело ответа.
+    content_length=None - ответ без тела (304 Not Modified) или с телом
+    chunked (make_chunked_response_head)
+    """
+    head = "HTTP/1.1 {} {}\r\n".format(status, RESPONSE_REASONS[status])
+    if content_length is not None:
+        head += "Content-Length: {}\r\n".format(content_length)
+    head += "Connection: {}\r\n".format('keep-alive' if keep_alive else
+                                        'close')
+    for header_name, header_value in (headers or {}).items():
+        head += "{}: {}\r\n".format(header_name, header_value)
+    return (head + "\r\n").encode()
+
+
+def make_chunked_response_head(status: int, keep_alive: bool = False,
+                               headers: Dict[str, str] = None) -> bytes:
+    """
+    Заголовки ответа, длина которого заранее неизвестна: тело ответа
+    отправляется частями http_parser.encode_chunk и завершается
+    http_parser.LAST_CHUNK
+    """
+    return make_response_head(status, None, keep_alive, dict(
+        headers or {}, **{'Transfer-Encoding': 'chunked'}))
 
-            if os.path.exists(file_abs_path):
-                return file_hash, file_abs_path
 
-            return '404', ''  # File Not Found
+def make_response(status: int, body: Union[str, bytes] = '',
+                  keep_alive: bool = False,
+                  headers: Dict[str, str] = None) -> bytes:
+    """
+    Формируем ответ сервера со статус кодом status и телом body
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    return make_response_head(status, len(body), keep_alive, headers) + body
 
-        return '400', ''  # Bad Request
 
-    except IndexError:
-        return '400', ''  # Bad Request
-    except KeyError:
+def enable_request_logging(access_log_path: str, dump_payloads: bool):
+    """
+    Включаем журнал доступа и, если нужно, вывод содержимого запросов
+    """
+    request_log = access_log.enable_access_log(access_log_path,
+                                               dump_payloads)
+    if request_log is not None:
+        register_stats_provider('access_log', request_log.stats)
+
+
+def finish_request(client_addr, request: HttpRequest):
+    """
+    Записываем метрики обработанного запроса и строку журнала доступа
+    """
+    timer = metrics.finish_request(request.method)
+    if timer is None:
+        return
+    access_log.log_request(
+        client_addr[0] if client_addr else '', request.method, request.path,
+        timer.key.replace('\n', ',') or request.query.get('file_hash', ''),
+        timer.status, timer.sent, timer.duration)
+
+
+def make_metrics_response(keep_alive: bool) -> bytes:
+    """
+    Ответ на GET /metrics: метрики процесса в формате Prometheus
+    """
+    return make_response(200, metrics.render_metrics(collect_stats),
+                         keep_alive,
+                         {'Content-Type': metrics.METRICS_CONTENT_TYPE})
+
+
+def register_stats_provider(name: str, provider: Callable[[], Dict]):
+    """
+    Регистрируем функцию, которая возвращает словарь со счетчиками
+    (например, статистику движка подключений). Все зарегистрированные
+    счетчики отдаются по запросу GET /stats
+    """
+    STATS_PROVIDERS[name] = provider
+
+
+def collect_stats() -> Dict:
+    """
+    Собираем счетчики всех зарегистрированных источников в один словарь
+    """
+    return {name: provider() for name, provider in STATS_PROVIDERS.items()}
+
+
+def find_file_hash_in_req(params: Dict[str, str]) -> Tuple[str, str]:
+    """
+    Ищем в индексе хранилища файл, ключ которого передан в параметре
+    file_hash
+
+    :param params: параметры запроса (HttpRequest.query)
+    :return: кортеж из ключа файла и полного пути к нему; если файл не
+    найден - ('404', ''), если параметр отсутствует или некорректен -
+    ('400', '')
+    """
+    # Ключ проверяется по формату, поэтому в путь не попадут "../" и т.п.
+    hash_key = split_hash_key(params.get('file_hash', ''))
+    if not hash_key:
         return '400', ''  # Bad Request
 
+    file_hash = make_hash_key(*hash_key)
+    if file_index.get_index().lookup(file_hash) is not None:
+        return file_hash, get_volumes(STORAGE_DIR).resolve(file_hash)
+
+    return '404', ''  # File Not Found
+
+
+def find_file_entry(params: Dict[str, str]
+                    ) -> Tuple[str, Optional[IndexEntry]]:
+    """
+    Ищем запись о файле, ключ которого передан в параметре file_hash, в
+    кэше записей индекса (stat_cache)
+
+    :param params: параметры запроса (HttpRequest.query)
+    :return: кортеж из ключа файла и записи индекса; если файл не
+    найден - ('404', None), если параметр отсутствует или некорректен -
+    ('400', None)
+    """
+    hash_key = split_hash_key(params.get('file_hash', ''))
+    if not hash_key:
+        return '400', None  # Bad Request
+
+    file_hash = make_hash_key(*hash_key)
+    index_entry = get_stat_cache().lookup(file_hash)
+    if index_entry is None:
+        return '404', None  # File Not Found
+    return file_hash, index_entry
+
 
 @logger.catch
 def check_request_by_first_line(request_first_line: List, methods: Tuple,
@@ -242,24 +724,17 @@ def get_request_elements(request: bytes) -> Union[Tuple[List, Dict, bytes]]:
     Функция позволяет распарсить запрос клиента (аргумент request) и получить:
     req_start_line_list - основную строку запроса в виде кортежа из метода, URI
     и версии HTTP;
-    req_headers_dict - словарь с заголовками запроса;
+    req_headers_dict - словарь с заголовками запроса (http_parser.Headers,
+    поиск без учета регистра);
     req_body_part - тело запроса в виде байтовой строки.
-    """
-
-    headers_end = request.find(b'\r\n\r\n')
-    headers = request[:headers_end].decode().split('\r\n')
-    req_start_line_list: List[str, ...] = headers[0].split(' ')
-    del headers[0]
 
-    req_headers_dict: Dict = {}
-    for i in headers:
-        key = i.split(': ')[0]
-        val = i.split(': ')[1]
-        req_headers_dict[key] = val
+    Запрос должен быть получен вместе с пустой строкой после заголовков;
+    запросы, которые приходят по частям, разбирает http_parser.RequestParser
 
-    req_body_part: bytes = request[headers_end + len('\r\n\r\n'):]
-
-    return req_start_line_list, req_headers_dict, req_body_part
+    :raise HttpParseError: если запрос некорректен
+    """
+    parsed = parse_request(request)
+    return parsed.first_line, parsed.headers, parsed.body
 
 
 if __name__ == '__main__':
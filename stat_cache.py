@@ -0,0 +1,100 @@
+"""
+LRU-кэш записей индекса хранилища для HEAD и GET /meta
+
+Запросы метаданных приходят часто, а содержимое файлов по ключу не
+меняется, поэтому запись индекса (размер, время добавления, количество
+ссылок) хранится в памяти процесса. Кэшируется и отсутствие файла.
+Загрузка (POST) и удаление (DELETE) сбрасывают запись своего ключа.
+Другие процессы prefork об этом не знают, поэтому запись живет не
+дольше ttl секунд
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from file_index import IndexEntry, get_index
+
+# Максимальное количество записей в кэше
+STAT_CACHE_SIZE: int = 4096
+# Сколько секунд запись считается актуальной
+STAT_CACHE_TTL: float = 2.0
+
+
+class StatCache:
+    """
+    Кэш записей индекса с вытеснением давно не использованных (LRU)
+
+    loader - функция, которая ищет запись в индексе, если ее нет в кэше
+    """
+
+    def __init__(self, loader: Callable[[str], Optional[IndexEntry]],
+                 max_entries: int = STAT_CACHE_SIZE,
+                 ttl: float = STAT_CACHE_TTL):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # ключ -> (запись индекса или None, время загрузки)
+        self._entries: OrderedDict = OrderedDict()
+        # Счетчик сбросов: запись, загруженная до сброса, в кэш не попадает
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, key: str) -> Optional[IndexEntry]:
+        """
+        Запись индекса для ключа файла, None - такого файла нет
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and now - cached[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+            generation = self._generation
+
+        entry = self.loader(key)
+        with self._lock:
+            if generation != self._generation:
+                return entry
+            self._entries[key] = (entry, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, key: str):
+        """
+        Сбрасываем запись ключа, когда файл добавлен или удален
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        """
+        Сбрасываем все записи кэша
+        """
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики кэша для GET /stats
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses}
+
+
+_cache = StatCache(lambda key: get_index().lookup(key))
+
+
+def get_stat_cache() -> StatCache:
+    """
+    Кэш записей индекса текущего хранилища (file_index.get_index)
+    """
+    return _cache
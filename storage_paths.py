@@ -0,0 +1,263 @@
+"""
+Расположение файлов в каталогах хранилища (шардирование)
+
+Файл с ключом <ключ> лежит в store/<шард>/<ключ>, где шард - несколько
+уровней каталогов из первых символов хэша: при глубине 2 и ширине 2
+файл abcdef... лежит в store/ab/cd/abcdef.... Исходная схема хранилища -
+один уровень из двух символов (1x2), она используется, пока схему не
+изменит команда reshard.
+
+Схема записана в индексе хранилища, поэтому ее видят все процессы
+сервера. Перешардирование выполняется без остановки сервера: сначала в
+индекс записывается новая схема, а старая остается предыдущей - новые
+файлы сохраняются по новой схеме, а файл, который еще не перенесен,
+ищется и по предыдущей. Затем файлы переносятся (rename в пределах той же
+файловой системы), пустые каталоги удаляются, и предыдущая схема
+забывается
+"""
+import os
+import time
+import threading
+from typing import Iterable, NamedTuple, Optional, Tuple
+from loguru import logger
+from file_hashing import split_hash_key
+from file_index import DEFAULT_STORAGE_DIR, FileIndex, get_index, \
+    is_shard_dir, iter_stored_files
+
+LAYOUT_META = 'shard_layout'
+PREVIOUS_LAYOUT_META = 'previous_shard_layout'
+# Сколько символов хэша можно разложить по каталогам
+MAX_SHARD_CHARS: int = 8
+# Как часто процессы сервера перечитывают схему из индекса (секунды)
+LAYOUT_TTL: float = 2.0
+
+
+class ShardLayout(NamedTuple):
+    """
+    Схема шардирования: количество уровней каталогов и количество
+    символов хэша в названии каталога каждого уровня
+    """
+    depth: int
+    width: int
+
+    def shard_dir(self, file_hash: str) -> str:
+        """
+        Каталог файла относительно хранилища, например 'ab/cd/'
+        """
+        hexdigest = split_hash_key(file_hash)[1]
+        return ''.join(hexdigest[level * self.width:
+                                 (level + 1) * self.width] + '/'
+                       for level in range(self.depth))
+
+    def __str__(self) -> str:
+        return '{}x{}'.format(self.depth, self.width)
+
+
+DEFAULT_LAYOUT = ShardLayout(1, 2)
+
+
+def make_layout(depth: int, width: int) -> ShardLayout:
+    """
+    Проверенная схема шардирования
+
+    :raise ValueError: если глубина или ширина некорректны
+    """
+    if depth < 1 or width < 1 or depth * width > MAX_SHARD_CHARS:
+        raise ValueError("Shard depth and width must be positive, with at "
+                         "most {} hash chars in total".format(
+                             MAX_SHARD_CHARS))
+    return ShardLayout(depth, width)
+
+
+def parse_layout(value: Optional[str]) -> Optional[ShardLayout]:
+    """
+    Схема из строки вида '2x2', None - строка пустая или некорректна
+    """
+    depth, _, width = (value or '').partition('x')
+    if not (depth.isdigit() and width.isdigit()):
+        return None
+    try:
+        return make_layout(int(depth), int(width))
+    except ValueError:
+        return None
+
+
+def move_to_layout(storage_dir: str, layout: ShardLayout) -> int:
+    """
+    Переносим файлы каталога хранилища (или тома) в каталоги схемы layout
+    и удаляем опустевшие каталоги
+
+    :return: количество перенесенных файлов
+    """
+    moved = 0
+    for file_name, rel_dir in list(iter_stored_files(storage_dir)):
+        # Сжатые копии <ключ>.<кодирование> переносятся вместе с файлом
+        file_hash = file_name.partition('.')[0]
+        if not is_shard_dir(file_hash, rel_dir):
+            continue
+        target_dir = layout.shard_dir(file_hash)
+        if rel_dir == target_dir:
+            continue
+        os.makedirs(storage_dir + target_dir, exist_ok=True)
+        try:
+            os.replace(storage_dir + rel_dir + file_name,
+                       storage_dir + target_dir + file_name)
+        except FileNotFoundError:  # файл удалили во время переноса
+            continue
+        moved += 1
+
+    # Удаляем опустевшие каталоги, вложенные - раньше родительских
+    shard_dirs = []
+    for dir_path, dir_names, _ in os.walk(storage_dir):
+        dir_names[:] = [name for name in dir_names
+                        if not name.startswith('.')]
+        shard_dirs.append(dir_path)
+    for dir_path in reversed(shard_dirs[1:]):
+        try:
+            os.rmdir(dir_path)
+        except OSError:  # в каталоге есть файлы
+            pass
+    return moved
+
+
+class StoragePaths:
+    """
+    Пути к файлам одного хранилища
+
+    index - индекс хранилища, в котором записана схема, по умолчанию
+    file_index.get_index
+    """
+
+    def __init__(self, storage_dir: str, index: Optional[FileIndex] = None):
+        self.storage_dir = storage_dir
+        self._index = index
+        self._layouts: Tuple[ShardLayout, Optional[ShardLayout]] = \
+            (DEFAULT_LAYOUT, None)
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> FileIndex:
+        return self._index or get_index(self.storage_dir)
+
+    def layouts(self) -> Tuple[ShardLayout, Optional[ShardLayout]]:
+        """
+        Текущая схема и предыдущая (None, если перешардирование не идет);
+        перечитываются из индекса не чаще раза в LAYOUT_TTL секунд
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded and now - self._loaded < LAYOUT_TTL:
+                return self._layouts
+        index = self.index
+        layouts = (parse_layout(index.get_meta(LAYOUT_META)) or
+                   DEFAULT_LAYOUT,
+                   parse_layout(index.get_meta(PREVIOUS_LAYOUT_META)))
+        with self._lock:
+            self._layouts = layouts
+            self._loaded = now
+        return layouts
+
+    def file_path(self, file_hash: str) -> str:
+        """
+        Путь для нового файла - по текущей схеме
+        """
+        return self.storage_dir + self.layouts()[0].shard_dir(file_hash) + \
+            file_hash
+
+    def resolve(self, file_hash: str) -> str:
+        """
+        Путь к файлу из хранилища: во время перешардирования файл может
+        еще лежать по предыдущей схеме
+        """
+        layout, previous = self.layouts()
+        file_abs_path = self.storage_dir + layout.shard_dir(file_hash) + \
+            file_hash
+        if previous is None or os.path.exists(file_abs_path):
+            return file_abs_path
+        previous_path = self.storage_dir + previous.shard_dir(file_hash) + \
+            file_hash
+        return previous_path if os.path.exists(previous_path) else \
+            file_abs_path
+
+    def remove_empty_dirs(self, file_abs_path: str):
+        """
+        Удаляем каталоги удаленного файла, в которых не осталось файлов
+        """
+        dir_path = os.path.dirname(file_abs_path)
+        root = self.storage_dir.rstrip('/')
+        while dir_path.startswith(self.storage_dir) and dir_path != root:
+            try:
+                os.rmdir(dir_path)
+            except OSError:  # в каталоге есть другие файлы
+                return
+            dir_path = os.path.dirname(dir_path)
+
+    def reshard(self, layout: ShardLayout, wait: float = 2 * LAYOUT_TTL,
+                volume_dirs: Iterable[str] = ()) -> int:
+        """
+        Переносим файлы хранилища в каталоги по новой схеме, не
+        останавливая сервер. Прерванное перешардирование продолжается
+        повторным вызовом с той же схемой
+
+        :param wait: сколько секунд ждать, пока все процессы сервера
+        перечитают схему и начнут сохранять файлы по новой
+        :param volume_dirs: каталоги дополнительных томов хранилища
+        (volumes), файлы на них переносятся так же; тома, записанные в
+        индексе, переносятся, даже если их здесь нет
+        :return: количество перенесенных файлов (вместе со сжатыми копиями)
+        :raise ValueError: если не закончено перешардирование в другую схему
+        или какой-то из томов недоступен - тогда предыдущая схема остается,
+        и перешардирование продолжается повторным вызовом
+        """
+        index = self.index
+        current = parse_layout(index.get_meta(LAYOUT_META)) or DEFAULT_LAYOUT
+        previous = parse_layout(index.get_meta(PREVIOUS_LAYOUT_META))
+        if previous is not None and layout != current:
+            raise ValueError("Resharding to {} is not finished".format(
+                current))
+        if layout != current:
+            index.set_meta(PREVIOUS_LAYOUT_META, str(current))
+            index.set_meta(LAYOUT_META, str(layout))
+            logger.info("Store layout is changed: {} -> {}", current, layout)
+            time.sleep(wait)
+
+        # Файлы томов, которые не передали, иначе остались бы в каталогах
+        # забытой предыдущей схемы
+        storage_dirs = list(dict.fromkeys(
+            [self.storage_dir, *volume_dirs, *sorted(index.volume_counts())]))
+        missing = [storage_dir for storage_dir in storage_dirs
+                   if not os.path.isdir(storage_dir)]
+        moved = sum(move_to_layout(storage_dir, layout)
+                    for storage_dir in storage_dirs
+                    if storage_dir not in missing)
+        if missing:
+            raise ValueError("Resharding to {} is not finished, volumes are "
+                             "not available: {}".format(layout,
+                                                        ', '.join(missing)))
+
+        index.set_meta(PREVIOUS_LAYOUT_META, None)
+        with self._lock:
+            self._loaded = 0.0
+        logger.info("Store was resharded to {}: {} files moved", layout,
+                    moved)
+        return moved
+
+
+_paths: Optional[StoragePaths] = None
+_paths_lock = threading.Lock()
+
+
+def get_storage_paths(storage_dir: Optional[str] = None) -> StoragePaths:
+    """
+    Пути к файлам хранилища storage_dir (по умолчанию - открытого
+    последним или DEFAULT_STORAGE_DIR)
+    """
+    global _paths  # pylint: disable=global-statement
+    with _paths_lock:
+        if storage_dir is None:
+            storage_dir = _paths.storage_dir if _paths else \
+                DEFAULT_STORAGE_DIR
+        if _paths is None or _paths.storage_dir != storage_dir:
+            _paths = StoragePaths(storage_dir)
+        return _paths
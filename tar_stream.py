@@ -0,0 +1,173 @@
+"""
+Потоковый разбор архива tar из тела запроса
+
+TarParser, как и multipart.MultipartParser, получает тело запроса
+частями и возвращает события PART_BEGIN (значение - имя файла),
+PART_DATA и PART_END, но только для обычных файлов архива: каталоги,
+ссылки и служебные записи пропускаются. Поддерживаются форматы ustar,
+pax (длинные имена в заголовке x) и GNU (длинные имена в записи L и
+размеры в base-256)
+"""
+from typing import List, Optional, Tuple
+from multipart import PART_BEGIN, PART_DATA, PART_END
+
+TAR_CONTENT_TYPES = ('application/x-tar', 'application/tar')
+BLOCK_SIZE: int = 512
+# Максимальный размер служебной записи с длинным именем файла
+MAX_META_SIZE: int = 65536
+
+REGULAR_TYPES = (b'0', b'\0', b'7')
+PAX_HEADER = b'x'
+GNU_LONG_NAME = b'L'
+
+_HEADER, _DATA, _PADDING = range(3)
+
+
+class TarError(ValueError):
+    """
+    Тело запроса не является корректным архивом tar
+    """
+
+
+def parse_number(field: bytes) -> int:
+    """
+    Числовое поле заголовка: восьмеричное число или base-256 (GNU)
+    """
+    if field[:1] and field[0] & 0x80:
+        return int.from_bytes(field[1:], 'big')
+    try:
+        return int(field.strip(b' \0') or b'0', 8)
+    except ValueError:
+        raise TarError("Invalid number in tar header") from None
+
+
+def parse_pax_path(records: bytes) -> Optional[str]:
+    """
+    Имя файла (path) из записей pax вида "<длина> <ключ>=<значение>\\n"
+    """
+    path = None
+    position = 0
+    while position < len(records):
+        space = records.find(b' ', position)
+        if space < 0:
+            break
+        try:
+            length = int(records[position:space])
+        except ValueError:
+            raise TarError("Invalid pax header") from None
+        if length <= 0:
+            raise TarError("Invalid pax header")
+        key, _, value = records[space + 1:position + length - 1] \
+            .partition(b'=')
+        if key == b'path':
+            path = value.decode('utf-8', 'replace')
+        position += length
+    return path
+
+
+class TarParser:
+    """
+    Инкрементальный парсер архива tar. Признак done становится True на
+    первом пустом блоке (конец архива), все данные после него
+    игнорируются
+    """
+
+    def __init__(self):
+        self.done = False
+        self._state = _HEADER
+        self._block = b''
+        self._remaining = 0
+        self._padding = 0
+        # Что делать с данными записи: file - файл, meta - длинное имя,
+        # None - пропустить
+        self._entry: Optional[str] = None
+        self._meta = b''
+        self._meta_type = b''
+        self._next_name: Optional[str] = None
+
+    def feed(self, data: bytes) -> List[Tuple[str, object]]:
+        """
+        Разбираем очередную часть архива
+
+        :raise TarError: если архив некорректен
+        """
+        events: List[Tuple[str, object]] = []
+        position = 0
+        while position < len(data) and not self.done:
+            if self._state == _HEADER:
+                size = min(BLOCK_SIZE - len(self._block),
+                           len(data) - position)
+                self._block += data[position:position + size]
+                position += size
+                if len(self._block) == BLOCK_SIZE:
+                    self._begin_entry(self._block, events)
+                    self._block = b''
+
+            elif self._state == _DATA:
+                size = min(self._remaining, len(data) - position)
+                piece = data[position:position + size]
+                position += size
+                self._remaining -= size
+                if self._entry == 'file':
+                    events.append((PART_DATA, piece))
+                elif self._entry == 'meta':
+                    self._meta += piece
+                if not self._remaining:
+                    self._end_entry(events)
+
+            else:  # self._state == _PADDING
+                size = min(self._padding, len(data) - position)
+                position += size
+                self._padding -= size
+                if not self._padding:
+                    self._state = _HEADER
+        return events
+
+    def _begin_entry(self, block: bytes, events: List):
+        if not block.strip(b'\0'):
+            self.done = True
+            return
+
+        checksum = parse_number(block[148:156])
+        if checksum != sum(block[:148]) + 8 * ord(' ') + sum(block[156:]):
+            raise TarError("Invalid tar header checksum")
+
+        size = parse_number(block[124:136])
+        type_flag = block[156:157]
+        name = self._next_name
+        self._next_name = None
+        if name is None:
+            name = block[:100].split(b'\0', 1)[0].decode('utf-8', 'replace')
+            prefix = block[345:500].split(b'\0', 1)[0]
+            if block[257:262] == b'ustar' and prefix:
+                name = prefix.decode('utf-8', 'replace') + '/' + name
+
+        if type_flag in REGULAR_TYPES:
+            self._entry = 'file'
+            events.append((PART_BEGIN, name))
+        elif type_flag in (PAX_HEADER, GNU_LONG_NAME):
+            if size > MAX_META_SIZE:
+                raise TarError("Tar meta entry is too large")
+            self._entry = 'meta'
+            self._meta_type = type_flag
+        else:
+            self._entry = None
+
+        self._remaining = size
+        self._padding = -size % BLOCK_SIZE
+        self._state = _DATA
+        if not size:
+            self._end_entry(events)
+
+    def _end_entry(self, events: List):
+        if self._entry == 'file':
+            events.append((PART_END, None))
+        elif self._entry == 'meta':
+            if self._meta_type == PAX_HEADER:
+                self._next_name = parse_pax_path(self._meta)
+            else:
+                self._next_name = self._meta.rstrip(b'\0').decode(
+                    'utf-8', 'replace')
+            self._meta = b''
+        self._entry = None
+        self._state = _PADDING if self._padding else _HEADER
@@ -0,0 +1,33 @@
+"""
+Unit tests for access_log module [pytest]
+"""
+from access_log import AccessLog, format_record
+
+
+def test_record_format():
+    """
+    One line per request, empty fields are '-', spaces are escaped
+    """
+    line = format_record((0.5, '127.0.0.1', 'GET', '/a b', '', 404, 120,
+                          0.0015))
+    assert line.split(' ')[1:] == ['127.0.0.1', 'GET', '/a%20b', '-', '404',
+                                   '120', '1.500\n']
+
+
+def test_lines_are_written_in_background(tmp_path):
+    """
+    Submitted lines reach the file after flush, a full queue drops lines
+    instead of blocking
+    """
+    log_path = str(tmp_path / 'access.log')
+    access_log = AccessLog(log_path, max_queue=2, flush_interval=0.01)
+    for number in range(3):
+        access_log.submit((0.0, '', 'GET', '/', str(number), 200, 0, 0.0))
+    access_log.flush(timeout=5)
+
+    with open(log_path) as log_file:
+        keys = [line.split(' ')[4] for line in log_file]
+    stats = access_log.stats()
+    assert stats['written'] + stats['dropped'] == 3
+    assert keys[:stats['written']] == [str(number) for number in
+                                       range(stats['written'])]
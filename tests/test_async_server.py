@@ -0,0 +1,112 @@
+"""
+Unit tests for async_server module [pytest]
+
+asyncio engine must serve upload, download and delete and must not be
+blocked by idle connections.
+"""
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+import requests
+import pytest
+from async_server import run_async_server
+from client import send_post_request
+
+SERVER_ADDR: str = 'localhost'
+SERVER_PORT: int = 9002
+SERVER_URL = 'http://' + SERVER_ADDR + ':' + str(SERVER_PORT)
+
+BASE_DIR = str(Path().parent.absolute())
+FILE_SAMPLE = BASE_DIR + '/tests/assets/sample_file.txt'
+FILE_HASH = 'f3d73e8b9006f3bf6c541786c1c96fc3'
+
+
+@pytest.fixture(scope='module', autouse=True)
+def start_async_server():
+    thread = threading.Thread(target=run_async_server,
+                              args=(SERVER_ADDR, SERVER_PORT, 12, 4096))
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+    yield
+
+
+def test_idle_connections_do_not_block_requests():
+    """
+    Idle clients are kept open while another client is served
+    """
+    idle_socks = []
+    for _ in range(20):
+        idle_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        idle_sock.connect((SERVER_ADDR, SERVER_PORT))
+        idle_socks.append(idle_sock)
+
+    response = requests.get(SERVER_URL, timeout=2)
+
+    for idle_sock in idle_socks:
+        idle_sock.close()
+
+    assert response.status_code == 400
+
+
+def test_upload_download_and_delete():
+    """
+    Full file cycle through asyncio engine
+    """
+    resp, file_hash = send_post_request(SERVER_URL, FILE_SAMPLE)
+    assert resp.status_code == 200
+    assert file_hash == FILE_HASH
+
+    response = requests.get(SERVER_URL, params={'file_hash': FILE_HASH})
+    assert response.status_code == 200
+    assert response.content == Path(FILE_SAMPLE).read_bytes()
+
+    response = requests.head(SERVER_URL, params={'file_hash': FILE_HASH})
+    assert response.status_code == 200
+    assert int(response.headers['Content-Length']) == \
+        os.path.getsize(FILE_SAMPLE)
+
+    response = requests.get(SERVER_URL + '/meta',
+                            params={'file_hash': FILE_HASH})
+    assert response.json()['size'] == os.path.getsize(FILE_SAMPLE)
+
+    response = requests.delete(SERVER_URL, params={'file_hash': FILE_HASH})
+    assert response.status_code == 200
+    assert not os.path.exists(BASE_DIR + '/store/f3/' + FILE_HASH)
+
+    response = requests.get(SERVER_URL, params={'file_hash': FILE_HASH})
+    assert response.status_code == 404
+
+
+def test_chunked_upload():
+    """
+    Chunked body is received through asyncio engine
+    """
+    resp, file_hash = send_post_request(SERVER_URL, FILE_SAMPLE, chunked=True)
+    assert resp.status_code == 200
+    assert file_hash == FILE_HASH
+
+    response = requests.delete(SERVER_URL, params={'file_hash': FILE_HASH})
+    assert response.status_code == 200
+
+
+def test_batch_requests():
+    """
+    Batch upload, stat and delete through asyncio engine
+    """
+    response = requests.post(SERVER_URL + '/batch/upload', files={
+        'sample': ('sample_file.txt', Path(FILE_SAMPLE).read_bytes())})
+    assert response.json() == [
+        {'name': 'sample_file.txt', 'hash': FILE_HASH, 'status': 200}]
+
+    response = requests.post(SERVER_URL + '/batch/stat', json=[FILE_HASH])
+    assert response.json()[0]['exists']
+
+    response = requests.post(SERVER_URL + '/batch/delete', json=[FILE_HASH])
+    assert response.json() == [{'hash': FILE_HASH, 'status': 200}]
+
+
+if __name__ == "__main__":
+    pass
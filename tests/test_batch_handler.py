@@ -0,0 +1,52 @@
+"""
+Unit tests for batch_handler module [pytest]
+"""
+import os
+from hashlib import md5
+from batch_handler import BodyCollector, upload_objects
+from file_index import get_index
+from post_handler import BodyReceiver, UploadReceiver
+
+
+def test_receivers_share_base_class():
+    """
+    Both request body receivers can be discarded the same way
+    """
+    collector = BodyCollector()
+    collector.feed(b'["aa"]')
+    collector.discard()
+
+    assert isinstance(collector, BodyReceiver)
+    assert collector.finish() == b''
+
+
+def test_discard_removes_files_left_by_interrupted_upload(tmp_path):
+    """
+    If the response is interrupted after the first object, only the
+    objects that were not moved to the storage are discarded
+    """
+    storage_dir = str(tmp_path) + '/store/'
+    boundary = 'batchboundary'
+    receiver = UploadReceiver(
+        {'Content-Type': 'multipart/form-data; boundary=' + boundary},
+        storage_dir, 'md5')
+    contents = [b'first object', b'second object', b'third object']
+    body = b''
+    for number, content in enumerate(contents):
+        body += ('--{}\r\nContent-Disposition: form-data; name="file{}"; '
+                 'filename="{}.txt"\r\n\r\n'.format(boundary, number,
+                                                    number)).encode()
+        body += content + b'\r\n'
+    receiver.feed(body + ('--' + boundary + '--\r\n').encode())
+    temp_files = [temp_file for _, temp_file in receiver.finish()]
+
+    results = upload_objects(receiver, storage_dir)
+    assert next(results) == {'name': '0.txt', 'status': 200,
+                             'hash': md5(contents[0]).hexdigest()}
+    results.close()
+    receiver.discard()
+
+    assert not any(os.path.exists(temp_file) for temp_file in temp_files)
+    index = get_index(storage_dir)
+    assert index.lookup(md5(contents[0]).hexdigest()) is not None
+    assert index.lookup(md5(contents[1]).hexdigest()) is None
@@ -0,0 +1,53 @@
+"""
+Unit tests for compression module [pytest]
+"""
+import gzip
+from pathlib import Path
+from compression import BackgroundCompressor, negotiate_encoding, \
+    variant_path
+from file_index import FileIndex
+from post_handler import create_staging_file
+
+BASE_DIR = str(Path().parent.absolute())
+TEXT_SAMPLE = BASE_DIR + '/tests/assets/sample_file.txt'
+IMAGE_SAMPLE = BASE_DIR + '/tests/assets/sample_image.jpg'
+
+
+def test_negotiate_encoding():
+    """
+    Stored variant with the highest client weight is chosen
+    """
+    assert negotiate_encoding('gzip, deflate, br', ['gzip']) == 'gzip'
+    assert negotiate_encoding('gzip;q=0', ['gzip']) == ''
+    assert negotiate_encoding('*', ['gzip']) == 'gzip'
+    assert negotiate_encoding('identity', ['gzip']) == ''
+    assert negotiate_encoding('gzip', []) == ''
+
+
+def test_compressible_files_get_variant(tmp_path):
+    """
+    Text file gets a gzip variant recorded in index, already compressed
+    image is skipped
+    """
+    storage_dir = str(tmp_path) + '/'
+    index = FileIndex(storage_dir)
+    compressor = BackgroundCompressor(storage_dir, ['gzip', 'unknown'],
+                                      create_staging_file, index)
+    text_path = str(tmp_path / 'text')
+    image_path = str(tmp_path / 'image')
+    Path(text_path).write_bytes(Path(TEXT_SAMPLE).read_bytes())
+    Path(image_path).write_bytes(Path(IMAGE_SAMPLE).read_bytes())
+    index.add('text', 1)
+    index.add('image', 1)
+
+    compressor.submit('text', text_path)
+    compressor.submit('image', image_path)
+    compressor.join()
+
+    compressed = Path(variant_path(text_path, 'gzip')).read_bytes()
+    assert gzip.decompress(compressed) == Path(TEXT_SAMPLE).read_bytes()
+    assert index.variants('text') == {'gzip': len(compressed)}
+    assert index.variants('image') == {}
+    assert compressor.stats() == {'pending': 0, 'compressed': 1,
+                                  'skipped': 1}
+    assert not list((tmp_path / '.staging').iterdir())
@@ -0,0 +1,96 @@
+"""
+Unit tests for engines module [pytest]
+
+Thread pool engine must keep serving while workers are busy and answer
+503 Service Unavailable when its bounded queue is full.
+"""
+import json
+import socket
+import threading
+import time
+import requests
+from server import run_server
+
+SERVER_ADDR: str = 'localhost'
+SERVER_PORT: int = 9001
+SERVER_URL = 'http://' + SERVER_ADDR + ':' + str(SERVER_PORT)
+
+WORKERS: int = 2
+QUEUE_SIZE: int = 1
+
+
+def start_thread_pool_server():
+    thread = threading.Thread(target=run_server,
+                              args=(SERVER_ADDR, SERVER_PORT, 12, 4096),
+                              kwargs={'engine': 'threads',
+                                      'workers': WORKERS,
+                                      'queue_size': QUEUE_SIZE})
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+
+def open_idle_connection() -> socket.socket:
+    idle_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    idle_sock.connect((SERVER_ADDR, SERVER_PORT))
+    time.sleep(0.2)
+    return idle_sock
+
+
+def test_thread_pool_rejects_clients_when_queue_is_full():
+    """
+    Two idle clients occupy both workers, the third one waits in the queue
+    and the fourth one must be rejected at once
+    """
+    start_thread_pool_server()
+
+    idle_socks = [open_idle_connection() for _ in range(WORKERS + QUEUE_SIZE)]
+
+    rejected_sock = open_idle_connection()
+    rejected_sock.settimeout(2)
+    server_response = rejected_sock.recv(1024)
+    rejected_sock.close()
+
+    for idle_sock in idle_socks:
+        idle_sock.close()
+    time.sleep(0.5)
+
+    response = requests.get(SERVER_URL + '/stats')
+    engine_stats = json.loads(response.content.decode())['engine']
+
+    assert server_response.startswith(b"HTTP/1.1 503 Service Unavailable")
+    assert engine_stats['rejected'] >= 1
+    assert engine_stats['peak_queued'] == QUEUE_SIZE
+    assert engine_stats['workers'] == WORKERS
+
+
+def test_idle_first_connection_is_closed_by_request_timeout():
+    """
+    A client that connects and sends nothing must not hold the only
+    worker forever: it is closed after request_timeout and the next
+    client is served
+    """
+    idle_port = SERVER_PORT + 3
+    thread = threading.Thread(target=run_server,
+                              args=(SERVER_ADDR, idle_port, 12, 4096),
+                              kwargs={'engine': 'threads', 'workers': 1,
+                                      'queue_size': 4,
+                                      'request_timeout': 0.5})
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    idle_sock = socket.create_connection((SERVER_ADDR, idle_port))
+    idle_sock.settimeout(5)
+    response = requests.get('http://{}:{}/stats'.format(SERVER_ADDR,
+                                                        idle_port),
+                            timeout=5)
+    idle_closed = idle_sock.recv(1024)
+    idle_sock.close()
+
+    assert response.status_code == 200
+    assert idle_closed == b''
+
+
+if __name__ == "__main__":
+    pass
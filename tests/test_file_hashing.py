@@ -0,0 +1,65 @@
+"""
+Unit tests for file_hashing module [pytest]
+
+Keys of stored files must record the algorithm and stay compatible with
+bare MD5 keys.
+"""
+import hashlib
+from pathlib import Path
+import pytest
+import file_hashing
+
+FILE_SAMPLE = str(Path().parent.absolute()) + '/tests/assets/sample_file.txt'
+FILE_HASH = 'f3d73e8b9006f3bf6c541786c1c96fc3'
+
+
+def test_md5_keys_stay_bare_hex_digests():
+    """
+    Keys of files stored before the registry was added do not change
+    """
+    assert file_hashing.get_hash_md5(FILE_SAMPLE) == FILE_HASH
+    assert file_hashing.split_hash_key(FILE_HASH) == ('md5', FILE_HASH)
+
+
+@pytest.mark.parametrize('algorithm', sorted(file_hashing.HASH_ALGORITHMS))
+def test_keys_record_algorithm(algorithm):
+    """
+    Every registered algorithm gives a key that can be split back
+    """
+    key = file_hashing.get_file_hash(FILE_SAMPLE, algorithm)
+    key_algorithm, hexdigest = file_hashing.split_hash_key(key)
+
+    assert key_algorithm == algorithm
+    assert file_hashing.make_hash_key(algorithm, hexdigest) == key
+
+
+def test_sha256_key():
+    """
+    Non-MD5 keys look like <algorithm>-<hexdigest>
+    """
+    expected = hashlib.sha256(Path(FILE_SAMPLE).read_bytes()).hexdigest()
+
+    assert file_hashing.get_file_hash(FILE_SAMPLE, 'sha256') == \
+        'sha256-' + expected
+
+
+@pytest.mark.parametrize('key', ['', '../../etc/passwd', FILE_HASH[:-1],
+                                 'sha256-' + FILE_HASH, 'crc32-00000000',
+                                 'z' * 32])
+def test_invalid_keys_are_rejected(key):
+    """
+    Keys of unknown algorithms or with wrong digest are not accepted
+    """
+    assert file_hashing.split_hash_key(key) is None
+
+
+def test_unknown_algorithm_can_not_be_selected():
+    """
+    Deployment can select only registered algorithm
+    """
+    with pytest.raises(ValueError):
+        file_hashing.set_algorithm('crc32')
+
+
+if __name__ == "__main__":
+    pass
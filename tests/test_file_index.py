@@ -0,0 +1,67 @@
+"""
+Unit tests for file_index module [pytest]
+"""
+import os
+from file_index import FileIndex, INDEX_FILE_NAME
+
+FILE_HASH = 'f3d73e8b9006f3bf6c541786c1c96fc3'
+
+
+def test_add_lookup_and_remove(tmp_path):
+    """
+    Repeated adds of the same key only increase the reference count
+    """
+    index = FileIndex(str(tmp_path) + '/')
+
+    assert index.lookup(FILE_HASH) is None
+    assert index.add(FILE_HASH, 10, 1.0) == 1
+    assert index.add(FILE_HASH, 10) == 2
+
+    entry = index.lookup(FILE_HASH)
+    assert (entry.size, entry.mtime, entry.refcount) == (10, 1.0, 2)
+    assert index.stats() == {'objects': 1, 'bytes': 10, 'references': 2,
+                             'deduplicated_bytes': 10}
+
+    assert index.remove(FILE_HASH)
+    assert index.lookup(FILE_HASH) is None
+    assert not index.remove(FILE_HASH)
+
+
+def test_release_removes_last_reference(tmp_path):
+    """
+    Release drops one reference at a time, the last one is reported as 0
+    and removes the entry, so it can no longer get new references
+    """
+    index = FileIndex(str(tmp_path) + '/')
+    assert not index.add_reference(FILE_HASH)
+    index.add(FILE_HASH, 10)
+    assert index.add_reference(FILE_HASH)
+
+    assert index.release(FILE_HASH) == 1
+    assert index.release(FILE_HASH) == 0
+    assert index.lookup(FILE_HASH) is None
+    assert not index.add_reference(FILE_HASH)
+    assert index.release(FILE_HASH) is None
+
+
+def test_index_is_built_from_existing_files(tmp_path):
+    """
+    New index picks up files and their compressed variants that are
+    already in store, other files are ignored
+    """
+    shard_dir = tmp_path / FILE_HASH[:2]
+    shard_dir.mkdir()
+    (shard_dir / FILE_HASH).write_bytes(b'12345')
+    (shard_dir / (FILE_HASH + '.gzip')).write_bytes(b'123')
+    (shard_dir / 'not-a-hash').write_bytes(b'')
+    (tmp_path / 'fortest').write_bytes(b'')
+
+    index = FileIndex(str(tmp_path) + '/')
+
+    assert os.path.isfile(str(tmp_path / INDEX_FILE_NAME))
+    assert index.lookup(FILE_HASH).size == 5
+    assert index.stats()['objects'] == 1
+    assert index.variants(FILE_HASH) == {'gzip': 3}
+
+    assert index.remove(FILE_HASH)
+    assert index.variants(FILE_HASH) == {}
@@ -0,0 +1,105 @@
+"""
+Unit tests for get_handler module [pytest]
+
+The sendfile loop must deliver the whole body when sendfile sends less
+than asked, when the socket is not ready and when sendfile is not
+available at all.
+"""
+import os
+import errno
+import socket
+import threading
+import pytest
+import get_handler
+from get_handler import send_file_to_client
+
+CONTENT = bytes(range(256)) * 200
+REAL_SENDFILE = getattr(os, 'sendfile', None)
+
+
+@pytest.fixture
+def file_path(tmp_path):
+    path = tmp_path / 'object'
+    path.write_bytes(CONTENT)
+    return str(path)
+
+
+def send_and_receive(file_path, offset=0, count=None) -> bytes:
+    send_sock, recv_sock = socket.socketpair()
+    received = []
+
+    def receive():
+        while True:
+            data = recv_sock.recv(65536)
+            if not data:
+                break
+            received.append(data)
+
+    with send_sock, recv_sock:
+        thread = threading.Thread(target=receive, daemon=True)
+        thread.start()
+        assert send_file_to_client(send_sock, file_path, offset, count)
+        send_sock.shutdown(socket.SHUT_WR)
+        thread.join(5)
+    return b''.join(received)
+
+
+@pytest.mark.skipif(REAL_SENDFILE is None, reason="no os.sendfile")
+def test_short_sendfile_counts_are_repeated(file_path, monkeypatch):
+    """
+    sendfile sending at most 1000 bytes per call is called until the
+    whole range is sent
+    """
+    calls = []
+
+    def sendfile(out_fd, in_fd, offset, count):
+        calls.append(count)
+        return REAL_SENDFILE(out_fd, in_fd, offset, min(count, 1000))
+
+    monkeypatch.setattr(get_handler.os, 'sendfile', sendfile)
+    assert send_and_receive(file_path, 100, 20000) == CONTENT[100:20100]
+    assert len(calls) == 20
+
+
+@pytest.mark.skipif(REAL_SENDFILE is None, reason="no os.sendfile")
+def test_blocking_io_error_waits_and_retries(file_path, monkeypatch):
+    """
+    BlockingIOError means the socket is not ready yet, the same range is
+    sent again
+    """
+    calls = []
+
+    def sendfile(out_fd, in_fd, offset, count):
+        calls.append(offset)
+        if len(calls) == 1:
+            raise BlockingIOError(errno.EAGAIN, "Resource unavailable")
+        return REAL_SENDFILE(out_fd, in_fd, offset, count)
+
+    monkeypatch.setattr(get_handler.os, 'sendfile', sendfile)
+    assert send_and_receive(file_path) == CONTENT
+    assert calls[:2] == [0, 0]
+
+
+def test_missing_sendfile_falls_back_to_buffered(file_path, monkeypatch):
+    """
+    Without os.sendfile the file is read and sent in BUFFER_SIZE chunks
+    """
+    monkeypatch.delattr(get_handler.os, 'sendfile', raising=False)
+    monkeypatch.setattr(get_handler, 'BUFFER_SIZE', 4096)
+    assert send_and_receive(file_path) == CONTENT
+
+
+@pytest.mark.parametrize('error', [errno.EINVAL, errno.ENOSYS,
+                                   errno.EOPNOTSUPP])
+def test_unsupported_sendfile_falls_back_to_buffered(file_path,
+                                                     monkeypatch, error):
+    """
+    sendfile errors from SENDFILE_UNSUPPORTED before anything was sent
+    switch to send_buffered
+    """
+    def sendfile(out_fd, in_fd, offset, count):
+        raise OSError(error, os.strerror(error))
+
+    monkeypatch.setattr(get_handler.os, 'sendfile', sendfile,
+                        raising=False)
+    assert send_and_receive(file_path, 10) == CONTENT[10:]
@@ -0,0 +1,105 @@
+"""
+Unit tests for graceful module [pytest]
+
+SIGTERM must stop accepting new connections but let the accepted ones
+finish; the listening socket can be handed over to a new process.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+import graceful
+
+SERVER_ADDR: str = 'localhost'
+SERVER_PORT: int = 9011
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_inherited_socket_is_taken_from_environment(monkeypatch):
+    """
+    The listening socket is rebuilt from the descriptor number in the
+    environment, and the variable is not passed on any further
+    """
+    listening = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening.bind((SERVER_ADDR, 0))
+    listening.listen(1)
+    monkeypatch.setenv(graceful.LISTEN_FD_ENV, str(os.dup(listening.fileno())))
+
+    assert graceful.is_takeover()
+    inherited = graceful.inherited_socket()
+    try:
+        assert inherited.getsockname() == listening.getsockname()
+        assert inherited.getblocking()
+        assert not graceful.is_takeover()
+        assert graceful.inherited_socket() is None
+    finally:
+        inherited.close()
+        listening.close()
+
+
+def test_stop_signal_drains_once():
+    """
+    Repeated stop signals call on_drain only once
+    """
+    previous = {signum: signal.getsignal(signum)
+                for signum in graceful.STOP_SIGNALS + (
+                    graceful.RELOAD_SIGNAL,)}
+    calls = []
+    try:
+        assert graceful.install_handlers(lambda: calls.append(1))
+        os.kill(os.getpid(), signal.SIGTERM)
+        os.kill(os.getpid(), signal.SIGTERM)
+        time.sleep(0.1)
+        assert calls == [1]
+        assert graceful.is_draining()
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        graceful._draining.clear()  # pylint: disable=protected-access
+
+
+def test_accepted_connection_is_served_after_sigterm():
+    """
+    A request that was started before SIGTERM gets its response with
+    'Connection: close', then the server exits and refuses new clients
+    """
+    server_process = subprocess.Popen(
+        [sys.executable, '-c',
+         'from server import run_server; '
+         'run_server({!r}, {}, engine="threads")'.format(SERVER_ADDR,
+                                                         SERVER_PORT)],
+        cwd=PROJECT_DIR)
+    try:
+        client_sock = None
+        for _ in range(50):
+            try:
+                client_sock = socket.create_connection(
+                    (SERVER_ADDR, SERVER_PORT))
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.1)
+        assert client_sock is not None
+        client_sock.settimeout(5)
+        client_sock.sendall(b'GET /stats HTTP/1.1\r\nHost: localhost\r\n')
+        time.sleep(0.3)
+
+        server_process.send_signal(signal.SIGTERM)
+        time.sleep(0.3)
+        client_sock.sendall(b'\r\n')
+        response = b''
+        while True:
+            data = client_sock.recv(65536)
+            if not data:
+                break
+            response += data
+        client_sock.close()
+
+        assert response.startswith(b'HTTP/1.1 200')
+        assert b'Connection: close' in response
+        assert server_process.wait(timeout=10) == 0
+    finally:
+        if server_process.poll() is None:
+            server_process.kill()
+            server_process.wait()
@@ -0,0 +1,133 @@
+"""
+Unit tests for http_parser module [pytest]
+"""
+import pytest
+from http_parser import RequestParser, HttpParseError, ChunkedDecoder, \
+    LAST_CHUNK, encode_chunk, parse_request
+
+REQUEST = (b'GET /some%20path?file_hash=ab%2Bcd&empty=&x=1 HTTP/1.1\r\n'
+           b'Host: localhost:9000\r\n'
+           b'content-LENGTH:  5 \r\n'
+           b'X-Value: a: b: c\r\n'
+           b'Accept: text/plain\r\n'
+           b'Accept: text/html\r\n'
+           b'\r\n'
+           b'GET /next')
+
+
+def test_request_split_into_single_bytes():
+    """
+    Parser keeps state between reads of any size
+    """
+    parser = RequestParser()
+    for position in range(len(REQUEST) - len(b'\r\nGET /next') - 1):
+        assert parser.feed(REQUEST[position:position + 1]) is None
+    request = parser.feed(REQUEST[len(REQUEST) - len(b'\r\nGET /next') - 1:])
+
+    assert request.first_line == [
+        'GET', '/some%20path?file_hash=ab%2Bcd&empty=&x=1', 'HTTP/1.1']
+    assert request.body == b'GET /next'
+
+
+def test_headers_and_query():
+    """
+    Header names are case-insensitive, query is percent-decoded
+    """
+    request = parse_request(REQUEST)
+
+    assert request.headers['Content-Length'] == '5'
+    assert request.headers.get('CONTENT-length') == '5'
+    assert 'content-length' in request.headers
+    assert request.headers['x-value'] == 'a: b: c'
+    assert request.headers['Accept'] == 'text/plain, text/html'
+    assert request.path == '/some path'
+    assert request.query == {'file_hash': 'ab+cd', 'empty': '', 'x': '1'}
+
+
+def test_not_http_request_is_rejected_early():
+    """
+    Data that can not be a request line is rejected before headers end
+    """
+    with pytest.raises(HttpParseError) as parse_error:
+        RequestParser().feed(b'Hello world')
+    assert parse_error.value.status == 400
+
+
+@pytest.mark.parametrize('request_head', [
+    b'GET /\r\n\r\n',
+    b'GET / HTTP/1.1\r\nNo colon here\r\n\r\n',
+    b'GET / HTTP/1.1\r\nBad name : value\r\n\r\n',
+    b'GET / HTTP/1.1\r\nHost: x\r\n folded\r\n\r\n',
+])
+def test_invalid_requests(request_head):
+    """
+    Malformed request line and header lines give 400
+    """
+    with pytest.raises(HttpParseError) as parse_error:
+        parse_request(request_head)
+    assert parse_error.value.status == 400
+
+
+def test_too_large_head():
+    """
+    Head longer than the limit gives 431 without waiting for its end
+    """
+    parser = RequestParser(max_head_size=64)
+    assert parser.feed(b'GET / HTTP/1.1\r\n') is None
+    with pytest.raises(HttpParseError) as parse_error:
+        parser.feed(b'X-Long: ' + b'a' * 64)
+    assert parse_error.value.status == 431
+
+
+CHUNKED_BODY = (b'5\r\nhello\r\n'
+                b'1;ext="x"\r\n \r\n'
+                b'A\r\n0123456789\r\n'
+                b'0\r\n'
+                b'X-Trailer: ignored\r\n'
+                b'\r\n'
+                b'GET /next')
+
+
+@pytest.mark.parametrize('part_size', [1, 2, 5, len(CHUNKED_BODY)])
+def test_chunked_body_in_any_parts(part_size):
+    """
+    Chunked body is decoded from parts of any size, the rest is unused
+    """
+    decoder = ChunkedDecoder()
+    decoded = b''
+    for position in range(0, len(CHUNKED_BODY), part_size):
+        assert not decoder.done
+        decoded += decoder.feed(CHUNKED_BODY[position:position + part_size])
+        if decoder.done:
+            break
+
+    assert decoder.done
+    assert decoded == b'hello 0123456789'
+    assert decoder.unused + CHUNKED_BODY[position + part_size:] == \
+        b'GET /next'
+
+
+def test_encoded_chunks_are_decoded():
+    """
+    encode_chunk and LAST_CHUNK produce a body ChunkedDecoder accepts
+    """
+    body = encode_chunk(b'abc') + encode_chunk(b'') + \
+        encode_chunk(b'x' * 300) + LAST_CHUNK
+    decoder = ChunkedDecoder()
+
+    assert decoder.feed(body) == b'abc' + b'x' * 300
+    assert decoder.done and decoder.unused == b''
+
+
+@pytest.mark.parametrize('chunked_body', [
+    b'zz\r\nhello\r\n0\r\n\r\n',
+    b'5\r\nhello!!\r\n0\r\n\r\n',
+    b'1' * 5000,
+])
+def test_invalid_chunked_body(chunked_body):
+    """
+    Bad chunk size, missing CRLF after data and endless size line give 400
+    """
+    with pytest.raises(HttpParseError) as parse_error:
+        ChunkedDecoder().feed(chunked_body)
+    assert parse_error.value.status == 400
@@ -0,0 +1,67 @@
+"""
+Unit tests for metrics module [pytest]
+"""
+import asyncio
+import threading
+import metrics
+from metrics import MetricsRegistry, RequestTimer, stats_gauges
+
+
+def test_request_is_recorded_with_status_and_stages():
+    """
+    Status is taken from the first final response line (not from
+    100 Continue), stages and sent bytes are recorded per method and status
+    """
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    timer = RequestTimer(0.0)
+    timer.count_sent(b'HTTP/1.1 100 Continue\r\n\r\n')
+    timer.count_sent(b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\n')
+    timer.count_sent(b'abc')
+    timer.add_stage('hash', 0.05)
+    timer.add_stage('hash', 0.5)
+    timer.duration = 0.6
+    registry.finish('POST', timer)
+
+    text = registry.render()
+    assert timer.status == 200
+    assert 'first_byte' in timer.stages
+    assert ('filestorage_http_response_bytes_total'
+            '{method="POST",status="200"} 66') in text
+    assert ('filestorage_http_request_stage_seconds_bucket'
+            '{stage="hash",method="POST",status="200",le="0.1"} 0') in text
+    assert ('filestorage_http_request_stage_seconds_bucket'
+            '{stage="hash",method="POST",status="200",le="1"} 1') in text
+    assert ('filestorage_http_request_stage_seconds_count'
+            '{stage="hash",method="POST",status="200"} 1') in text
+    assert '# TYPE filestorage_http_request_duration_seconds histogram' \
+        in text
+
+
+def test_numeric_stats_become_gauges():
+    """
+    Nested counters get a name label, other values are skipped
+    """
+    stats = {'engine': {'active': 2, 'name': 'threads', 'busy': True},
+             'volumes': {'/store/': {'objects': 5}}}
+    assert list(stats_gauges(stats)) == [
+        ('engine_active', (), 2),
+        ('volumes_objects', (('name', '/store/'),), 5)]
+
+
+def test_executor_stage_is_added_to_current_request():
+    """
+    A blocking step run in the executor records its stage in the timer of
+    the request that started it, off the event loop thread
+    """
+    def commit():
+        metrics.add_stage('commit', 0.25)
+        return threading.current_thread()
+
+    async def handle():
+        timer = metrics.start_request()
+        thread = await metrics.run_in_executor(commit)
+        return timer, thread
+
+    timer, thread = asyncio.run(handle())
+    assert timer.stages == {'commit': 0.25}
+    assert thread is not threading.current_thread()
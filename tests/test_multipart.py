@@ -0,0 +1,77 @@
+"""
+Unit tests for multipart module [pytest]
+"""
+import pytest
+from multipart import MultipartParser, MultipartError, PART_BEGIN, \
+    PART_DATA, PART_END, get_boundary, part_filename
+
+BOUNDARY = b'xYzZY'
+BODY = (b'preamble\r\n'
+        b'--xYzZY\r\n'
+        b'Content-Disposition: form-data; name="comment"\r\n\r\n'
+        b'text field\r\n'
+        b'--xYzZY\r\n'
+        b'Content-Disposition: form-data; name="file"; filename="a.bin"\r\n'
+        b'Content-Type: application/octet-stream\r\n\r\n'
+        b'\r\n--xYz binary\r\n-- data\r\n'
+        b'--xYzZY--\r\n'
+        b'epilogue')
+
+
+def parse(body, chunk_size):
+    """
+    Feed body by chunks and collect parts as (headers, data)
+    """
+    parser = MultipartParser(BOUNDARY)
+    parts = []
+    for position in range(0, len(body), chunk_size):
+        for event, value in parser.feed(body[position:position + chunk_size]):
+            if event == PART_BEGIN:
+                parts.append([value, b''])
+            elif event == PART_DATA:
+                parts[-1][1] += value
+            else:
+                assert event == PART_END
+    return parser, parts
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64, len(BODY)])
+def test_parts_are_found_in_any_chunking(chunk_size):
+    """
+    Delimiters split across chunks are found, data is not changed
+    """
+    parser, parts = parse(BODY, chunk_size)
+
+    assert parser.done
+    assert [data for _, data in parts] == [
+        b'text field', b'\r\n--xYz binary\r\n-- data']
+    assert part_filename(parts[0][0]) is None
+    assert part_filename(parts[1][0]) == 'a.bin'
+    assert parts[1][0]['content-type'] == 'application/octet-stream'
+
+
+def test_incomplete_body_is_not_done():
+    """
+    Body without closing delimiter is not finished
+    """
+    parser, _ = parse(BODY[:BODY.index(b'--xYzZY--')], 5)
+    assert not parser.done
+
+
+def test_too_long_part_headers():
+    """
+    Part headers are limited to keep memory bounded
+    """
+    parser = MultipartParser(BOUNDARY, max_head_size=64)
+    with pytest.raises(MultipartError):
+        parser.feed(b'--xYzZY\r\nX-Long: ' + b'a' * 100)
+
+
+def test_get_boundary():
+    """
+    Boundary is taken only from multipart/form-data content type
+    """
+    assert get_boundary('multipart/form-data; boundary="xYzZY"') == BOUNDARY
+    assert get_boundary('Multipart/Form-Data;boundary=xYzZY') == BOUNDARY
+    assert get_boundary('application/octet-stream') is None
+    assert get_boundary('multipart/form-data') is None
@@ -0,0 +1,113 @@
+"""
+Unit tests for pack_store module [pytest]
+"""
+import os
+from file_index import FileIndex
+from pack_store import PackStore, scan_pack
+
+
+def write_file(tmp_path, name, content):
+    path = str(tmp_path / name)
+    with open(path, 'wb') as file_stream:
+        file_stream.write(content)
+    return path
+
+
+def read_location(location):
+    with open(location.path, 'rb') as pack:
+        pack.seek(location.offset)
+        return pack.read(location.length)
+
+
+def make_store(tmp_path, max_pack_size=1000):
+    storage_dir = str(tmp_path) + '/store/'
+    os.makedirs(storage_dir)
+    return PackStore(storage_dir, max_object_size=100,
+                     max_pack_size=max_pack_size,
+                     index=FileIndex(storage_dir))
+
+
+def test_add_locate_and_delete(tmp_path):
+    """
+    Packed file is read back from its offset, a second add of the same key
+    is ignored, delete forgets the location
+    """
+    store = make_store(tmp_path)
+    first = write_file(tmp_path, 'first', b'first content')
+    second = write_file(tmp_path, 'second', b'second')
+
+    assert store.accepts(100) and not store.accepts(101)
+    assert store.add('aa01', first)
+    assert store.add('bb02', second)
+    assert not store.add('aa01', first)
+
+    assert read_location(store.locate('aa01')) == b'first content'
+    assert read_location(store.locate('bb02')) == b'second'
+    assert store.locate('cc03') is None
+
+    assert store.delete('aa01')
+    assert not store.delete('aa01')
+    assert store.locate('aa01') is None
+    pack_path = store.locate('bb02').path
+    assert [key for key, _ in scan_pack(pack_path, 1)] == ['bb02']
+
+
+def test_compact_moves_live_records(tmp_path):
+    """
+    Full pack with many deleted records is rewritten into the current one,
+    the current pack itself is never compacted
+    """
+    store = make_store(tmp_path, max_pack_size=100)
+    for number in range(4):
+        path = write_file(tmp_path, str(number), bytes([number]) * 40)
+        assert store.add('key{}'.format(number), path)
+    assert store.pack_ids() == [1, 2]
+
+    store.delete('key0')
+    store.delete('key2')
+    reclaimed = store.compact()
+
+    # Each record is a 15-byte header, a 4-byte key and 40 bytes of data
+    assert reclaimed == 118 - 59
+    # Pack 2 is full, so the live record goes to a new pack
+    assert store.pack_ids() == [2, 3]
+    assert store.stats()['live_bytes'] == 80
+    assert read_location(store.locate('key1')) == bytes([1]) * 40
+    assert store.locate('key1').path.endswith('pack-000003.dat')
+    assert read_location(store.locate('key3')) == bytes([3]) * 40
+
+
+def test_compact_keeps_packs_without_deleted_records(tmp_path):
+    """
+    Record headers and keys are live bytes too, so packs with no deleted
+    records are never rewritten
+    """
+    store = make_store(tmp_path, max_pack_size=300)
+    for number in range(60):
+        path = write_file(tmp_path, str(number), bytes([number]) * 10)
+        assert store.add('key{:02d}'.format(number), path)
+    pack_ids = store.pack_ids()
+    assert len(pack_ids) > 2
+
+    assert store.compact() == 0
+    assert store.pack_ids() == pack_ids
+
+
+def test_recover_index_from_pack_files(tmp_path):
+    """
+    New index is filled from the records of existing pack files
+    """
+    store = make_store(tmp_path)
+    for key in ('aa01', 'bb02', 'cc03'):
+        store.add(key, write_file(tmp_path, key, key.encode() * 5))
+    store.delete('bb02')
+    for name in os.listdir(store.storage_dir):
+        if name.startswith('index.sqlite3'):
+            os.remove(store.storage_dir + name)
+
+    index = FileIndex(store.storage_dir)
+    recovered = PackStore(store.storage_dir, index=index)
+
+    assert recovered.locate('bb02') is None
+    assert read_location(recovered.locate('cc03')) == b'cc03' * 5
+    assert index.lookup('aa01').size == 20
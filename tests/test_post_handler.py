@@ -0,0 +1,34 @@
+"""
+Unit tests for post_handler module [pytest]
+"""
+import os
+from hashlib import md5
+import post_handler
+from file_index import get_index
+from post_handler import create_staging_file, serve_post_request
+
+
+def make_staging_file(storage_dir: str, content: bytes) -> str:
+    temp_file = create_staging_file(storage_dir)
+    with open(temp_file, 'wb') as file_stream:
+        file_stream.write(content)
+    return temp_file
+
+
+def test_failed_link_is_not_indexed(tmp_path, monkeypatch):
+    """
+    If the shard directory disappears before both link attempts, the
+    upload fails with 500 and leaves no index entry or staging file
+    """
+    storage_dir = str(tmp_path) + '/store/'
+    content = b'lost upload'
+    file_hash = md5(content).hexdigest()
+    temp_file = make_staging_file(storage_dir, content)
+
+    def link(source, destination):
+        raise FileNotFoundError(destination)
+
+    monkeypatch.setattr(post_handler.os, 'link', link)
+    assert serve_post_request(file_hash, storage_dir, temp_file) == ('', 500)
+    assert get_index(storage_dir).lookup(file_hash) is None
+    assert not os.path.exists(temp_file)
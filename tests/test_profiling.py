@@ -0,0 +1,67 @@
+"""
+Unit tests for profiling module [pytest]
+"""
+import os
+import time
+import signal
+import threading
+import profiling
+from profiling import ProfileSession, SamplingProfiler
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_samples_include_other_threads():
+    """
+    Stacks of a busy thread appear in the report and in folded stacks
+    """
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,))
+    worker.start()
+    profiler = SamplingProfiler()
+    for _ in range(5):
+        profiler.sample()
+    stop.set()
+    worker.join()
+
+    assert profiler.samples == 5
+    assert 'busy_loop (test_profiling.py:' in profiler.report()
+    assert all(line.rsplit(' ', 1)[1].isdigit()
+               for line in profiler.folded().splitlines())
+
+
+def test_signal_starts_and_stops_profiling(tmp_path):
+    """
+    The first signal starts profiling, the second one writes the profile
+    """
+    previous = signal.getsignal(profiling.PROFILE_SIGNAL)
+    try:
+        assert profiling.enable_profiling(60, str(tmp_path))
+        os.kill(os.getpid(), profiling.PROFILE_SIGNAL)
+        time.sleep(0.2)
+        os.kill(os.getpid(), profiling.PROFILE_SIGNAL)
+        for _ in range(50):
+            if len(os.listdir(str(tmp_path))) == 2:
+                break
+            time.sleep(0.1)
+    finally:
+        signal.signal(profiling.PROFILE_SIGNAL, previous)
+
+    extensions = sorted(os.path.splitext(name)[1]
+                        for name in os.listdir(str(tmp_path)))
+    assert extensions == ['.folded', '.txt']
+
+
+def test_session_finishes_after_timeout(tmp_path):
+    session = ProfileSession(0.1, str(tmp_path))
+    session.toggle()
+    for _ in range(50):
+        if session.profiler is None and len(os.listdir(str(tmp_path))) == 2:
+            break
+        time.sleep(0.1)
+    assert session.profiler is None
+    assert session.finish() is None
+    assert len(os.listdir(str(tmp_path))) == 2
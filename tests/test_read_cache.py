@@ -0,0 +1,56 @@
+"""
+Unit tests for read_cache module [pytest]
+"""
+import os
+from read_cache import ReadCache
+
+
+def write_file(tmp_path, name, size):
+    """
+    File with size bytes of predictable content
+    """
+    path = str(tmp_path / name)
+    with open(path, 'wb') as file_stream:
+        file_stream.write(bytes(index % 251 for index in range(size)))
+    return path
+
+
+def test_small_and_mapped_files_are_cached(tmp_path):
+    """
+    Small file is kept in memory, medium one is mapped, large one is not
+    cached; content stays available after the file is removed
+    """
+    cache = ReadCache(max_bytes=1000, small_object_size=100,
+                      mmap_max_size=10000)
+    small = write_file(tmp_path, 'small', 50)
+    medium = write_file(tmp_path, 'medium', 5000)
+    large = write_file(tmp_path, 'large', 20000)
+
+    assert bytes(cache.get('small', small, 50)) == open(small, 'rb').read()
+    assert bytes(cache.get('medium', medium, 5000)[10:20]) == \
+        open(medium, 'rb').read()[10:20]
+    assert cache.get('large', large, 20000) is None
+
+    os.remove(small)
+    assert len(cache.get('small', small, 50)) == 50
+    assert cache.stats() == {'objects': 1, 'bytes': 50, 'mapped': 1,
+                             'hits': 1, 'misses': 2}
+
+    cache.evict('small')
+    assert cache.get('small', small, 50) is None
+    assert cache.stats()['bytes'] == 0
+
+
+def test_byte_budget_evicts_least_recently_used(tmp_path):
+    """
+    Total size of small files stays within max_bytes
+    """
+    cache = ReadCache(max_bytes=250, small_object_size=100)
+    paths = {name: write_file(tmp_path, name, 100) for name in 'abc'}
+    for name in 'abac':
+        cache.get(name, paths[name], 100)
+
+    assert cache.stats()['objects'] == 2
+    assert cache.stats()['bytes'] == 200
+    cache.get('a', paths['a'], 100)
+    assert cache.stats()['hits'] == 2
@@ -3,14 +3,21 @@ Unit tests for server module [pytest]
 
 Short description. Can help with autogenerate docs.
 """
+import io
 import os
+import gzip
+import tarfile
 import threading
 import socket
 import time
+from hashlib import md5
 import requests
 import pytest
 from pathlib import Path
 from server import run_server
+from compression import BackgroundCompressor
+from post_handler import create_staging_file
+from pack_store import get_pack_store
 from client import send_post_request
 
 SERVER_ADDR: str = 'localhost'
@@ -56,7 +63,54 @@ def test_response_for_incorrect_request_http_protocol_version():
     server_sock.send("Hello world".encode())
     server_response = server_sock.recv(1024)
 
-    assert server_response == b"HTTP/1.1 400 Bad Request\n\n"
+    assert server_response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+
+
+def test_keep_alive_with_pipelined_requests():
+    """
+    Two pipelined requests on one persistent connection get two responses
+    """
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_sock.connect((SERVER_ADDR, SERVER_PORT))
+    server_sock.settimeout(2)
+
+    missing_file_hash = b'0' * 32
+    server_sock.sendall(b"GET /?file_hash=" + missing_file_hash +
+                        b" HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                        b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+    server_response = b''
+    while True:
+        data = server_sock.recv(1024)
+        if not data:
+            break
+        server_response += data
+    server_sock.close()
+
+    first_response, second_response = server_response.split(b'\r\n\r\n')[:2]
+    assert first_response.startswith(b"HTTP/1.1 404 Not Found\r\n")
+    assert b"Content-Length: 0\r\n" in first_response
+    assert b"Connection: keep-alive" in first_response
+    assert second_response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert b"Connection: close" in second_response
+
+
+def test_request_head_sent_in_parts_and_too_large_head():
+    """
+    Headers may come in many small parts; too large headers give 431
+    """
+    with socket.create_connection((SERVER_ADDR, SERVER_PORT)) as sock:
+        for part in (b"GET /st", b"ats HTTP/1.1\r\nHo", b"st: localhost\r",
+                     b"\nconnection: close\r\n", b"\r\n"):
+            sock.sendall(part)
+            time.sleep(0.01)
+        response = sock.recv(1024)
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+
+    with socket.create_connection((SERVER_ADDR, SERVER_PORT)) as sock:
+        sock.sendall(b"GET / HTTP/1.1\r\nX-Long: " + b"a" * 70000)
+        response = sock.recv(1024)
+    assert response.startswith(
+        b"HTTP/1.1 431 Request Header Fields Too Large\r\n")
 
 
 def test_response_for_empty_get_request():
@@ -135,6 +189,323 @@ def test_response_for_get_request_if_file_exists_in_store():
     assert is_ok
 
 
+def test_head_and_meta_requests():
+    """
+    HEAD returns GET headers without body, /meta returns file metadata,
+    both notice upload and delete of the file
+    """
+    content = b'head and meta'
+    file_hash = md5(content).hexdigest()
+    params = {'file_hash': file_hash}
+
+    assert requests.head(SERVER_URL, params=params).status_code == 404
+    requests.post(SERVER_URL, files={'file': ('a.txt', content)})
+
+    response = requests.head(SERVER_URL, params=params)
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == str(len(content))
+    assert response.headers['ETag'] == '"{}"'.format(file_hash)
+    assert response.content == b''
+
+    response = requests.get(SERVER_URL + '/meta', params=params)
+    metadata = response.json()
+    assert metadata['size'] == len(content)
+    assert metadata['algorithm'] == 'md5'
+    assert metadata['created'] <= time.time()
+
+    requests.delete(SERVER_URL, params=params)
+    assert requests.head(SERVER_URL, params=params).status_code == 404
+    response = requests.get(SERVER_URL + '/meta', params=params)
+    assert response.status_code == 404
+    response = requests.get(SERVER_URL + '/meta', params={'file_hash': 'x'})
+    assert response.status_code == 400
+
+
+def test_range_and_conditional_get_requests():
+    """
+    Range, If-Range and If-None-Match for a stored file
+    """
+    base_dir = str(Path().parent.absolute())
+    file_sample = base_dir + '/tests/assets/sample_file.txt'
+    file_content = Path(file_sample).read_bytes()
+    resp, file_hash = send_post_request(SERVER_URL, file_sample)
+    params = {'file_hash': file_hash}
+    etag = '"{}"'.format(file_hash)
+
+    full = requests.get(SERVER_URL, params=params)
+    single = requests.get(SERVER_URL, params=params,
+                          headers={'Range': 'bytes=10-19'})
+    suffix = requests.get(SERVER_URL, params=params,
+                          headers={'Range': 'bytes=-5'})
+    multi = requests.get(SERVER_URL, params=params,
+                         headers={'Range': 'bytes=0-1,-2'})
+    not_satisfiable = requests.get(SERVER_URL, params=params,
+                                   headers={'Range': 'bytes=999999-'})
+    stale_if_range = requests.get(SERVER_URL, params=params,
+                                  headers={'Range': 'bytes=0-1',
+                                           'If-Range': '"stale"'})
+    not_modified = requests.get(SERVER_URL, params=params,
+                                headers={'If-None-Match': etag})
+
+    requests.delete(SERVER_URL, params=params)
+
+    assert resp.status_code == 200
+    assert full.headers['ETag'] == etag
+    assert full.headers['Content-Length'] == str(len(file_content))
+    assert single.status_code == 206
+    assert single.content == file_content[10:20]
+    assert single.headers['Content-Range'] == 'bytes 10-19/{}'.format(
+        len(file_content))
+    assert suffix.content == file_content[-5:]
+    assert multi.status_code == 206
+    assert multi.headers['Content-Type'].startswith('multipart/byteranges')
+    assert file_content[:2] in multi.content
+    assert len(multi.content) == int(multi.headers['Content-Length'])
+    assert not_satisfiable.status_code == 416
+    assert stale_if_range.status_code == 200
+    assert stale_if_range.content == file_content
+    assert not_modified.status_code == 304
+    assert not_modified.content == b''
+
+
+def test_get_request_for_compressed_variant():
+    """
+    Stored gzip variant is served to clients that accept it, the key
+    stays the hash of the original bytes
+    """
+    base_dir = str(Path().parent.absolute())
+    file_sample = base_dir + '/tests/assets/sample_file.txt'
+    content = Path(file_sample).read_bytes()
+    file_hash = md5(content).hexdigest()
+    file_path = base_dir + '/store/' + file_hash[:2] + '/' + file_hash
+    params = {'file_hash': file_hash}
+
+    send_post_request(SERVER_URL, file_sample)
+    compressor = BackgroundCompressor(base_dir + '/store/', ['gzip'],
+                                      create_staging_file)
+    assert compressor.compress(file_hash, file_path, 'gzip')
+
+    response = requests.get(SERVER_URL, params=params, stream=True)
+    compressed = response.raw.read()
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'] == '"{}.gzip"'.format(file_hash)
+    assert gzip.decompress(compressed) == content
+    assert len(compressed) < len(content)
+
+    response = requests.get(SERVER_URL, params=params,
+                            headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.content == content
+
+    response = requests.get(SERVER_URL, params=params,
+                            headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert response.content == content[:10]
+
+    response = requests.head(SERVER_URL, params=params)
+    assert response.headers['Content-Length'] == str(len(compressed))
+
+    requests.delete(SERVER_URL, params=params)
+    assert not os.path.exists(file_path + '.gzip')
+
+
+def test_packed_small_file():
+    """
+    Small file is appended to a pack file and served from its offset
+    """
+    base_dir = str(Path().parent.absolute())
+    file_sample = base_dir + '/tests/assets/sample_file.txt'
+    content = Path(file_sample).read_bytes()
+    file_hash = md5(content).hexdigest()
+    params = {'file_hash': file_hash}
+    time.sleep(0.1)  # run_server of the fixture resets the packing size
+    pack_store = get_pack_store(base_dir + '/store/')
+    pack_store.max_object_size = len(content)
+    try:
+        resp, _ = send_post_request(SERVER_URL, file_sample)
+        duplicate, _ = send_post_request(SERVER_URL, file_sample)
+    finally:
+        pack_store.max_object_size = 0
+    location = pack_store.locate(file_hash)
+
+    full = requests.get(SERVER_URL, params=params)
+    single = requests.get(SERVER_URL, params=params,
+                          headers={'Range': 'bytes=10-19'})
+    meta = requests.get(SERVER_URL + '/meta', params=params)
+    # Первый DELETE убирает ссылку дубликата, второй - сам файл
+    deleted_duplicate = requests.delete(SERVER_URL, params=params)
+    kept = requests.get(SERVER_URL, params=params)
+    deleted = requests.delete(SERVER_URL, params=params)
+
+    assert resp.status_code == 200
+    assert duplicate.status_code == 409
+    assert location.length == len(content)
+    assert not os.path.exists(base_dir + '/store/' + file_hash[:2] + '/' +
+                              file_hash)
+    assert full.content == content
+    assert single.content == content[10:20]
+    assert meta.json()['size'] == len(content)
+    assert deleted_duplicate.status_code == 200
+    assert kept.content == content
+    assert deleted.status_code == 200
+    assert pack_store.locate(file_hash) is None
+    assert requests.get(SERVER_URL, params=params).status_code == 404
+
+
+def test_post_request_with_declared_hash_and_expect_continue():
+    """
+    Upload with declared hash: known file is skipped without sending the
+    body, new file is accepted after 100 Continue, wrong hash is rejected
+    """
+    base_dir = str(Path().parent.absolute())
+    file_body = Path(base_dir + '/tests/assets/sample_file.txt').read_bytes()
+    file_hash = 'f3d73e8b9006f3bf6c541786c1c96fc3'
+
+    def post_head(declared_hash, expect=True):
+        return ("POST /?file_hash={} HTTP/1.1\r\n"
+                "Host: localhost\r\n"
+                "Content-Type: application/octet-stream\r\n"
+                "Content-Length: {}\r\n"
+                "{}\r\n").format(
+                    declared_hash, len(file_body),
+                    "Expect: 100-continue\r\n" if expect else "").encode()
+
+    with socket.create_connection((SERVER_ADDR, SERVER_PORT)) as sock:
+        sock.sendall(post_head('59c19f7df4ceba37936035844bb2ab5c'))
+        response = sock.recv(1024)
+    assert response.startswith(b"HTTP/1.1 409 Conflict\r\n")
+
+    with socket.create_connection((SERVER_ADDR, SERVER_PORT)) as sock:
+        sock.sendall(post_head(file_hash))
+        assert sock.recv(1024) == b"HTTP/1.1 100 Continue\r\n\r\n"
+        sock.sendall(file_body)
+        response = sock.recv(1024)
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert response.endswith(file_hash.encode())
+
+    requests.delete(SERVER_URL, params={'file_hash': file_hash})
+
+    with socket.create_connection((SERVER_ADDR, SERVER_PORT)) as sock:
+        sock.sendall(post_head('0' * 32, expect=False) + file_body)
+        response = sock.recv(1024)
+    assert response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+
+
+def test_post_request_with_several_files():
+    """
+    Every file part of multipart/form-data body is stored separately
+    """
+    response = requests.post(SERVER_URL, files={
+        'first': ('first.txt', b'first file'),
+        'second': ('second.txt', b'second file')})
+    file_hashes = response.text.split('\n')
+
+    assert response.status_code == 200
+    assert file_hashes == [md5(b'first file').hexdigest(),
+                           md5(b'second file').hexdigest()]
+    for file_hash in file_hashes:
+        response = requests.get(SERVER_URL, params={'file_hash': file_hash})
+        assert response.content in (b'first file', b'second file')
+        requests.delete(SERVER_URL, params={'file_hash': file_hash})
+
+
+def test_batch_upload_stat_and_delete():
+    """
+    Files from a tar archive are stored by one request, then checked and
+    deleted by lists of keys
+    """
+    files = {'a.txt': b'batch first', 'b/c.txt': b'batch second'}
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w') as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    file_hashes = [md5(data).hexdigest() for data in files.values()]
+
+    response = requests.post(SERVER_URL + '/batch/upload',
+                             data=stream.getvalue(),
+                             headers={'Content-Type': 'application/x-tar'})
+    assert response.status_code == 200
+    assert response.headers['Transfer-Encoding'] == 'chunked'
+    assert response.json() == [
+        {'name': name, 'hash': file_hash, 'status': 200}
+        for name, file_hash in zip(files, file_hashes)]
+
+    response = requests.post(SERVER_URL + '/batch/stat',
+                             json=file_hashes + ['0' * 32, 'bad'])
+    assert response.json() == [
+        {'hash': file_hashes[0], 'exists': True, 'size': 11},
+        {'hash': file_hashes[1], 'exists': True, 'size': 12},
+        {'hash': '0' * 32, 'exists': False, 'size': None},
+        {'hash': 'bad', 'exists': False, 'size': None}]
+
+    response = requests.post(SERVER_URL + '/batch/delete',
+                             json=file_hashes + ['0' * 32])
+    assert [item['status'] for item in response.json()] == [200, 200, 404]
+    for file_hash in file_hashes:
+        response = requests.get(SERVER_URL, params={'file_hash': file_hash})
+        assert response.status_code == 404
+
+    response = requests.post(SERVER_URL + '/batch/stat', data=b'{"a": 1}')
+    assert response.status_code == 400
+
+
+def test_chunked_post_requests():
+    """
+    Chunked body is accepted from requests and from a raw socket, request
+    pipelined after the chunked body is served too
+    """
+    base_dir = str(Path().parent.absolute())
+    file_sample = base_dir + '/tests/assets/sample_file.txt'
+    file_hash = 'f3d73e8b9006f3bf6c541786c1c96fc3'
+
+    resp, response_hash = send_post_request(SERVER_URL, file_sample,
+                                            chunked=True)
+    assert resp.status_code == 200
+    assert response_hash == file_hash
+    requests.delete(SERVER_URL, params={'file_hash': file_hash})
+
+    with socket.create_connection((SERVER_ADDR, SERVER_PORT)) as sock:
+        sock.sendall(b"POST / HTTP/1.1\r\n"
+                     b"Host: localhost\r\n"
+                     b"Content-Type: application/octet-stream\r\n"
+                     b"Transfer-Encoding: chunked\r\n\r\n"
+                     b"6\r\nchunk \r\n4\r\nbody\r\n0\r\n\r\n"
+                     b"DELETE /?file_hash=" +
+                     md5(b'chunk body').hexdigest().encode() +
+                     b" HTTP/1.1\r\nConnection: close\r\n\r\n")
+        response = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert md5(b'chunk body').hexdigest().encode() in response
+    assert response.count(b"HTTP/1.1 200 OK\r\n") == 2
+
+
+def test_metrics_endpoint():
+    """
+    GET /metrics returns request latency histograms in Prometheus text
+    format
+    """
+    time.sleep(0.1)
+    requests.get(SERVER_URL + '/?file_hash=' + '0' * 32)
+    response = requests.get(SERVER_URL + '/metrics')
+    text = response.content.decode()
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+    assert 'filestorage_http_request_duration_seconds_bucket{method="GET",' \
+        'status="404",le="+Inf"}' in text
+    assert 'filestorage_http_request_stage_seconds_count{stage=' \
+        '"header_parse",method="GET",status="404"}' in text
+
+
 def test_response_for_incorrect_delete_request():
     """
     Simple test for DELETE request to HTTP-server
@@ -154,8 +525,15 @@ def test_response_for_delete_request():
     file_hash = '59c19f7df4ceba37936035844bb2ab5c'
     file_dir = base_dir + '/store/59/'
     filename = file_dir + file_hash
+    params = {'file_hash': file_hash}
 
-    requests.delete(SERVER_URL, params={'file_hash': file_hash})
+    # Файл загружали несколько раз: он удаляется с последней ссылкой
+    references = requests.get(SERVER_URL + '/meta',
+                              params=params).json()['references']
+    for _ in range(references - 1):
+        requests.delete(SERVER_URL, params=params)
+        assert Path(filename).is_file()
+    requests.delete(SERVER_URL, params=params)
 
     check_file = Path(filename)
     is_file_was_deleted = not check_file.is_file()
@@ -165,5 +543,61 @@ def test_response_for_delete_request():
     assert is_file_was_deleted and is_dir_was_deleted
 
 
+def test_delete_keeps_content_of_other_uploads():
+    """
+    Content uploaded twice is still served after one DELETE and is
+    removed by the second one
+    """
+    content = b'shared content'
+    params = {'file_hash': md5(content).hexdigest()}
+    statuses = [requests.post(SERVER_URL, files={
+        'file': ('shared.txt', content)}).status_code for _ in range(2)]
+
+    first_delete = requests.delete(SERVER_URL, params=params)
+    kept = requests.get(SERVER_URL, params=params)
+    references = requests.get(SERVER_URL + '/meta',
+                              params=params).json()['references']
+    second_delete = requests.delete(SERVER_URL, params=params)
+
+    assert statuses == [200, 409]
+    assert first_delete.status_code == 200
+    assert kept.content == content
+    assert references == 1
+    assert second_delete.status_code == 200
+    assert requests.get(SERVER_URL, params=params).status_code == 404
+
+
+def test_concurrent_uploads_of_same_file():
+    """
+    Concurrent uploads of the same content: one 200, others 409, no
+    temporary files are left in store
+    """
+    base_dir = str(Path().parent.absolute())
+    file_sample = base_dir + '/tests/assets/sample_file.txt'
+    file_hash = 'f3d73e8b9006f3bf6c541786c1c96fc3'
+    statuses = []
+
+    def upload():
+        resp, _ = send_post_request(SERVER_URL, file_sample)
+        statuses.append(resp.status_code)
+
+    threads = [threading.Thread(target=upload) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    staging_dir = base_dir + '/store/.staging/'
+    assert sorted(statuses) == [200, 409, 409, 409]
+    assert not os.listdir(staging_dir)
+
+    for _ in statuses:
+        response = requests.delete(SERVER_URL,
+                                   params={'file_hash': file_hash})
+        assert response.status_code == 200
+    response = requests.get(SERVER_URL, params={'file_hash': file_hash})
+    assert response.status_code == 404
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,56 @@
+"""
+Unit tests for stat_cache module [pytest]
+"""
+from file_index import IndexEntry
+from stat_cache import StatCache
+
+ENTRY = IndexEntry(10, 1.0, 1)
+
+
+def test_lookup_is_cached_until_invalidated():
+    """
+    Loader is called once per key until the key is invalidated, missing
+    files are cached too
+    """
+    calls = []
+    entries = {'a': ENTRY}
+
+    def loader(key):
+        calls.append(key)
+        return entries.get(key)
+
+    cache = StatCache(loader)
+    assert cache.lookup('a') == ENTRY
+    assert cache.lookup('a') == ENTRY
+    assert cache.lookup('b') is None
+    assert cache.lookup('b') is None
+    assert calls == ['a', 'b']
+
+    entries['b'] = ENTRY
+    cache.invalidate('b')
+    assert cache.lookup('b') == ENTRY
+    assert cache.stats() == {'entries': 2, 'hits': 2, 'misses': 3}
+
+
+def test_least_recently_used_entry_is_evicted():
+    """
+    Cache keeps at most max_entries records
+    """
+    calls = []
+    cache = StatCache(lambda key: calls.append(key), max_entries=2)
+    for key in ('a', 'b', 'a', 'c', 'a', 'b'):
+        cache.lookup(key)
+
+    assert calls == ['a', 'b', 'c', 'b']
+
+
+def test_expired_entry_is_reloaded():
+    """
+    Entries older than ttl are loaded again
+    """
+    calls = []
+    cache = StatCache(lambda key: calls.append(key), ttl=0)
+    cache.lookup('a')
+    cache.lookup('a')
+
+    assert calls == ['a', 'a']
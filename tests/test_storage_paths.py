@@ -0,0 +1,107 @@
+"""
+Unit tests for storage_paths module [pytest]
+"""
+import os
+import pytest
+from file_index import FileIndex
+from storage_paths import DEFAULT_LAYOUT, ShardLayout, StoragePaths, \
+    make_layout, parse_layout
+
+FILE_HASH = '59c19f7df4ceba37936035844bb2ab5c'
+SHA_KEY = 'sha256-' + 'ab' * 32
+
+
+def make_paths(tmp_path):
+    storage_dir = str(tmp_path) + '/store/'
+    os.makedirs(storage_dir)
+    return StoragePaths(storage_dir, FileIndex(storage_dir))
+
+
+def store_file(path, content=b'content'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file_stream:
+        file_stream.write(content)
+
+
+def test_layouts():
+    assert DEFAULT_LAYOUT.shard_dir(FILE_HASH) == '59/'
+    assert ShardLayout(2, 2).shard_dir(FILE_HASH) == '59/c1/'
+    assert ShardLayout(3, 1).shard_dir(SHA_KEY) == 'a/b/a/'
+    assert parse_layout('2x2') == ShardLayout(2, 2)
+    assert parse_layout('0x2') is None and parse_layout('') is None
+    with pytest.raises(ValueError):
+        make_layout(3, 3)
+
+
+def test_reshard_moves_files_and_variants(tmp_path):
+    """
+    Files and their compressed variants move to the new layout, empty old
+    directories are removed, the index still finds every file
+    """
+    paths = make_paths(tmp_path)
+    storage_dir = paths.storage_dir
+    store_file(storage_dir + '59/' + FILE_HASH)
+    store_file(storage_dir + '59/' + FILE_HASH + '.gzip')
+    store_file(storage_dir + 'ab/' + SHA_KEY)
+    store_file(storage_dir + '.staging/upload.data')
+
+    assert paths.file_path(FILE_HASH) == storage_dir + '59/' + FILE_HASH
+    assert paths.reshard(ShardLayout(2, 2), wait=0) == 3
+
+    assert paths.resolve(FILE_HASH) == storage_dir + '59/c1/' + FILE_HASH
+    assert os.path.exists(storage_dir + '59/c1/' + FILE_HASH + '.gzip')
+    assert os.path.exists(storage_dir + 'ab/ab/' + SHA_KEY)
+    assert os.path.exists(storage_dir + '.staging/upload.data')
+    assert paths.layouts() == (ShardLayout(2, 2), None)
+
+    index = FileIndex(storage_dir)
+    assert index.rebuild() == 2
+    assert index.variants(FILE_HASH) == {'gzip': 7}
+
+    paths.remove_empty_dirs(paths.resolve(SHA_KEY))
+    assert os.path.isdir(storage_dir + 'ab/ab/')
+    os.remove(paths.resolve(SHA_KEY))
+    paths.remove_empty_dirs(storage_dir + 'ab/ab/' + SHA_KEY)
+    assert not os.path.exists(storage_dir + 'ab/')
+    assert os.path.isdir(storage_dir)
+
+
+def test_resolve_during_reshard(tmp_path):
+    """
+    While resharding is not finished, files not moved yet are found by
+    the previous layout and a different layout can not be started
+    """
+    paths = make_paths(tmp_path)
+    storage_dir = paths.storage_dir
+    store_file(storage_dir + '59/' + FILE_HASH)
+    paths.index.set_meta('shard_layout', '2x2')
+    paths.index.set_meta('previous_shard_layout', '1x2')
+
+    assert paths.resolve(FILE_HASH) == storage_dir + '59/' + FILE_HASH
+    assert paths.file_path(SHA_KEY) == storage_dir + 'ab/ab/' + SHA_KEY
+    with pytest.raises(ValueError):
+        paths.reshard(ShardLayout(1, 3), wait=0)
+
+    assert paths.reshard(ShardLayout(2, 2), wait=0) == 1
+    assert paths.resolve(FILE_HASH) == storage_dir + '59/c1/' + FILE_HASH
+
+
+def test_reshard_moves_files_of_indexed_volumes(tmp_path):
+    """
+    Volumes recorded in the index are resharded without being passed;
+    while one of them is not available, the previous layout is kept
+    """
+    paths = make_paths(tmp_path)
+    volume_dir = str(tmp_path) + '/disk2/'
+    store_file(volume_dir + '59/' + FILE_HASH)
+    paths.index.claim_volume(FILE_HASH, volume_dir)
+    paths.index.claim_volume(SHA_KEY, str(tmp_path) + '/unmounted/')
+
+    with pytest.raises(ValueError):
+        paths.reshard(ShardLayout(2, 2), wait=0)
+    assert os.path.exists(volume_dir + '59/c1/' + FILE_HASH)
+    assert paths.index.get_meta('previous_shard_layout') == '1x2'
+
+    paths.index.remove(SHA_KEY)
+    assert paths.reshard(ShardLayout(2, 2), wait=0) == 0
+    assert paths.index.get_meta('previous_shard_layout') is None
@@ -0,0 +1,80 @@
+"""
+Unit tests for tar_stream module [pytest]
+"""
+import io
+import tarfile
+import pytest
+from multipart import PART_BEGIN, PART_DATA, PART_END
+from tar_stream import TarParser, TarError
+
+LONG_NAME = 'dir/' + 'long-name-' * 15 + '.bin'
+FILES = [('a.txt', b'first file'), (LONG_NAME, b'x' * 1500),
+         ('empty', b'')]
+
+
+def make_archive(tar_format):
+    """
+    Archive with a directory and FILES in the given format
+    """
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w', format=tar_format) as tar:
+        directory = tarfile.TarInfo('dir')
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory)
+        for name, data in FILES:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return stream.getvalue()
+
+
+def parse(archive, chunk_size):
+    """
+    Feed archive by chunks and collect files as (name, data)
+    """
+    parser = TarParser()
+    files = []
+    for position in range(0, len(archive), chunk_size):
+        for event, value in parser.feed(
+                archive[position:position + chunk_size]):
+            if event == PART_BEGIN:
+                files.append([value, b''])
+            elif event == PART_DATA:
+                files[-1][1] += value
+            else:
+                assert event == PART_END
+    return parser, [tuple(file) for file in files]
+
+
+@pytest.mark.parametrize('tar_format', [tarfile.GNU_FORMAT,
+                                        tarfile.PAX_FORMAT])
+@pytest.mark.parametrize('chunk_size', [1, 7, 512, 100000])
+def test_files_are_found_in_any_chunking(tar_format, chunk_size):
+    """
+    Regular files with long names are found, directories are skipped
+    """
+    parser, files = parse(make_archive(tar_format), chunk_size)
+
+    assert parser.done
+    assert files == FILES
+
+
+def test_truncated_archive_is_not_done():
+    """
+    Archive without end blocks is not complete
+    """
+    parser, files = parse(make_archive(tarfile.GNU_FORMAT)[:2048], 512)
+
+    assert not parser.done
+    assert files[0] == FILES[0]
+
+
+def test_invalid_header_checksum():
+    """
+    Corrupted header is rejected
+    """
+    archive = bytearray(make_archive(tarfile.GNU_FORMAT))
+    archive[0] ^= 1
+
+    with pytest.raises(TarError):
+        TarParser().feed(bytes(archive))
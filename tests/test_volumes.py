@@ -0,0 +1,97 @@
+"""
+Unit tests for volumes module [pytest]
+"""
+import os
+from hashlib import md5
+from file_index import FileIndex, get_index
+from post_handler import create_staging_file, serve_post_request
+from volumes import VolumeManager, enable_volumes
+
+LOW_HASH = '00' + 'a' * 30
+HIGH_HASH = 'ff' + 'a' * 30
+
+
+def make_volumes(tmp_path, placement='space'):
+    storage_dir = str(tmp_path) + '/store/'
+    volume_dir = str(tmp_path) + '/disk2/'
+    os.makedirs(storage_dir)
+    os.makedirs(volume_dir)
+    return VolumeManager(storage_dir, [volume_dir], placement,
+                         FileIndex(storage_dir))
+
+
+def store_file(path, content=b'content'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file_stream:
+        file_stream.write(content)
+
+
+def test_placement_and_resolve(tmp_path):
+    """
+    Hash placement splits keys by range, space placement keeps the file on
+    the volume where it was received; reads go to the claimed volume
+    """
+    volumes = make_volumes(tmp_path, 'hash')
+    storage_dir, volume_dir = volumes.volumes
+    assert volumes.target_volume(LOW_HASH, '') == storage_dir
+    assert volumes.target_volume(HIGH_HASH, '') == volume_dir
+    assert volumes.staging_volume() in volumes.volumes
+
+    volumes.placement = 'space'
+    temp_file = volume_dir + '.staging/upload.data'
+    assert volumes.target_volume(LOW_HASH, temp_file) == volume_dir
+    assert volumes.file_path(LOW_HASH, volume_dir) == \
+        volume_dir + '00/' + LOW_HASH
+
+    assert volumes.claim(LOW_HASH, volume_dir)
+    assert not volumes.claim(LOW_HASH, storage_dir)
+    assert volumes.resolve(LOW_HASH) == volume_dir + '00/' + LOW_HASH
+    assert volumes.resolve(HIGH_HASH) == storage_dir + 'ff/' + HIGH_HASH
+
+
+def test_index_is_recovered_from_volumes(tmp_path):
+    """
+    A new index finds files of extra volumes and their volumes
+    """
+    volumes = make_volumes(tmp_path)
+    storage_dir, volume_dir = volumes.volumes
+    store_file(storage_dir + 'ff/' + HIGH_HASH)
+    store_file(volume_dir + '00/' + LOW_HASH)
+    store_file(volume_dir + '00/' + LOW_HASH + '.gzip', b'gz')
+
+    assert volumes.recover() == 2
+    assert volumes.recover() == 0
+    assert volumes.index.lookup_volume(LOW_HASH) == volume_dir
+    assert volumes.index.variants(LOW_HASH) == {'gzip': 2}
+    stats = volumes.stats()
+    assert stats[storage_dir]['objects'] == 1
+    assert stats[volume_dir]['objects'] == 1
+    assert stats[volume_dir]['free_bytes'] > 0
+
+
+def test_upload_is_copied_to_its_volume(tmp_path):
+    """
+    With hash placement a file received on another volume is copied to
+    the volume of its hash range
+    """
+    storage_dir = str(tmp_path) + '/store/'
+    volume_dir = str(tmp_path) + '/disk2/'
+    volumes = enable_volumes(storage_dir, [volume_dir], 'hash')
+    for number in range(8):
+        content = 'file {}'.format(number).encode()
+        file_hash = md5(content).hexdigest()
+        temp_file = create_staging_file(storage_dir)
+        with open(temp_file, 'wb') as file_stream:
+            file_stream.write(content)
+
+        assert serve_post_request(file_hash, storage_dir, temp_file) == \
+            (file_hash, 200)
+        target = volumes.target_volume(file_hash, temp_file)
+        assert volumes.resolve(file_hash).startswith(target)
+        with open(volumes.resolve(file_hash), 'rb') as file_stream:
+            assert file_stream.read() == content
+        assert not os.listdir(storage_dir + '.staging/')
+        assert not os.path.isdir(volume_dir + '.staging/') or \
+            not os.listdir(volume_dir + '.staging/')
+    assert get_index(storage_dir).stats()['objects'] == 8
+    assert len(os.listdir(volume_dir)) > 1
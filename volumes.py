@@ -0,0 +1,221 @@
+"""
+Хранилище на нескольких томах (дисках)
+
+Кроме основного каталога хранилища (store/) файлы могут лежать в
+каталогах других томов, у каждого свои каталоги шардирования
+(storage_paths) и свой каталог временных файлов. Индекс и pack-файлы
+остаются в основном каталоге, а для каждого файла в индексе записано, на
+каком томе он лежит, поэтому файл отдается с его тома без поиска по
+всем томам.
+
+Том для нового файла выбирается одним из способов (placement):
+'space' - том выбирается при начале загрузки случайно с весом по
+свободному месту, и файл остается на томе, куда он был получен, поэтому
+загрузки и скачивания распределяются по дискам без копирования;
+'hash' - том определяется диапазоном хэша файла, и файл, полученный на
+другом томе, копируется на свой том
+"""
+import os
+import random
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+from file_hashing import split_hash_key
+from file_index import DEFAULT_STORAGE_DIR, FileIndex, get_index
+from storage_paths import StoragePaths
+
+PLACEMENTS = ('space', 'hash')
+DEFAULT_PLACEMENT = 'space'
+
+
+def free_space(volume_dir: str) -> int:
+    """
+    Свободное место на томе в байтах, 0 - том недоступен
+    """
+    try:
+        fs_stat = os.statvfs(volume_dir)
+    except OSError:
+        return 0
+    return fs_stat.f_bavail * fs_stat.f_frsize
+
+
+def parse_volume_dirs(value: str) -> Tuple[str, ...]:
+    """
+    Каталоги томов из списка через запятую: абсолютные пути с '/' в конце
+    """
+    return tuple(os.path.abspath(volume_dir.strip()) + '/'
+                 for volume_dir in value.split(',') if volume_dir.strip())
+
+
+class VolumeManager:
+    """
+    Тома одного хранилища: первый - основной каталог storage_dir
+
+    index - индекс хранилища, по умолчанию file_index.get_index
+    """
+
+    def __init__(self, storage_dir: str, volume_dirs: Iterable[str] = (),
+                 placement: str = DEFAULT_PLACEMENT,
+                 index: Optional[FileIndex] = None):
+        if placement not in PLACEMENTS:
+            raise ValueError("Unknown placement: {}".format(placement))
+        self.storage_dir = storage_dir
+        self.volumes: List[str] = [storage_dir] + [
+            volume_dir for volume_dir in volume_dirs
+            if volume_dir != storage_dir]
+        self.placement = placement
+        self._index = index
+        self._paths: Dict[str, StoragePaths] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> FileIndex:
+        return self._index or get_index(self.storage_dir)
+
+    def paths(self, volume_dir: str) -> StoragePaths:
+        """
+        Пути к файлам тома (схема шардирования - общая для всех томов)
+        """
+        with self._lock:
+            paths = self._paths.get(volume_dir)
+            if paths is None:
+                paths = StoragePaths(volume_dir, self.index)
+                self._paths[volume_dir] = paths
+            return paths
+
+    def staging_volume(self) -> str:
+        """
+        Том, на который принимается загружаемый файл: с вероятностью,
+        пропорциональной свободному месту
+        """
+        if len(self.volumes) == 1:
+            return self.storage_dir
+        weights = [free_space(volume_dir) for volume_dir in self.volumes]
+        if not any(weights):
+            return self.storage_dir
+        return random.choices(self.volumes, weights=weights)[0]
+
+    def target_volume(self, file_hash: str, temp_file: str) -> str:
+        """
+        Том для нового файла
+        """
+        if self.placement == 'hash' and len(self.volumes) > 1:
+            hash_range = int(split_hash_key(file_hash)[1][:8], 16)
+            return self.volumes[hash_range * len(self.volumes) >> 32]
+        return self.volume_of(temp_file)
+
+    def volume_of(self, file_abs_path: str) -> str:
+        """
+        Том, в каталоге которого лежит файл
+        """
+        for volume_dir in sorted(self.volumes, key=len, reverse=True):
+            if file_abs_path.startswith(volume_dir):
+                return volume_dir
+        return self.storage_dir
+
+    def file_path(self, file_hash: str, volume_dir: str) -> str:
+        """
+        Путь для нового файла на томе
+        """
+        return self.paths(volume_dir).file_path(file_hash)
+
+    def claim(self, file_hash: str, volume_dir: str) -> bool:
+        """
+        Записываем в индекс том нового файла
+
+        :return: False - файл с таким ключом уже сохранен на другом томе
+        (параллельная загрузка того же содержимого)
+        """
+        if len(self.volumes) == 1:
+            return True
+        return self.index.claim_volume(file_hash, volume_dir)
+
+    def resolve(self, file_hash: str) -> str:
+        """
+        Путь к файлу из хранилища на его томе
+        """
+        volume_dir = self.storage_dir
+        if len(self.volumes) > 1:
+            volume_dir = self.index.lookup_volume(file_hash) or volume_dir
+        return self.paths(volume_dir).resolve(file_hash)
+
+    def remove_empty_dirs(self, file_abs_path: str):
+        """
+        Удаляем каталоги удаленного файла на его томе, в которых не
+        осталось файлов
+        """
+        self.paths(self.volume_of(file_abs_path)).remove_empty_dirs(
+            file_abs_path)
+
+    def recover(self) -> int:
+        """
+        Заполняем индекс заново по файлам всех томов, если индекс не знает,
+        что на дополнительных томах есть файлы (индекс создан заново)
+
+        :return: количество найденных файлов, 0 - индекс не изменился
+        """
+        if len(self.volumes) == 1 or self.index.volume_counts():
+            return 0
+        for volume_dir in self.volumes[1:]:
+            if os.path.isdir(volume_dir) and any(
+                    not name.startswith('.')
+                    for name in os.listdir(volume_dir)):
+                return self.index.rebuild(self.volumes[1:])
+        return 0
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Счетчики для GET /stats: количество файлов и место на каждом томе
+        """
+        counts = self.index.volume_counts()
+        placed = sum(counts.values())
+        result = {}
+        for volume_dir in self.volumes:
+            fs_stat = os.statvfs(volume_dir) if os.path.isdir(volume_dir) \
+                else None
+            result[volume_dir] = {
+                'objects': counts.get(volume_dir, 0),
+                'free_bytes': free_space(volume_dir),
+                'total_bytes': fs_stat.f_blocks * fs_stat.f_frsize
+                if fs_stat else 0}
+        # Файлы, сохраненные до подключения томов, лежат в основном каталоге
+        result[self.storage_dir]['objects'] += \
+            self.index.stats()['objects'] - placed
+        return result
+
+
+_volumes: Optional[VolumeManager] = None
+_volumes_lock = threading.Lock()
+
+
+def get_volumes(storage_dir: Optional[str] = None) -> VolumeManager:
+    """
+    Тома хранилища storage_dir (по умолчанию - открытого последним или
+    DEFAULT_STORAGE_DIR); пока тома не подключены, том один - сам
+    каталог хранилища
+    """
+    global _volumes  # pylint: disable=global-statement
+    with _volumes_lock:
+        if storage_dir is None:
+            storage_dir = _volumes.storage_dir if _volumes else \
+                DEFAULT_STORAGE_DIR
+        if _volumes is None or _volumes.storage_dir != storage_dir:
+            _volumes = VolumeManager(storage_dir)
+        return _volumes
+
+
+def enable_volumes(storage_dir: str, volume_dirs: Iterable[str],
+                   placement: str = DEFAULT_PLACEMENT) -> VolumeManager:
+    """
+    Подключаем дополнительные тома хранилища
+    """
+    global _volumes  # pylint: disable=global-statement
+    volumes = VolumeManager(storage_dir, volume_dirs, placement)
+    for volume_dir in volumes.volumes:
+        os.makedirs(volume_dir, exist_ok=True)
+    with _volumes_lock:
+        _volumes = volumes
+    if volumes.recover():
+        logger.info("File index was rebuilt from {} volumes",
+                    len(volumes.volumes))
+    return volumes